@@ -18,8 +18,9 @@ interface OptimizationResponse {
     eligible: boolean;
     status: string;
     fitness_days_left: number;
-    reasons: string;
-    recommendations: string;
+    reasons: string[];
+    recommendations: string[];
+    reason_codes: number[];
     cleaning: {
       last_clean_end: string | null;
       clean_age_hours: number;
@@ -1,14 +1,131 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from contextlib import asynccontextmanager
+from functools import partial
+from fastapi import (
+    Body,
+    Depends,
+    FastAPI,
+    File,
+    Form,
+    Header,
+    Query,
+    UploadFile,
+    HTTPException,
+)
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 import pandas as pd
-import io
 from typing import Optional
 import os
-import re
+import shutil
+import tempfile
+import threading
+import time
 import numpy as np
 
-app = FastAPI(title="Galactus Ranking API")
+from .batch import depots_from_dir, extract_archive
+from .cleaning import SHIFT_HOURS, CleaningJobs
+from .explain import explain_trains
+from .cache import DEFAULT_DISK_BYTES, ResultCache, result_key
+from .datasets import Dataset, DatasetRegistry
+from .horizon import DEFAULT_NIGHTS, MAX_NIGHTS, plan_horizon
+from .ingest import read_input, stream_features
+from .jobs import FAILED, JobQueue, QueueFull
+from .metrics import (
+    PROMETHEUS_CONTENT_TYPE,
+    REGISTRY,
+    attach_spans,
+    current_trace,
+    load_profile,
+    observe_request,
+    observe_spans,
+    profile_call,
+    render_metrics,
+    save_profile,
+    server_timing,
+    span,
+    tracing,
+)
+from .mileage_store import MileageStore
+from .planner import (
+    DEFAULT_TIME_BUDGET,
+    MAINTENANCE,
+    MAX_TIME_BUDGET,
+    cleaning_bookings,
+    plan_induction,
+)
+from .reasons import fleet_context, reason_codes
+from .scenarios import DEFAULT_TOP_N, WEIGHT_NAMES, sweep
+from .scoring import (
+    DEFAULT_STANDBY,
+    INDUCT,
+    PLANNING_TIME,
+    STANDBY,
+    build_features,
+    compute_scores,
+    rank_top_k,
+    rank_trains,
+    resolve_weights,
+)
+from .serialize import (
+    JSON,
+    NDJSON,
+    NDJSON_MEDIA_TYPE,
+    build_rows,
+    dumps,
+    iter_ndjson,
+    loads,
+    parse_fields,
+    result_columns,
+    select_view,
+)
+from .snapshot import SnapshotReader, publish
+from .state import FleetState
+from .work_orders import read_events
+
+
+class InputError(ValueError):
+    """Raised when required inputs are missing or unreadable"""
+
+
+# Optimizations run in worker processes behind a bounded queue
+MAX_JOB_WAIT_SECONDS = 60
+job_queue = JobQueue(
+    max_workers=int(os.environ.get("GALACTUS_WORKERS", 0)) or None,
+    max_pending=int(os.environ.get("GALACTUS_MAX_PENDING_JOBS", 0)) or None,
+)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    job_queue.shutdown(wait=False)
+
+
+app = FastAPI(title="Galactus Ranking API", lifespan=lifespan)
+
+# Fleet state kept between requests for incremental re-ranking
+STATE_PATH = os.environ.get("GALACTUS_STATE_PATH")
+fleet_state = None
+state_lock = threading.Lock()
+
+# Odometer history kept across runs; this process is its only writer
+MILEAGE_STORE_DIR = os.environ.get("GALACTUS_MILEAGE_STORE")
+mileage_writer = None
+
+# Content-addressed cache of encoded /api/run-optimization responses
+result_cache = ResultCache(
+    disk_dir=os.environ.get(
+        "GALACTUS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "galactus-cache")
+    ),
+    max_disk_bytes=int(os.environ.get("GALACTUS_CACHE_DISK_BYTES", DEFAULT_DISK_BYTES)),
+)
+
+# Parsed uploads kept under GALACTUS_DATASET_DIR, referenced by dataset ID
+datasets = DatasetRegistry()
+
+# Latest ranking, shared with the other API workers under GALACTUS_SNAPSHOT_DIR
+snapshots = SnapshotReader()
 
 app.add_middleware(
     CORSMiddleware,
@@ -18,6 +135,50 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def record_timings(request, call_next):
+    """Trace every request: latency histogram plus a `Server-Timing` header"""
+    with tracing() as trace:
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+        finally:
+            elapsed = time.perf_counter() - start
+            route = request.scope.get("route")
+            observe_request(
+                request.method, getattr(route, "path", "unmatched"), status, elapsed
+            )
+            observe_spans(trace.spans)
+    response.headers["Server-Timing"] = server_timing(trace.all_spans(), elapsed)
+    return response
+
+
+@REGISTRY.collector
+def service_metrics():
+    return [
+        (
+            "galactus_jobs_pending",
+            "gauge",
+            "Jobs queued or running",
+            job_queue.pending(),
+        ),
+        (
+            "galactus_result_cache_hits_total",
+            "counter",
+            "Result cache lookups answered from the cache",
+            result_cache.hits,
+        ),
+        (
+            "galactus_result_cache_misses_total",
+            "counter",
+            "Result cache lookups that had to compute",
+            result_cache.misses,
+        ),
+    ]
+
+
 @app.get("/")
 def read_root():
     return {"message": "Galactus Ranking API is running"}
@@ -28,20 +189,130 @@ def health_check():
     return {"status": "healthy"}
 
 
-def safe_read_csv_from_upload(upload_file: UploadFile):
-    """Read CSV from uploaded file"""
-    if not upload_file or not upload_file.filename:
+@app.get("/api/metrics")
+def metrics():
+    """Request and stage latency histograms in the Prometheus text format"""
+    return Response(content=render_metrics(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
+@app.get("/api/profiles/{profile_id}")
+def get_profile(profile_id: str, top: int = Query(40, ge=1, le=1000)):
+    """Spans and hottest functions of a run made with `profile=true`"""
+    report = load_profile(profile_id, top=top)
+    if report is None:
+        raise HTTPException(status_code=404, detail=f"Unknown profile: {profile_id}")
+    return report
+
+
+def safe_read_source(source, kind=None):
+    """Read a CSV, Parquet or Arrow IPC table from a path or file object.
+
+    Only the columns declared for `kind` are read, CSV ones with their
+    declared types.
+    """
+    if source is None:
         return None
 
     try:
-        content = upload_file.file.read()
-        upload_file.file.seek(0)  # Reset file pointer for potential re-reading
-        return pd.read_csv(io.StringIO(content.decode("utf-8")))
+        with span(f"read_{kind or 'source'}") as s:
+            # Parsed straight from the (spooled) file, pruned to the
+            # columns the scorer uses; the file pointer is left at the start
+            df = read_input(source, kind)
+            s.rows = len(df)
+        return df
     except Exception as e:
-        print(f"Error reading {upload_file.filename}: {str(e)}")
+        print(f"Error reading {kind or source}: {str(e)}")
         return None
 
 
+def current_state():
+    """The kept fleet state, loaded from `STATE_PATH` on first use"""
+    global fleet_state
+    if fleet_state is None and STATE_PATH and os.path.exists(STATE_PATH):
+        fleet_state = FleetState.load(STATE_PATH)
+    return fleet_state
+
+
+def publish_ranking(body, key=None):
+    """Publish an encoded ranking as the latest snapshot, unless it is already.
+
+    A failure is logged; the request that produced the ranking still
+    succeeds.
+    """
+    try:
+        latest = snapshots.latest()
+    except Exception:
+        # An unreadable snapshot is replaced by publishing over it
+        latest = None
+    if key is not None and latest is not None and latest.key == key:
+        return
+    try:
+        with span("publish_snapshot"):
+            publish(body, key, snapshots.root)
+    except Exception as e:
+        print(f"Error publishing ranking snapshot: {str(e)}")
+
+
+def publish_state(state):
+    """Make `state` the kept fleet state and persist it if configured"""
+    global fleet_state
+    fleet_state = state
+    if STATE_PATH:
+        state.save(STATE_PATH)
+
+
+def kept_mileage_store():
+    """The kept odometer history open for appending; None unless configured"""
+    global mileage_writer
+    if mileage_writer is None and MILEAGE_STORE_DIR:
+        mileage_writer = MileageStore(MILEAGE_STORE_DIR)
+    return mileage_writer
+
+
+def mileage_history():
+    """The kept odometer history as last published, for reading in a job"""
+    return MileageStore(MILEAGE_STORE_DIR) if MILEAGE_STORE_DIR else None
+
+
+def upload_source(upload_file: UploadFile):
+    """Return the spooled file behind an upload for chunked reading.
+
+    A referenced dataset is read from its stored Arrow file.
+    """
+    if isinstance(upload_file, Dataset):
+        return upload_file.path
+    if not upload_file or not upload_file.filename:
+        return None
+    upload_file.file.seek(0)
+    return upload_file.file
+
+
+def rank_features(features, scores=None, top_k=None, standby=DEFAULT_STANDBY):
+    """Rank an assembled per-train feature frame and attach reason codes.
+
+    With `top_k` only the `top_k` best eligible trains and `standby` more
+    are selected and returned; thresholds still use the whole fleet.
+    """
+    if scores is None:
+        with span("compute_scores", rows=len(features)):
+            scores = compute_scores(features)
+    if top_k is not None:
+        with span("rank", rows=len(features)):
+            df, feature_scores = rank_top_k(features, top_k, standby, scores=scores)
+        with span("reason_codes", rows=len(df)):
+            df["reason_mask"] = reason_codes(df, context=fleet_context(features))
+        return df
+
+    with span("rank", rows=len(features)):
+        df, feature_scores = rank_trains(features, scores=scores)
+
+    # Reason codes only; text is rendered for the rows that are returned
+    with span("reason_codes", rows=len(df)):
+        df["reason_mask"] = reason_codes(df)
+
+    return df
+
+
 def process_train_optimization(
     fitness_df,
     wo_df,
@@ -50,414 +321,524 @@ def process_train_optimization(
     cleaning_df,
     stabling_df=None,
     cleaning_df_prev=None,
+    top_k=None,
+    standby=DEFAULT_STANDBY,
+    mileage_store=None,
 ):
-    """Process train optimization logic"""
-
-    PLANNING_TIME = pd.Timestamp("2025-09-01T21:00:00")
+    """Process train optimization logic
+
+    With `top_k` only the winners and `standby` trains are returned; a
+    `mileage_store` adds its odometer history to the mileage log.
+    """
+
+    features = build_features(
+        fitness_df,
+        wo_df,
+        branding_df,
+        mileage_df,
+        cleaning_df,
+        stabling_df=stabling_df,
+        cleaning_df_prev=cleaning_df_prev,
+        mileage_store=mileage_store,
+    )
+    return rank_features(features, top_k=top_k, standby=standby)
 
-    # Collect all train IDs
-    all_train_ids = set()
-    for df in [fitness_df, wo_df, branding_df, mileage_df, cleaning_df]:
-        if df is not None and "train_id" in df.columns:
-            all_train_ids.update(df["train_id"].dropna().unique())
 
-    if stabling_df is not None and "train_id" in stabling_df.columns:
-        all_train_ids.update(stabling_df["train_id"].dropna().unique())
+def build_response(result_df, message="Optimization completed successfully"):
+    """Serialize a ranked frame into the API response body.
 
-    all_trains = sorted(list(all_train_ids))
-    if len(all_trains) == 0:
-        raise ValueError(
-            "No train IDs found in provided files. Ensure `train_id` column is present in your CSVs."
+    A top-K frame lists its winners under `results` and the standby
+    trains under `standby`, with fleet-wide totals.
+    """
+    if "role" not in result_df.columns:
+        return {
+            "success": True,
+            "message": message,
+            "total_trains": len(result_df),
+            "eligible_trains": int(result_df["eligible"].sum()),
+            "results": build_rows(result_columns(result_df)),
+        }
+    standby = result_df["role"].to_numpy() == STANDBY
+    return {
+        "success": True,
+        "message": message,
+        "total_trains": result_df.attrs["total_trains"],
+        "eligible_trains": result_df.attrs["eligible_trains"],
+        "top_k": result_df.attrs["top_k"],
+        "shunt_moves": result_df.attrs["shunt_moves"],
+        "results": build_rows(result_columns(result_df, np.flatnonzero(~standby))),
+        "standby": build_rows(result_columns(result_df, np.flatnonzero(standby))),
+    }
+
+
+def read_sources(sources, streaming=False):
+    """Parse the inputs and check that the required ones are present.
+
+    `sources` maps upload field names to paths or seekable file objects
+    (None for inputs that were not supplied). With `streaming` the history
+    inputs are returned unread for chunked reading.
+    """
+    # Read input files
+    if streaming:
+        fitness_df = sources["fitness_certificates_"]
+        wo_df = sources["work_order_maximo_"]
+        mileage_df = sources["mileage_logs_"]
+    else:
+        fitness_df = safe_read_source(
+            sources["fitness_certificates_"], "fitness_certificates"
         )
+        wo_df = safe_read_source(sources["work_order_maximo_"], "work_order_maximo")
+        mileage_df = safe_read_source(sources["mileage_logs_"], "mileage_logs")
+    branding_df = safe_read_source(sources["branding_schedule_"], "branding_schedule")
+    cleaning_df = safe_read_source(sources["cleaning_schedule_"], "cleaning_schedule")
+    stabling_df = safe_read_source(sources["stabling_layout_"], "stabling_layout")
+    cleaning_df_prev = safe_read_source(
+        sources["cleaning_schedule_prev_"], "cleaning_schedule_prev"
+    )
+
+    # Validate required files
+    required_files = {
+        "fitness_certificates": fitness_df,
+        "work_order_maximo": wo_df,
+        "branding_schedule": branding_df,
+        "mileage_logs": mileage_df,
+        "cleaning_schedule": cleaning_df,
+    }
+
+    missing_files = [name for name, df in required_files.items() if df is None]
+    if missing_files:
+        raise InputError(f"Required CSV files missing: {missing_files}")
+    return (
+        fitness_df,
+        wo_df,
+        branding_df,
+        mileage_df,
+        cleaning_df,
+        stabling_df,
+        cleaning_df_prev,
+    )
 
-    df = pd.DataFrame({"train_id": all_trains})
 
-    # Process fitness certificates
-    if fitness_df is not None and not fitness_df.empty:
-        fitness_df["valid_to_dt"] = pd.to_datetime(
-            fitness_df["valid_to"], errors="coerce"
+def optimize_sources(
+    sources,
+    streaming=False,
+    keep_state=False,
+    top_k=None,
+    standby=DEFAULT_STANDBY,
+    mileage_store=None,
+):
+    """Parse the inputs and rank the fleet.
+
+    `sources` maps upload field names to paths or seekable file objects
+    (None for inputs that were not supplied). A `mileage_store` adds its
+    odometer history to the uploaded mileage log.
+    """
+    (
+        fitness_df,
+        wo_df,
+        branding_df,
+        mileage_df,
+        cleaning_df,
+        stabling_df,
+        cleaning_df_prev,
+    ) = read_sources(sources, streaming)
+
+    # Run optimization
+    if streaming:
+        features = stream_features(
+            fitness_df,
+            wo_df,
+            branding_df,
+            mileage_df,
+            cleaning_df,
+            stabling_df=stabling_df,
+            cleaning_df_prev=cleaning_df_prev,
+            mileage_store=mileage_store,
         )
-        fitness_min = (
-            fitness_df.groupby("train_id")["valid_to_dt"]
-            .min()
-            .reset_index()
-            .rename(columns={"valid_to_dt": "fitness_valid_till"})
+        return rank_features(features, top_k=top_k, standby=standby)
+    if keep_state:
+        with span("build_state"):
+            state = FleetState.from_frames(
+                fitness_df,
+                wo_df,
+                branding_df,
+                mileage_df,
+                cleaning_df,
+                stabling_df=stabling_df,
+                cleaning_df_prev=cleaning_df_prev,
+                mileage_store=mileage_store,
+            )
+        with state_lock:
+            publish_state(state)
+        return rank_features(
+            state.features, scores=state.scores, top_k=top_k, standby=standby
         )
-        df = df.merge(fitness_min, on="train_id", how="left")
-        df["fitness_days_left"] = (df["fitness_valid_till"] - PLANNING_TIME).dt.days
-    else:
-        df["fitness_days_left"] = 0
+    return process_train_optimization(
+        fitness_df=fitness_df,
+        wo_df=wo_df,
+        branding_df=branding_df,
+        mileage_df=mileage_df,
+        cleaning_df=cleaning_df,
+        stabling_df=stabling_df,
+        cleaning_df_prev=cleaning_df_prev,
+        top_k=top_k,
+        standby=standby,
+        mileage_store=mileage_store,
+    )
 
-    df["fitness_days_left"] = df["fitness_days_left"].fillna(-9999).clip(lower=0)
 
-    def fitness_priority(days_left):
-        if days_left < 0:
-            return 0.0
-        return 1.0 / (1.0 + days_left)
+def encode_response(content):
+    """Encode a response body as compact UTF-8 JSON"""
+    return dumps(content)
 
-    df["fitness_priority_raw"] = df["fitness_days_left"].apply(fitness_priority)
 
-    # Process work orders
-    if wo_df is not None and not wo_df.empty:
-        wo_df["status_norm"] = wo_df["status"].str.lower().fillna("")
-        wo_open = wo_df[wo_df["status_norm"].str.contains("open", na=False)]
+def result_view(
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=0),
+    fields: Optional[str] = None,
+    format: str = Query(JSON, pattern=f"^({JSON}|{NDJSON})$"),
+):
+    """Pagination, field selection and format of a ranking response"""
+    try:
+        selected = parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"offset": offset, "limit": limit, "fields": selected, "format": format}
 
-        open_counts = wo_open.groupby("train_id").size().rename("open_wo_count")
-        open_hours = (
-            wo_open.groupby("train_id")["estimated_hours"]
-            .sum(min_count=1)
-            .rename("open_wo_hours")
-        )
 
-        wo_summary = (
-            pd.concat([open_counts, open_hours], axis=1).reset_index().fillna(0)
-        )
-        wo_summary["open_wo_count"] = wo_summary["open_wo_count"].astype(int)
-        wo_summary["open_wo_hours"] = wo_summary["open_wo_hours"].astype(float)
-        df = df.merge(wo_summary, on="train_id", how="left")
-
-    df[["open_wo_count", "open_wo_hours"]] = df[
-        ["open_wo_count", "open_wo_hours"]
-    ].fillna(0)
-
-    # Process branding schedule
-    if branding_df is not None and not branding_df.empty:
-        branding_df["start_date_dt"] = pd.to_datetime(
-            branding_df["start_date"], errors="coerce"
-        ).dt.date
-        branding_df["end_date_dt"] = pd.to_datetime(
-            branding_df["end_date"], errors="coerce"
-        ).dt.date
-        today_date = PLANNING_TIME.date()
-        branding_df["active"] = (
-            (~branding_df["start_date_dt"].isna())
-            & (~branding_df["end_date_dt"].isna())
-            & (branding_df["start_date_dt"] <= today_date)
-            & (branding_df["end_date_dt"] >= today_date)
-        )
-        active_brand = branding_df[branding_df["active"]].copy()
-        if not active_brand.empty:
-            brand_hours = (
-                active_brand.groupby("train_id")["required_exposure_hours_per_day"]
-                .sum()
-                .rename("branding_hours")
-                .reset_index()
+def render(body, view, headers=None):
+    """Response for a body (encoded bytes or content dict) in the requested view"""
+    with span("render"):
+        if view["format"] == JSON and not (
+            view["offset"] or view["limit"] is not None or view["fields"]
+        ):
+            if not isinstance(body, bytes):
+                body = encode_response(body)
+            return Response(
+                content=body, media_type="application/json", headers=headers
             )
-            df = df.merge(brand_hours, on="train_id", how="left")
-
-    df["branding_hours"] = df["branding_hours"].fillna(0).astype(float)
-
-    # Process mileage logs
-    if mileage_df is not None and not mileage_df.empty:
-        mileage_df["odometer_km"] = pd.to_numeric(
-            mileage_df["odometer_km"], errors="coerce"
-        ).fillna(0)
-        odom = (
-            mileage_df.sort_values("recorded_at")
-            .groupby("train_id")
-            .tail(1)[["train_id", "odometer_km"]]
-            .rename(columns={"odometer_km": "cumulative_km"})
-        )
-        if "delta_km" in mileage_df.columns:
-            delta = (
-                mileage_df.sort_values("recorded_at")
-                .groupby("train_id")
-                .tail(1)[["train_id", "delta_km"]]
+        content = loads(body) if isinstance(body, bytes) else body
+        if "results" not in content:
+            raise HTTPException(
+                status_code=400, detail="This result has no rows to page or select"
+            )
+        content = select_view(content, view["offset"], view["limit"], view["fields"])
+        if view["format"] == NDJSON:
+            return StreamingResponse(
+                iter_ndjson(content), media_type=NDJSON_MEDIA_TYPE, headers=headers
             )
-            df = df.merge(delta, on="train_id", how="left")
-        df = df.merge(odom, on="train_id", how="left")
-
-    df["cumulative_km"] = pd.to_numeric(
-        df["cumulative_km"].fillna(0), errors="coerce"
-    ).astype(float)
-    df["delta_km"] = pd.to_numeric(df["delta_km"].fillna(0), errors="coerce").astype(
-        float
+        return Response(
+            content=encode_response(content),
+            media_type="application/json",
+            headers=headers,
+        )
+
+
+def optimization_job(sources, streaming=False, top_k=None, standby=DEFAULT_STANDBY):
+    """Job body run in a worker process; returns the encoded response"""
+    result_df = optimize_sources(
+        sources,
+        streaming,
+        top_k=top_k,
+        standby=standby,
+        mileage_store=mileage_history(),
     )
+    return serialize_response(build_response, result_df)
 
-    # Process previous cleaning schedule
-    if cleaning_df_prev is not None and not cleaning_df_prev.empty:
-        cleaning_df_prev["scheduled_end_dt"] = pd.to_datetime(
-            cleaning_df_prev["scheduled_end"], errors="coerce"
-        )
-        last_clean = (
-            cleaning_df_prev.sort_values("scheduled_end_dt")
-            .groupby("train_id")
-            .tail(1)[["train_id", "scheduled_end_dt"]]
-            .copy()
-        )
-        df = df.merge(
-            last_clean.rename(columns={"scheduled_end_dt": "last_clean_end"}),
-            on="train_id",
-            how="left",
-        )
-        df["clean_age_hours"] = (
-            PLANNING_TIME - df["last_clean_end"]
-        ).dt.total_seconds() / 3600.0
-    else:
-        df["clean_age_hours"] = 99999.0
 
-    df["clean_age_hours"] = df["clean_age_hours"].fillna(99999.0)
-    df["clean_freshness_raw"] = (
-        1.0 - (np.minimum(df["clean_age_hours"], 72.0) / 72.0)
-    ).clip(0.0, 1.0)
+def serialize_response(build, *args):
+    """Build and encode a response body, timing each step"""
+    with span("build_response"):
+        content = build(*args)
+    with span("encode"):
+        return encode_response(content)
 
-    # Process current cleaning schedule
-    type_duration_mins = {"daily": 15, "outside_cleaning": 120, "heavy": 180}
 
-    if cleaning_df is not None and not cleaning_df.empty:
-        start_window = PLANNING_TIME
-        end_window = PLANNING_TIME + pd.Timedelta(hours=24)
-        cleaning_df["scheduled_start_dt"] = pd.to_datetime(
-            cleaning_df["scheduled_start"], errors="coerce"
-        )
-        mask_window = (cleaning_df["scheduled_start_dt"] >= start_window) & (
-            cleaning_df["scheduled_start_dt"] < end_window
-        )
-        today_jobs = cleaning_df[mask_window].copy()
-
-        def duration_hours(row):
-            t = str(row.get("cleaning_type", "")).lower().strip().replace(" ", "_")
-            mins = type_duration_mins.get(t, type_duration_mins["daily"])
-            return float(mins) / 60.0
-
-        if not today_jobs.empty:
-            today_jobs["duration_hours"] = today_jobs.apply(duration_hours, axis=1)
-            today_jobs["manpower_required"] = pd.to_numeric(
-                today_jobs["manpower_required"], errors="coerce"
-            ).fillna(0.0)
-            today_jobs["load"] = (
-                today_jobs["duration_hours"] * today_jobs["manpower_required"]
-            )
-            load_by_train = (
-                today_jobs.groupby("train_id")["load"]
-                .sum()
-                .rename("today_clean_load")
-                .reset_index()
-            )
-        else:
-            load_by_train = pd.DataFrame(columns=["train_id", "today_clean_load"])
-    else:
-        load_by_train = pd.DataFrame(columns=["train_id", "today_clean_load"])
-
-    df = df.merge(load_by_train, on="train_id", how="left")
-    df["today_clean_load"] = df["today_clean_load"].fillna(0.0)
-
-    # Process stabling layout
-    def parse_position(position):
-        if pd.isna(position):
-            return (None, None)
-        pid = str(position).strip()
-        m = re.search(r"(?i)\bline[_\-]?(\d+)[_\-]?pos[_\-]?(\d+)\b", pid)
-        if m:
-            line_num = m.group(1)
-            slot_num = int(m.group(2))
-            return (f"line_{line_num}", int(slot_num))
-        return (pid, None)
-
-    if stabling_df is not None and not stabling_df.empty:
-        pos_map = stabling_df[["train_id", "position"]].dropna()
-        pos_map["parsed"] = pos_map["position"].apply(parse_position)
-        pos_map[["line_id", "slot_idx"]] = pd.DataFrame(
-            pos_map["parsed"].tolist(), index=pos_map.index
-        )
-        df = df.merge(
-            pos_map[["train_id", "position", "line_id", "slot_idx"]],
-            on="train_id",
-            how="left",
-        )
-    else:
-        df["position"] = df["train_id"]
-        df["line_id"] = "default_line"
-        df["slot_idx"] = None
-
-    # Assign slots by group
-    def assign_slots_by_group(g):
-        if g["slot_idx"].notna().any():
-            used = set([int(x) for x in g["slot_idx"].dropna().astype(int).tolist()])
-            next_slot = 0
-            res = []
-            for _, r in g.iterrows():
-                if pd.notna(r["slot_idx"]):
-                    res.append(int(r["slot_idx"]))
-                else:
-                    while next_slot in used:
-                        next_slot += 1
-                    res.append(next_slot)
-                    used.add(next_slot)
-            g["slot_idx_assigned"] = res
-        else:
-            g = g.sort_values(by=["position", "train_id"])
-            g["slot_idx_assigned"] = list(range(len(g)))
-        return g
-
-    group_key = (
-        "line_id"
-        if "line_id" in df.columns and df["line_id"].notna().any()
-        else "position"
-    )
-    df[group_key] = df[group_key].fillna(df.get("position", df["train_id"]))
+def horizon_job(sources, start=PLANNING_TIME, nights=DEFAULT_NIGHTS):
+    """Job body for a multi-night horizon; returns the encoded response"""
+    frames = read_sources(sources)
+    with span("plan_horizon", rows=nights):
+        summary, rankings = plan_horizon(*frames, start=start, nights=nights)
+    return serialize_response(build_horizon_response, summary, rankings)
 
-    assigned = (
-        df.groupby(group_key, group_keys=False)
-        .apply(assign_slots_by_group, include_groups=False)
-        .reset_index(drop=True)
-    )
-    if "slot_idx_assigned" in assigned.columns:
-        assigned["shunt_depth"] = assigned["slot_idx_assigned"].fillna(0).astype(int)
-    else:
-        assigned["shunt_depth"] = 0
-    df = assigned
-
-    max_depth = max(1, int(df["shunt_depth"].max()))
-
-    # Constants for scoring
-    SHUNT_LAMBDA = 0.25
-    W_FITNESS = 0.15
-    W_JOB = 0.20
-    W_BRANDING = 0.25
-    W_MILEAGE = 0.25
-    W_CLEAN = 0.15
-    CLEAN_UPCOMING_ALPHA = 0.8
-
-    def minmax_col(s):
-        s2 = s.copy().astype(float)
-        if s2.isna().all():
-            return s2.fillna(0.0)
-        lo, hi = s2.min(), s2.max()
-        if hi == lo:
-            return pd.Series(0.0, index=s2.index)
-        return (s2 - lo) / (hi - lo)
-
-    # Compute scores
-    feature_scores = pd.DataFrame({"train_id": df["train_id"]})
-    feature_scores["fitness_score"] = minmax_col(df["fitness_priority_raw"])
-    feature_scores["job_score"] = 1.0 - minmax_col(df["open_wo_hours"].astype(float))
-    feature_scores["branding_score"] = minmax_col(df["branding_hours"].astype(float))
-
-    km = df["cumulative_km"].astype(float)
-    km_mean = float(km.mean()) if not km.isna().all() else 0.0
-    max_abs = max(1.0, (km - km_mean).abs().max())
-    feature_scores["mileage_score"] = (1.0 - (km - km_mean).abs() / max_abs).clip(
-        0.0, 1.0
-    )
 
-    df["clean_today_penalty"] = minmax_col(df["today_clean_load"])
-    df["cleaning_score_raw"] = df["clean_freshness_raw"] * (
-        1.0 - CLEAN_UPCOMING_ALPHA * df["clean_today_penalty"]
+def plan_job(
+    sources,
+    service_trains=None,
+    standby=DEFAULT_STANDBY,
+    cleaning_bays=None,
+    manpower=None,
+    branding_share=1.0,
+    time_budget=DEFAULT_TIME_BUDGET,
+):
+    """Job body for an induction plan; returns the encoded response"""
+    frames = read_sources(sources)
+    features = build_features(
+        *frames[:5],
+        stabling_df=frames[5],
+        cleaning_df_prev=frames[6],
+        mileage_store=mileage_history(),
     )
-    df["cleaning_score_raw"] = df["cleaning_score_raw"].clip(0.0, 1.0)
-    df["cleaning_score"] = minmax_col(df["cleaning_score_raw"])
-
-    feature_scores = feature_scores.merge(
-        df[["train_id", "cleaning_score"]], on="train_id", how="left"
+    hours, bays = cleaning_bookings(frames[4], features["train_id"].to_numpy())
+    if cleaning_bays is None:
+        cleaning_bays = bays or None
+    with span("plan_induction", rows=len(features)):
+        df, _ = plan_induction(
+            features,
+            service_trains=service_trains,
+            standby=standby,
+            cleaning_hours=hours,
+            cleaning_bays=cleaning_bays,
+            manpower=manpower,
+            branding_share=branding_share,
+            time_budget=time_budget,
+        )
+    with span("reason_codes", rows=len(df)):
+        df["reason_mask"] = reason_codes(df, context=fleet_context(features))
+    return serialize_response(build_plan_response, df)
+
+
+def build_plan_response(result_df):
+    """Serialize an induction plan: service, standby and maintenance trains"""
+    role = result_df["role"].to_numpy()
+    return {
+        "success": True,
+        "message": "Induction plan completed successfully",
+        **result_df.attrs,
+        "results": build_rows(
+            result_columns(result_df, np.flatnonzero(role == INDUCT))
+        ),
+        "standby": build_rows(
+            result_columns(result_df, np.flatnonzero(role == STANDBY))
+        ),
+        "maintenance": build_rows(
+            result_columns(result_df, np.flatnonzero(role == MAINTENANCE))
+        ),
+    }
+
+
+def build_horizon_response(summary, rankings):
+    """Serialize a horizon plan: one entry per night with its ranking"""
+    nights = len(summary)
+    trains = len(rankings) // nights if nights else 0
+
+    def per_night(values):
+        return np.asarray(values).reshape(nights, trains).tolist()
+
+    train_ids = per_night(rankings["train_id"].astype(str))
+    scores = per_night(rankings["priority_score"].round(4))
+    eligible = per_night(rankings["eligible"])
+    days_left = per_night(rankings["fitness_days_left"].astype(int))
+
+    entries = summary.assign(night=summary["night"].map(pd.Timestamp.isoformat))
+    entries = entries.to_dict(orient="records")
+    for i, entry in enumerate(entries):
+        entry["ranking"] = [
+            {
+                "train_id": t,
+                "priority_score": p,
+                "eligible": e,
+                "fitness_days_left": d,
+            }
+            for t, p, e, d in zip(train_ids[i], scores[i], eligible[i], days_left[i])
+        ]
+    return {
+        "success": True,
+        "message": "Horizon planned successfully",
+        "total_nights": nights,
+        "total_trains": trains,
+        "nights": entries,
+    }
+
+
+def spool_uploads(uploads):
+    """Copy the uploads to temporary files a worker process can open.
+
+    Referenced datasets are already files and are not copied.
+    """
+    spool_dir = tempfile.mkdtemp(prefix="galactus-job-")
+    paths = {}
+    for name, upload in uploads.items():
+        source = upload_source(upload)
+        if source is None or isinstance(upload, Dataset):
+            paths[name] = source
+            continue
+        paths[name] = os.path.join(spool_dir, name.rstrip("_"))
+        with open(paths[name], "wb") as fh:
+            shutil.copyfileobj(source, fh)
+        source.seek(0)
+    return spool_dir, paths
+
+
+def cache_key(sources, **params):
+    """Result cache key for a set of optimization inputs"""
+    store = kept_mileage_store()
+    if store is not None:
+        # Results read the kept odometer history as well as the uploads
+        params["mileage_store"] = store.version
+    return result_key(
+        sources, planning_time=PLANNING_TIME, weights=resolve_weights(), **params
     )
 
-    df["S"] = df["shunt_depth"].astype(float) / float(max_depth)
-    feature_scores["shunt_penalty"] = df["S"]
 
-    df["priority_score"] = (
-        W_FITNESS * feature_scores["fitness_score"]
-        + W_JOB * feature_scores["job_score"]
-        + W_BRANDING * feature_scores["branding_score"]
-        + W_MILEAGE * feature_scores["mileage_score"]
-        + W_CLEAN * feature_scores["cleaning_score"]
-    ) - SHUNT_LAMBDA * feature_scores["shunt_penalty"]
-
-    df["priority_score"] = minmax_col(df["priority_score"])
+def submit_optimization(
+    uploads, streaming=False, top_k=None, standby=DEFAULT_STANDBY, profile=False
+):
+    """Queue an optimization job for the uploads; returns `(job, hit)`.
+
+    Cached results come back as an already finished job, and a request
+    matching a job that is still running joins it instead of queueing
+    another. Raises `QueueFull` when no more jobs can be admitted. Only
+    full rankings are published as the latest ranking; a `top_k` result
+    lists part of the fleet.
+    """
+    if top_k is None:
+        return submit_uploads(
+            uploads, optimization_job, streaming, profile=profile, publish=True
+        )
+    return submit_uploads(
+        uploads,
+        optimization_job,
+        streaming,
+        top_k,
+        standby,
+        profile=profile,
+        top_k=top_k,
+        standby=standby,
+    )
 
-    # Determine eligibility and rank
-    df["eligible"] = (df["fitness_days_left"] > 0) & (df["open_wo_hours"] <= 0)
-    df = df.sort_values(
-        by=["eligible", "priority_score"], ascending=[False, False]
-    ).reset_index(drop=True)
 
-    # Generate reasons and recommendations
-    def safe_mean(series):
-        try:
-            return float(series.mean()) if not series.isna().all() else 0.0
-        except Exception:
-            return 0.0
-
-    avg_fitness_days = safe_mean(df["fitness_days_left"])
-    avg_branding_hours = safe_mean(df["branding_hours"])
-    avg_delta_km = safe_mean(df["delta_km"])
-    avg_clean_age = safe_mean(df["clean_age_hours"])
-    avg_clean_load = safe_mean(df["today_clean_load"])
-    median_position = df["slot_idx"].median() if "slot_idx" in df.columns else 0
-
-    def get_reasons_and_recommendations(row):
-        reasons = []
-        recommendations = []
-
-        if row["fitness_days_left"] <= 0:
-            reasons.append("Expired fitness certificate")
-            recommendations.append("Renew fitness certificate immediately")
-        elif row["fitness_days_left"] < 30:
-            reasons.append(
-                f"Fitness expiring soon ({row['fitness_days_left']:.0f} days)"
-            )
-            recommendations.append("Schedule fitness renewal")
+def submit_uploads(uploads, fn, *args, profile=False, publish=False, **params):
+    """Queue `fn(paths, *args)` over the spooled uploads, cached by content.
+
+    `params` are extra values that change the result and so the cache key.
+    A `profile` run always computes, on its own, under the profiler. With
+    `publish` the result, cached or computed, becomes the latest ranking.
+    """
+    with span("cache_lookup"):
+        key = cache_key(
+            {
+                name: upload if isinstance(upload, Dataset) else upload_source(upload)
+                for name, upload in uploads.items()
+            },
+            **params,
+        )
+        body = None if profile else result_cache.get(key)
+    if body is not None:
+        if publish:
+            publish_ranking(body, key)
+        return job_queue.add_finished(body, key=key), True
+
+    with span("spool_uploads"):
+        spool_dir, paths = spool_uploads(uploads)
+
+    def finished(job):
+        shutil.rmtree(spool_dir, ignore_errors=True)
+        if job.error is None:
+            result_cache.put(key, job.result)
+            if publish:
+                publish_ranking(job.result, key)
 
-        if row["open_wo_count"] > 0:
-            reasons.append(
-                f"Open work orders ({row['open_wo_hours']:.1f} hrs estimated)"
+    try:
+        if profile:
+            job, joined = job_queue.submit(
+                None, profile_call, fn, paths, *args, on_done=finished
             )
-            recommendations.append("Complete pending maintenance work")
+        else:
+            job, joined = job_queue.submit(key, fn, paths, *args, on_done=finished)
+    except BaseException:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+        raise
+    if joined:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+    return job, joined
 
-        if row["branding_hours"] > avg_branding_hours * 1.1:
-            reasons.append(
-                f"High branding exposure required ({row['branding_hours']:.1f} hrs)"
-            )
-            recommendations.append("Prioritize for passenger service")
-        elif row["branding_hours"] < avg_branding_hours * 0.5:
-            recommendations.append("Consider for freight or non-passenger service")
 
-        if row["delta_km"] > avg_delta_km * 1.2:
-            reasons.append(f"High recent mileage ({row['delta_km']:.1f} km)")
-            recommendations.append("Schedule for maintenance check")
+def submit_depots(archive, streaming=False):
+    """Unpack a batch archive and queue one optimization job per depot.
 
-        if row["clean_age_hours"] > 48:
-            reasons.append(
-                f"Long since last cleaning ({row['clean_age_hours']:.1f} hrs ago)"
-            )
-            recommendations.append("Schedule cleaning before service")
+    Returns depot name -> `(job, hit)`. The jobs are admitted together,
+    so a full queue rejects the whole batch with `QueueFull`.
+    """
+    workdir = tempfile.mkdtemp(prefix="galactus-batch-")
+    try:
+        extract_archive(archive, workdir)
+        depots = depots_from_dir(workdir)
+    except BaseException:
+        shutil.rmtree(workdir, ignore_errors=True)
+        raise
 
-        if row["today_clean_load"] > avg_clean_load * 1.2:
-            reasons.append("High cleaning workload scheduled today")
-            recommendations.append(
-                "Consider alternative trains to reduce cleaning bottleneck"
-            )
+    results, entries, names = {}, [], []
+    for depot, sources in depots.items():
+        key = cache_key(sources)
+        body = result_cache.get(key)
+        if body is not None:
+            results[depot] = (job_queue.add_finished(body, key=key), True)
+            continue
+        entries.append((key, optimization_job, (sources, streaming), None))
+        names.append(depot)
+
+    # The extracted files are removed once the last queued depot finishes
+    remaining = [len(entries) + 1]
+    remaining_lock = threading.Lock()
+
+    def release(count=1):
+        with remaining_lock:
+            remaining[0] -= count
+            done = remaining[0] == 0
+        if done:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def finished(job):
+        if job.error is None:
+            result_cache.put(job.key, job.result)
+        release()
+
+    entries = [(key, fn, args, finished) for key, fn, args, _ in entries]
+    try:
+        submitted = job_queue.submit_many(entries)
+    except BaseException:
+        shutil.rmtree(workdir, ignore_errors=True)
+        raise
+    for depot, (job, joined) in zip(names, submitted):
+        results[depot] = (job, joined)
+    release(1 + sum(joined for _, joined in submitted))
+    return {depot: results[depot] for depot in depots}
+
+
+def batch_body(jobs):
+    """Encoded batch response built from each depot's encoded response"""
+    parts = []
+    failed = 0
+    for depot, job in jobs.items():
+        if job.status == FAILED:
+            failed += 1
+            body = encode_response({"success": False, "detail": job_error(job).detail})
+        else:
+            body = job.result
+        parts.append(encode_response(depot) + b":" + body)
+    header = encode_response(
+        {
+            "success": failed == 0,
+            "total_depots": len(jobs),
+            "failed_depots": failed,
+        }
+    )
+    return header[:-1] + b',"depots":{' + b",".join(parts) + b"}}"
 
-        if (
-            "slot_idx" in row
-            and pd.notna(row["slot_idx"])
-            and row["slot_idx"] > median_position
-        ):
-            reasons.append("Requires significant shunting operations")
-            recommendations.append("Plan shunting operations in advance")
 
-        return {
-            "reasons": (
-                " | ".join(reasons)
-                if reasons
-                else "Balanced performance across all metrics"
-            ),
-            "recommendations": (
-                " | ".join(recommendations)
-                if recommendations
-                else "Ready for immediate deployment"
-            ),
-        }
+def job_error(job):
+    """HTTP error for a failed job"""
+    if isinstance(job.error, InputError):
+        return HTTPException(status_code=400, detail=str(job.error))
+    return HTTPException(status_code=500, detail=f"Optimization failed: {job.error}")
 
-    reason_rec = df.apply(get_reasons_and_recommendations, axis=1, result_type="expand")
-    df["reasons"] = reason_rec["reasons"]
-    df["recommendations"] = reason_rec["recommendations"]
 
-    return df
+def queue_full(e):
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
 
 
-@app.post("/api/run-optimization")
-async def run_optimization(
+def upload_form(
     maintainance_: Optional[UploadFile] = File(None),
     fitness_certificates_: Optional[UploadFile] = File(None),
     cleaning_schedule_: Optional[UploadFile] = File(None),
@@ -466,108 +847,539 @@ async def run_optimization(
     mileage_logs_: Optional[UploadFile] = File(None),
     stabling_layout_: Optional[UploadFile] = File(None),
     cleaning_schedule_prev_: Optional[UploadFile] = File(None),
+    fitness_certificates_id: Optional[str] = Form(None),
+    cleaning_schedule_id: Optional[str] = Form(None),
+    branding_schedule_id: Optional[str] = Form(None),
+    work_order_maximo_id: Optional[str] = Form(None),
+    mileage_logs_id: Optional[str] = Form(None),
+    stabling_layout_id: Optional[str] = Form(None),
+    cleaning_schedule_prev_id: Optional[str] = Form(None),
 ):
-    """Run optimization with uploaded CSV files and return results directly"""
-    try:
-        # Read uploaded CSV files
-        fitness_df = safe_read_csv_from_upload(fitness_certificates_)
-        wo_df = safe_read_csv_from_upload(work_order_maximo_)
-        branding_df = safe_read_csv_from_upload(branding_schedule_)
-        mileage_df = safe_read_csv_from_upload(mileage_logs_)
-        cleaning_df = safe_read_csv_from_upload(cleaning_schedule_)
-        stabling_df = safe_read_csv_from_upload(stabling_layout_)
-        cleaning_df_prev = safe_read_csv_from_upload(cleaning_schedule_prev_)
-
-        # Validate required files
-        required_files = {
-            "fitness_certificates": fitness_df,
-            "work_order_maximo": wo_df,
-            "branding_schedule": branding_df,
-            "mileage_logs": mileage_df,
-            "cleaning_schedule": cleaning_df,
-        }
+    """The optimization input uploads keyed by form field name.
+
+    Each input may instead name a stored dataset in its `<input>_id`
+    field, so only the inputs that changed need uploading again.
+    """
+    uploads = {
+        "fitness_certificates_": fitness_certificates_,
+        "cleaning_schedule_": cleaning_schedule_,
+        "branding_schedule_": branding_schedule_,
+        "work_order_maximo_": work_order_maximo_,
+        "mileage_logs_": mileage_logs_,
+        "stabling_layout_": stabling_layout_,
+        "cleaning_schedule_prev_": cleaning_schedule_prev_,
+    }
+    dataset_ids = {
+        "fitness_certificates_": fitness_certificates_id,
+        "cleaning_schedule_": cleaning_schedule_id,
+        "branding_schedule_": branding_schedule_id,
+        "work_order_maximo_": work_order_maximo_id,
+        "mileage_logs_": mileage_logs_id,
+        "stabling_layout_": stabling_layout_id,
+        "cleaning_schedule_prev_": cleaning_schedule_prev_id,
+    }
+    for name, dataset_id in dataset_ids.items():
+        if dataset_id:
+            uploads[name] = referenced_dataset(name, uploads[name], dataset_id)
+    return uploads
+
+
+def referenced_dataset(name, upload, dataset_id):
+    """The stored dataset an input names in place of an upload"""
+    kind = name.rstrip("_")
+    if upload is not None and upload.filename:
+        raise HTTPException(
+            status_code=400,
+            detail=f"{kind} is both uploaded and given as dataset {dataset_id}",
+        )
+    dataset = datasets.get(dataset_id)
+    if dataset is None:
+        raise HTTPException(status_code=404, detail=f"Unknown dataset: {dataset_id}")
+    if dataset.kind != kind:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Dataset {dataset_id} holds {dataset.kind}, not {kind}",
+        )
+    return dataset
+
 
-        missing_files = [name for name, df in required_files.items() if df is None]
-        if missing_files:
+@app.post("/api/run-optimization")
+async def run_optimization(
+    uploads: dict = Depends(upload_form),
+    view: dict = Depends(result_view),
+    streaming: bool = False,
+    keep_state: bool = False,
+    top_k: Optional[int] = Query(None, ge=0),
+    standby: int = Query(DEFAULT_STANDBY, ge=0),
+    profile: bool = False,
+):
+    """Run optimization with uploaded files and return results directly.
+
+    Each input may be CSV, Parquet or Arrow IPC; the format is detected
+    from the file contents.
+
+    With `streaming=true` the fitness, work-order and mileage uploads are
+    folded chunk by chunk into per-train aggregates instead of being
+    loaded whole. With `keep_state=true` the per-train state is kept so
+    that `/api/fleet-state/deltas` can update it incrementally.
+
+    With `top_k` only the `top_k` best eligible trains are returned under
+    `results`, followed by `standby` more under `standby`; reasons and
+    serialization are limited to those rows.
+
+    `offset`/`limit` page through the ranked results, `fields` picks a
+    comma separated subset of the result fields and `format=ndjson`
+    streams a header line followed by one line per result.
+
+    The work runs in the job queue's worker processes and the request
+    waits for it; a full queue is answered with 429. Results are cached
+    by the content of the uploads; identical requests are answered from
+    the cache (`X-Cache: HIT`) and concurrent identical requests share
+    one computation.
+
+    The `Server-Timing` header breaks the request down by stage. With
+    `profile=true` the ranking is recomputed under the profiler, with
+    peak memory per stage, and `X-Profile-Id` names the dump served by
+    `/api/profiles/{profile_id}`.
+    """
+    try:
+        if streaming and keep_state:
             raise HTTPException(
-                status_code=400, detail=f"Required CSV files missing: {missing_files}"
+                status_code=400,
+                detail="keep_state needs the full work-order and certificate tables; it cannot be combined with streaming",
             )
 
-        # Run optimization
-        result_df = process_train_optimization(
-            fitness_df=fitness_df,
-            wo_df=wo_df,
-            branding_df=branding_df,
-            mileage_df=mileage_df,
-            cleaning_df=cleaning_df,
-            stabling_df=stabling_df,
-            cleaning_df_prev=cleaning_df_prev,
+        if keep_state:
+            # Keeping state is a side effect on this process, so it always
+            # recomputes here rather than in a worker
+            sources = {name: upload_source(upload) for name, upload in uploads.items()}
+            run = partial(
+                optimize_sources,
+                sources,
+                keep_state=True,
+                top_k=top_k,
+                standby=standby,
+                mileage_store=kept_mileage_store(),
+            )
+            try:
+                if profile:
+                    result_df = await run_in_threadpool(profile_call, run)
+                else:
+                    result_df = await run_in_threadpool(run)
+            except InputError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            headers = {}
+            if profile:
+                trace = current_trace()
+                headers["X-Profile-Id"] = save_profile(trace.spans, trace.profile)
+            body = await run_in_threadpool(
+                serialize_response, build_response, result_df
+            )
+            if top_k is None:
+                await run_in_threadpool(publish_ranking, body)
+            return await run_in_threadpool(render, body, view, headers)
+
+        try:
+            job, hit = await run_in_threadpool(
+                submit_optimization, uploads, streaming, top_k, standby, profile
+            )
+        except QueueFull as e:
+            raise queue_full(e)
+        await job.wait()
+        if job.status == FAILED:
+            raise job_error(job)
+        attach_spans(job.spans)
+        headers = {"X-Cache": "HIT" if hit else "MISS", "X-Job-Id": job.id}
+        if profile:
+            headers["X-Profile-Id"] = save_profile(job.spans, job.profile)
+        return await run_in_threadpool(render, job.result, view, headers)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Optimization failed: {str(e)}")
+
+
+@app.post("/api/jobs", status_code=202)
+async def submit_job(
+    uploads: dict = Depends(upload_form),
+    streaming: bool = False,
+    top_k: Optional[int] = Query(None, ge=0),
+    standby: int = Query(DEFAULT_STANDBY, ge=0),
+):
+    """Queue an optimization and return its job id without waiting.
+
+    Poll `/api/jobs/{job_id}` for the status and fetch the ranking from
+    `/api/jobs/{job_id}/result`. Answers 429 when the queue is full.
+    """
+    try:
+        job, _ = await run_in_threadpool(
+            submit_optimization, uploads, streaming, top_k, standby
         )
+    except QueueFull as e:
+        raise queue_full(e)
+    return JSONResponse(
+        status_code=202,
+        content=job.describe(),
+        headers={"Location": f"/api/jobs/{job.id}"},
+    )
 
-        def to_json_safe(val):
-            if pd.isna(val):  # catches NaN, NaT, None
-                return None
-            if isinstance(val, (np.integer,)):
-                return int(val)
-            if isinstance(val, (np.floating,)):
-                return float(val)
-            if isinstance(val, (pd.Timestamp,)):
-                return val.isoformat()  # or str(val) if you prefer
-            return (
-                str(val)
-                if not isinstance(val, (dict, list, bool, int, float, type(None)))
-                else val
+
+@app.post("/api/horizon")
+async def run_horizon(
+    uploads: dict = Depends(upload_form),
+    nights: int = Query(DEFAULT_NIGHTS, ge=1, le=MAX_NIGHTS),
+    start: Optional[str] = None,
+):
+    """Rank the fleet for every night of a multi-night horizon.
+
+    Takes the same uploads as `/api/run-optimization`. `start` is the
+    first night's planning time (ISO 8601, default the configured planning
+    time) and `nights` the horizon length. Each night lists the summary
+    counts (eligible trains, certificate expiries, branding hours at risk)
+    and its ranking.
+    """
+    try:
+        planning_time = pd.Timestamp(start) if start else PLANNING_TIME
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid start: {str(e)}")
+    try:
+        try:
+            job, hit = await run_in_threadpool(
+                submit_uploads,
+                uploads,
+                horizon_job,
+                planning_time,
+                nights,
+                plan="horizon",
+                start=planning_time.isoformat(),
+                nights=nights,
             )
+        except QueueFull as e:
+            raise queue_full(e)
+        await job.wait()
+        if job.status == FAILED:
+            raise job_error(job)
+        attach_spans(job.spans)
+        return Response(
+            content=job.result,
+            media_type="application/json",
+            headers={"X-Cache": "HIT" if hit else "MISS", "X-Job-Id": job.id},
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, detail=f"Horizon planning failed: {str(e)}"
+        )
 
-        # Prepare response data
-        response_data = []
-        for _, row in result_df.iterrows():
-            eligible = bool(row["eligible"])
-            open_wo = int(row.get("open_wo_count", 0) or 0)
-            reasons_txt = str(row.get("reasons", "") or "")
-
-            # Infer status if not provided: Ready > Standby > Maintenance
-            status = "Standby"
-            if eligible:
-                status = "Ready"
-            if open_wo > 0 or ("expired fitness" in reasons_txt.lower()):
-                status = "Maintenance"
-
-            response_data.append(
-                {
-                    "train_id": str(row["train_id"]),
-                    "priority_score": round(float(row["priority_score"]), 4),
-                    "eligible": bool(row["eligible"]),
-                    "status": status,
-                    "fitness_days_left": int(row.get("fitness_days_left", 0) or 0),
-                    "reasons": reasons_txt,
-                    "recommendations": str(row.get("recommendations", "")),
-                    "cleaning": {
-                        "last_clean_end": to_json_safe(row.get("last_clean_end", None)),
-                        "clean_age_hours": float(
-                            row.get("clean_age_hours", 0.0) or 0.0
-                        ),
-                        "today_clean_load": float(
-                            row.get("today_clean_load", 0.0) or 0.0
-                        ),
-                    },
-                    "maintenance": {
-                        "open_work_orders": int(row.get("open_wo_count", 0) or 0),
-                        "open_work_order_hours": float(
-                            row.get("open_wo_hours", 0.0) or 0.0
-                        ),
-                    },
-                }
+
+@app.post("/api/induction-plan")
+async def run_induction_plan(
+    uploads: dict = Depends(upload_form),
+    service_trains: Optional[int] = Query(None, ge=0),
+    standby: int = Query(DEFAULT_STANDBY, ge=0),
+    cleaning_bays: Optional[int] = Query(None, ge=0),
+    manpower: Optional[int] = Query(None, ge=0),
+    branding_share: float = Query(1.0, ge=0, le=1),
+    time_budget: float = Query(DEFAULT_TIME_BUDGET, ge=0, le=MAX_TIME_BUDGET),
+):
+    """Choose the trains for service, standby and maintenance.
+
+    Takes the same uploads as `/api/run-optimization`. `service_trains`
+    (default: the eligible fleet less `standby`) trains are picked to
+    maximise the summed priority less the shunt moves to pull them out,
+    within `cleaning_bays` (default: the bays booked tonight) and
+    `manpower` cleaners for tonight's cleaning, while carrying
+    `branding_share` of the booked branding exposure. The plan is
+    searched for at most `time_budget` seconds; `0` returns the greedy
+    plan. Service trains are listed under `results` in induction order,
+    followed by `standby` and `maintenance`, with the plan totals and any
+    shortfall against the targets.
+    """
+    try:
+        try:
+            job, hit = await run_in_threadpool(
+                partial(
+                    submit_uploads,
+                    uploads,
+                    plan_job,
+                    service_trains,
+                    standby,
+                    cleaning_bays,
+                    manpower,
+                    branding_share,
+                    time_budget,
+                    plan="induction",
+                    service_trains=service_trains,
+                    standby=standby,
+                    cleaning_bays=cleaning_bays,
+                    manpower=manpower,
+                    branding_share=branding_share,
+                    time_budget=time_budget,
+                )
             )
+        except QueueFull as e:
+            raise queue_full(e)
+        await job.wait()
+        if job.status == FAILED:
+            raise job_error(job)
+        attach_spans(job.spans)
+        return Response(
+            content=job.result,
+            media_type="application/json",
+            headers={"X-Cache": "HIT" if hit else "MISS", "X-Job-Id": job.id},
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, detail=f"Induction planning failed: {str(e)}"
+        )
+
 
-        return JSONResponse(
-            content={
+@app.post("/api/cleaning-timeline")
+def cleaning_timeline(
+    cleaning_schedule_: UploadFile = File(...),
+    shift_hours: int = Query(SHIFT_HOURS, ge=1, le=24),
+):
+    """Bay and manpower occupancy of a cleaning schedule.
+
+    Lists the intervals in which a bay is booked for more than one job
+    (`overbooked`, with the most jobs at once) and, per shift of
+    `shift_hours` from 06:00, the peak number of cleaners at work, their
+    man-hours and the jobs touching the shift.
+    """
+    df = safe_read_source(upload_source(cleaning_schedule_), "cleaning_schedule")
+    if df is None:
+        raise HTTPException(status_code=400, detail="Unreadable cleaning schedule")
+    try:
+        with span("cleaning_timeline", rows=len(df)):
+            jobs = CleaningJobs(df)
+            overbooked = jobs.overbooked()
+            shifts = jobs.shifts(shift_hours)
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Missing column: {str(e)}")
+
+    def records(frame, timestamps):
+        frame = frame.assign(
+            **{col: frame[col].map(pd.Timestamp.isoformat) for col in timestamps}
+        )
+        return frame.to_dict(orient="records")
+
+    return Response(
+        content=encode_response(
+            {
                 "success": True,
-                "message": "Optimization completed successfully",
-                "total_trains": len(result_df),
-                "eligible_trains": len(result_df[result_df["eligible"]]),
-                "results": response_data,
+                "total_jobs": len(jobs),
+                "total_bays": len(jobs.bays),
+                "overbooked_hours": float(
+                    (overbooked["end"] - overbooked["start"]).dt.total_seconds().sum()
+                    / 3600.0
+                ),
+                "peak_manpower": float(
+                    shifts["peak_manpower"].max() if len(shifts) else 0
+                ),
+                "overbooked": records(overbooked, ("start", "end")),
+                "shifts": records(shifts, ("shift_start", "shift_end")),
             }
+        ),
+        media_type="application/json",
+    )
+
+
+@app.post("/api/datasets")
+def register_datasets(uploads: dict = Depends(upload_form)):
+    """Store optimization inputs as parsed datasets and return their IDs.
+
+    Takes the same uploads as `/api/run-optimization`. Each is parsed
+    once and kept in columnar form; its `dataset_id` can then be passed
+    as `<input>_id` (e.g. `fitness_certificates_id`) in place of the
+    file. Uploading content that is stored already returns the existing
+    dataset with `reused: true`.
+    """
+    stored = {}
+    for name, upload in uploads.items():
+        kind = name.rstrip("_")
+        if isinstance(upload, Dataset):
+            stored[kind] = {**upload.meta, "reused": True}
+            continue
+        source = upload_source(upload)
+        if source is None:
+            continue
+        try:
+            with span(f"store_{kind}"):
+                dataset, reused = datasets.put(kind, source)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Unreadable {kind}: {str(e)}")
+        stored[kind] = {**dataset.meta, "reused": reused}
+    if not stored:
+        raise HTTPException(status_code=400, detail="No inputs uploaded")
+    return {"success": True, "datasets": stored}
+
+
+@app.get("/api/datasets")
+def list_datasets(kind: Optional[str] = None):
+    """Stored datasets, newest first, optionally of one input kind"""
+    found = datasets.list(kind)
+    return {"total_datasets": len(found), "datasets": found}
+
+
+@app.get("/api/datasets/{dataset_id}")
+def get_dataset(dataset_id: str):
+    dataset = datasets.get(dataset_id)
+    if dataset is None:
+        raise HTTPException(status_code=404, detail=f"Unknown dataset: {dataset_id}")
+    return dataset.meta
+
+
+@app.delete("/api/datasets/{dataset_id}")
+def delete_dataset(dataset_id: str):
+    """Remove a stored dataset; runs already reading it are not affected"""
+    if not datasets.delete(dataset_id):
+        raise HTTPException(status_code=404, detail=f"Unknown dataset: {dataset_id}")
+    return {"success": True, "dataset_id": dataset_id}
+
+
+def require_mileage_store():
+    store = kept_mileage_store()
+    if store is None:
+        raise HTTPException(
+            status_code=409,
+            detail="No mileage store; set GALACTUS_MILEAGE_STORE to keep odometer history",
+        )
+    return store
+
+
+@app.post("/api/mileage")
+def append_mileage(mileage_logs_: UploadFile = File(...)):
+    """Append a mileage log to the kept odometer history.
+
+    Readings are added as a new segment; later optimizations read them
+    together with their uploaded mileage log.
+    """
+    store = require_mileage_store()
+    df = safe_read_source(upload_source(mileage_logs_), "mileage_logs")
+    if df is None:
+        raise HTTPException(status_code=400, detail="Unreadable mileage log")
+    try:
+        with span("mileage_append", rows=len(df)):
+            added = store.append(df)
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Missing column: {str(e)}")
+    return {
+        "success": True,
+        "rows_added": added,
+        "total_rows": len(store),
+        "total_trains": len(store.trains),
+        "segments": len(store.segments),
+    }
+
+
+@app.get("/api/mileage/{train_id}")
+def mileage_windows(
+    train_id: str, at: Optional[str] = None, since: Optional[str] = None
+):
+    """Odometer and rolling-window kilometres of one train.
+
+    `at` is the time to measure at (ISO 8601, default the configured
+    planning time) and `since` the last maintenance, for
+    `km_since_maintenance`.
+    """
+    store = require_mileage_store()
+    try:
+        at = pd.Timestamp(at) if at else PLANNING_TIME
+        since = pd.Timestamp(since) if since else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid time: {str(e)}")
+    if train_id not in store.trains:
+        raise HTTPException(status_code=404, detail=f"Unknown train: {train_id}")
+
+    def km(value):
+        return None if np.isnan(value) else value
+
+    windows = store.windows(train_id, at, since)
+    return {
+        "train_id": train_id,
+        "at": at.isoformat(),
+        "odometer_km": km(store.odometer(train_id, at)),
+        **{name: km(value) for name, value in windows.items()},
+    }
+
+
+@app.post("/api/scenarios")
+def run_scenarios(body: dict = Body(...)):
+    """Rank the kept fleet under many weight scenarios at once.
+
+    `scenarios` is a list of weight override objects (merged over the
+    defaults) or a list of rows ordered as `weight_names` in the response.
+    `top_n` (default 10) sets the cut-off for the top-N statistics and
+    `rankings: false` leaves out the per-scenario train orders.
+    """
+    with state_lock:
+        state = current_state()
+        if state is None:
+            raise HTTPException(
+                status_code=409,
+                detail="No fleet state; run /api/run-optimization?keep_state=true first",
+            )
+        features = state.features
+    try:
+        orders, train_stats, scenario_stats = sweep(
+            features,
+            body.get("scenarios") or [],
+            top_n=body.get("top_n", DEFAULT_TOP_N),
+        )
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid scenarios: {str(e)}")
+
+    train_ids = features["train_id"].astype(str).to_numpy()
+    scenarios = scenario_stats.to_dict(orient="records")
+    if body.get("rankings", True):
+        for scenario, order in zip(scenarios, orders):
+            scenario["ranking"] = train_ids[order].tolist()
+    train_stats["train_id"] = train_stats["train_id"].astype(str)
+    return JSONResponse(
+        content={
+            "success": True,
+            "weight_names": list(WEIGHT_NAMES),
+            "total_scenarios": len(scenarios),
+            "trains": train_stats.to_dict(orient="records"),
+            "scenarios": scenarios,
+        }
+    )
+
+
+@app.post("/api/batch-optimization")
+async def run_batch_optimization(
+    archive: UploadFile = File(...), streaming: bool = False
+):
+    """Rank several depots at once from a zip or tar archive.
+
+    The archive holds one directory per depot with the same file names as
+    the exports in `data/` (CSV, Parquet or Arrow), or a `manifest.json`
+    mapping depot names to their files. Depots run in parallel in the job
+    queue's worker processes and are returned together under `depots`;
+    a depot whose inputs are missing or invalid is reported with
+    `success: false` without failing the others.
+    """
+    try:
+        try:
+            jobs = await run_in_threadpool(submit_depots, archive.file, streaming)
+        except QueueFull as e:
+            raise queue_full(e)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid batch: {str(e)}")
+        for job, _ in jobs.values():
+            await job.wait()
+        body = batch_body({depot: job for depot, (job, _) in jobs.items()})
+        hits = sum(hit for _, hit in jobs.values())
+        return Response(
+            content=body,
+            media_type="application/json",
+            headers={"X-Cache-Hits": f"{hits}/{len(jobs)}"},
         )
 
     except HTTPException:
@@ -576,6 +1388,198 @@ async def run_optimization(
         raise HTTPException(status_code=500, detail=f"Optimization failed: {str(e)}")
 
 
+def find_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job
+
+
+@app.get("/api/jobs/{job_id}")
+async def job_status(job_id: str, wait: float = 0):
+    """Status of a queued job, waiting up to `wait` seconds for it to finish"""
+    job = find_job(job_id)
+    if wait > 0:
+        await job.wait(timeout=min(wait, MAX_JOB_WAIT_SECONDS))
+    return job.describe()
+
+
+@app.get("/api/jobs/{job_id}/result")
+async def job_result(job_id: str, wait: float = 0, view: dict = Depends(result_view)):
+    """Ranking produced by a job; 202 with its status while it is unfinished.
+
+    Takes the same `offset`, `limit`, `fields` and `format` options as
+    `/api/run-optimization`.
+    """
+    job = find_job(job_id)
+    if wait > 0:
+        await job.wait(timeout=min(wait, MAX_JOB_WAIT_SECONDS))
+    if not job.done():
+        return JSONResponse(status_code=202, content=job.describe())
+    if job.status == FAILED:
+        raise job_error(job)
+    attach_spans(job.spans)
+    return await run_in_threadpool(render, job.result, view, {"X-Job-Id": job.id})
+
+
+def require_state():
+    state = current_state()
+    if state is None:
+        raise HTTPException(
+            status_code=409,
+            detail="No fleet state; run /api/run-optimization?keep_state=true first",
+        )
+    return state
+
+
+def update_state(deltas, view):
+    """Apply delta feeds to the kept fleet state and render the new ranking"""
+    with state_lock:
+        state = require_state()
+        try:
+            changed = state.apply(deltas)
+        except (ValueError, KeyError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid deltas: {str(e)}")
+        publish_state(state)
+        result_df = rank_features(state.features, scores=state.scores)
+
+    content = build_response(result_df, message="Fleet state updated")
+    content["state_version"] = state.version
+    content["changed_trains"] = [str(t) for t in changed]
+    body = encode_response(content)
+    publish_ranking(body)
+    return render(body, view)
+
+
+@app.post("/api/fleet-state/deltas")
+def apply_fleet_deltas(deltas: dict = Body(...), view: dict = Depends(result_view)):
+    """Apply new and changed rows to the kept fleet state and re-rank.
+
+    The body maps feed names (`mileage_logs`, `work_orders`,
+    `fitness_certificates`, `cleaning_schedule`, `cleaning_schedule_prev`)
+    to lists of row objects with the same columns as the CSV exports;
+    `work_order_events` takes work-order events as in
+    `/api/fleet-state/work-order-events`.
+    """
+    return update_state(deltas, view)
+
+
+@app.post("/api/fleet-state/work-order-events")
+def apply_work_order_events(
+    events: UploadFile = File(...), view: dict = Depends(result_view)
+):
+    """Apply a JSONL feed of Maximo work-order events and re-rank.
+
+    Each line is a `create`, `status_change` or `close` event (see
+    `backend.work_orders`). Events that refer to unknown orders or make a
+    move the order's state does not allow reject the whole feed.
+    """
+    try:
+        feed = read_events(upload_source(events))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid events: {str(e)}")
+    return update_state({"work_order_events": feed}, view)
+
+
+@app.get("/api/fleet-state/work-orders/{train_id}")
+def train_work_orders(train_id: str):
+    """Open work orders of one train and whether it may enter service"""
+    with state_lock:
+        state = require_state()
+        index = state.work_orders
+        eligible = state.eligible(train_id)
+        if eligible is None:
+            raise HTTPException(status_code=404, detail=f"Unknown train: {train_id}")
+        return {
+            "train_id": train_id,
+            "open_wo_count": index.open_count(train_id),
+            "open_wo_hours": index.open_hours(train_id),
+            "eligible": eligible,
+        }
+
+
+@app.get("/api/ranking/latest")
+def latest_ranking(
+    view: dict = Depends(result_view), if_none_match: Optional[str] = Header(None)
+):
+    """The most recently published ranking, the same in every API worker.
+
+    Optimization runs (`/api/run-optimization`, `/api/jobs`) other than
+    top-K ones, and fleet state updates, publish their full ranking as a
+    snapshot under GALACTUS_SNAPSHOT_DIR that every worker memory-maps, so
+    this neither recomputes nor copies it. Takes the same `offset`,
+    `limit`, `fields` and `format` as `/api/run-optimization`. The `ETag`
+    is the snapshot version; a request whose `If-None-Match` carries it
+    gets a 304.
+    """
+    try:
+        snapshot = snapshots.latest()
+    except Exception as e:
+        raise HTTPException(
+            status_code=503, detail=f"Ranking snapshot unreadable: {str(e)}"
+        )
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="No ranking published yet")
+    etag = f'"{snapshot.version}"'
+    headers = {"ETag": etag, "X-Snapshot-Version": snapshot.version}
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+    if view["format"] == JSON and not (
+        view["offset"] or view["limit"] is not None or view["fields"]
+    ):
+        return Response(
+            content=snapshot.body, media_type="application/json", headers=headers
+        )
+    content = snapshot.view(view["offset"], view["limit"], view["fields"])
+    if view["format"] == NDJSON:
+        return StreamingResponse(
+            iter_ndjson(content), media_type=NDJSON_MEDIA_TYPE, headers=headers
+        )
+    return Response(
+        content=encode_response(content), media_type="application/json", headers=headers
+    )
+
+
+@app.get("/api/explain/{train_id}")
+def explain_train(train_id: str):
+    """Weighted feature contributions behind one train's priority score.
+
+    Read from the kept fleet state: each feature's raw value, the bounds
+    it was normalised against, its score, weight and contribution to the
+    combined sum, and the train's position in the ranking.
+    """
+    with state_lock:
+        state = require_state()
+        rows = state.rows([train_id])
+        if rows[0] < 0:
+            raise HTTPException(status_code=404, detail=f"Unknown train: {train_id}")
+        explained = explain_trains(state, rows)[0]
+        explained["state_version"] = state.version
+    return explained
+
+
+@app.post("/api/explain")
+def explain_bulk(body: dict = Body(...)):
+    """`/api/explain/{train_id}` for each train in `train_ids`.
+
+    Trains the state does not know are listed under `unknown_trains`.
+    """
+    train_ids = body.get("train_ids")
+    if not isinstance(train_ids, list):
+        raise HTTPException(status_code=400, detail="train_ids must be a list")
+    train_ids = [str(t) for t in train_ids]
+    with state_lock:
+        state = require_state()
+        rows = state.rows(train_ids)
+        explained = explain_trains(state, rows[rows >= 0])
+        version = state.version
+    return {
+        "state_version": version,
+        "trains": explained,
+        "unknown_trains": [t for t, row in zip(train_ids, rows) if row < 0],
+    }
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -0,0 +1,143 @@
+"""Multi-depot batches: locating each depot's inputs and ranking them in parallel.
+
+A batch is a mapping of depot name to that depot's input files. It can be
+read from a directory (one sub-directory per depot, files named like the
+exports in `data/`), from a zip or tar archive with the same layout, or
+from a JSON manifest listing the files of every depot.
+"""
+
+import json
+import os
+import tarfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+from .ranking import INPUT_EXTENSIONS
+
+# Upload field name -> export file stem, in the order used by the API
+DEPOT_INPUTS = {
+    "fitness_certificates_": "fitness_certificates",
+    "work_order_maximo_": "work_orders_maximo",
+    "branding_schedule_": "branding_schedule",
+    "mileage_logs_": "mileage_logs",
+    "cleaning_schedule_": "cleaning_schedule",
+    "stabling_layout_": "stabling_layout",
+    "cleaning_schedule_prev_": "cleaning_schedule_prev",
+}
+
+MANIFEST_NAME = "manifest.json"
+# Name of the depot whose exports sit at the top of the batch directory
+DEFAULT_DEPOT = "default"
+
+
+def _sources(files):
+    """Depot files keyed by stem -> sources keyed by upload field name"""
+    unknown = set(files) - set(DEPOT_INPUTS.values())
+    if unknown:
+        raise ValueError(f"Unknown depot inputs: {sorted(unknown)}")
+    return {field: files.get(stem) for field, stem in DEPOT_INPUTS.items()}
+
+
+def _depot_files(directory):
+    files = {}
+    for stem in DEPOT_INPUTS.values():
+        for ext in INPUT_EXTENSIONS:
+            path = os.path.join(directory, stem + ext)
+            if os.path.isfile(path):
+                files[stem] = path
+                break
+    return files
+
+
+def load_manifest(path):
+    """Depots listed in a JSON manifest.
+
+    The manifest maps depot names to objects of export stem -> file path;
+    relative paths are resolved against the manifest's directory. The
+    mapping may also be nested under a top-level `depots` key.
+    """
+    with open(path) as fh:
+        manifest = json.load(fh)
+    manifest = manifest.get("depots", manifest)
+    base = os.path.dirname(os.path.abspath(path))
+    depots = {}
+    for depot, files in manifest.items():
+        if not isinstance(files, dict):
+            raise ValueError(f"Manifest entry for {depot!r} must be an object")
+        depots[str(depot)] = _sources(
+            {stem: os.path.join(base, rel) for stem, rel in files.items()}
+        )
+    return depots
+
+
+def depots_from_dir(root):
+    """Depots found under `root`, keyed by their relative directory.
+
+    A `manifest.json` at the top takes precedence; otherwise every
+    directory holding at least one known export is a depot.
+    """
+    manifest = os.path.join(root, MANIFEST_NAME)
+    if os.path.isfile(manifest):
+        return load_manifest(manifest)
+    depots = {}
+    for directory, _, _ in sorted(os.walk(root)):
+        files = _depot_files(directory)
+        if files:
+            name = os.path.relpath(directory, root)
+            depots[DEFAULT_DEPOT if name == "." else name] = _sources(files)
+    if not depots:
+        raise ValueError("No depot inputs found")
+    return depots
+
+
+def extract_archive(source, dest):
+    """Unpack a zip or tar archive (path or file object) into `dest`"""
+    if hasattr(source, "seek"):
+        source.seek(0)
+    if zipfile.is_zipfile(source):
+        if hasattr(source, "seek"):
+            source.seek(0)
+        root = os.path.realpath(dest)
+        with zipfile.ZipFile(source) as archive:
+            for member in archive.namelist():
+                target = os.path.realpath(os.path.join(dest, member))
+                if os.path.commonpath([root, target]) != root:
+                    raise ValueError(f"Unsafe path in archive: {member}")
+            archive.extractall(dest)
+        return dest
+    if hasattr(source, "seek"):
+        source.seek(0)
+    try:
+        if hasattr(source, "read"):
+            archive = tarfile.open(fileobj=source)
+        else:
+            archive = tarfile.open(source)
+    except tarfile.TarError:
+        raise ValueError("Batch archive must be a zip or tar file")
+    with archive:
+        archive.extractall(dest, filter="data")
+    return dest
+
+
+def _rank_depot(sources):
+    # Imported here: the app module pulls in the web stack and imports us
+    from .app import optimize_sources
+
+    return optimize_sources(sources)
+
+
+def rank_depots(depots, max_workers=None):
+    """Rank every depot in parallel; returns depot name -> ranked DataFrame.
+
+    `depots` maps depot names to sources keyed by upload field name, as
+    returned by `depots_from_dir` or `load_manifest`. Each depot runs in
+    its own worker process, so the batch takes about as long as the
+    slowest depot.
+    """
+    max_workers = min(max_workers or os.cpu_count() or 1, max(len(depots), 1))
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            depot: pool.submit(_rank_depot, sources)
+            for depot, sources in depots.items()
+        }
+        return {depot: future.result() for depot, future in futures.items()}
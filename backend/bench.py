@@ -0,0 +1,284 @@
+"""Stage-level benchmarks of the ranking pipeline.
+
+Times every stage the pipeline records as a span (parsing, each
+per-table aggregate, feature assembly, scoring, ranking, reason codes,
+response building and encoding), and the end-to-end
+`/api/run-optimization` request, on synthetic fleets from
+`backend.synthetic`. Median timings are compared with a stored baseline
+and stages that got slower than the tolerance allows are flagged.
+
+    python -m backend.bench                      # compare with the baseline
+    python -m backend.bench --trains 25 100000   # other fleet sizes
+    python -m backend.bench --update-baseline    # record new baselines
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import nullcontext
+
+from .batch import DEPOT_INPUTS
+from .metrics import tracing
+from .synthetic import DEFAULT_SEED, write_fleet
+
+DEFAULT_SIZES = (25, 1_000, 10_000)
+DEFAULT_MILEAGE_ROWS_PER_TRAIN = 10
+DEFAULT_REPEAT = 5
+
+# A stage regresses when its median is this much slower than the baseline
+# and by more than the noise floor
+DEFAULT_TOLERANCE = 0.25
+MIN_REGRESSION_SECONDS = 0.005
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "bench_baseline.json")
+
+API_STAGES = ("api_cold", "api_cached")
+
+
+def case_name(trains, mileage_rows):
+    return f"trains={trains},mileage_rows={mileage_rows}"
+
+
+def time_pipeline(paths):
+    """Run the pipeline once over export files; returns stage -> seconds.
+
+    Runs the body of an `/api/run-optimization` job (reading, features,
+    ranking, response building and encoding) under a trace, so the stages
+    are the spans the pipeline itself records, summed by name, and
+    `pipeline` is the whole run.
+    """
+    from . import app
+
+    sources = {field: paths.get(stem) for field, stem in DEPOT_INPUTS.items()}
+    with tracing() as trace:
+        start = time.perf_counter()
+        result_df = app.optimize_sources(sources)
+        app.serialize_response(app.build_response, result_df)
+        total = time.perf_counter() - start
+    seconds = {}
+    for s in trace.all_spans():
+        seconds[s["name"]] = seconds.get(s["name"], 0.0) + s["seconds"]
+    seconds["pipeline"] = total
+    return seconds
+
+
+def time_api(client, paths):
+    """Time one uncached and one cached `/api/run-optimization` request"""
+    from . import app
+    from .cache import ResultCache
+
+    # A fresh in-memory cache makes the first request compute
+    app.result_cache = ResultCache()
+    seconds = {}
+    for stage in API_STAGES:
+        files = {
+            field: open(paths[stem], "rb")
+            for field, stem in DEPOT_INPUTS.items()
+            if stem in paths
+        }
+        try:
+            start = time.perf_counter()
+            response = client.post("/api/run-optimization", files=files)
+            seconds[stage] = time.perf_counter() - start
+        finally:
+            for fh in files.values():
+                fh.close()
+        if response.status_code != 200:
+            raise RuntimeError(
+                f"/api/run-optimization answered {response.status_code}: {response.text[:200]}"
+            )
+    return seconds
+
+
+def _api_client():
+    try:
+        from fastapi.testclient import TestClient
+    except (ImportError, RuntimeError):
+        return None
+    from .app import app
+
+    return TestClient(app)
+
+
+def run_case(trains, mileage_rows, repeat=DEFAULT_REPEAT, seed=DEFAULT_SEED, api=True):
+    """Median seconds per stage for one synthetic fleet"""
+    samples = {}
+    with tempfile.TemporaryDirectory(prefix="galactus-bench-") as tmp:
+        paths = write_fleet(tmp, trains, mileage_rows, seed)
+        client = _api_client() if api else None
+        if api and client is None:
+            print("fastapi.testclient unavailable (needs httpx); skipping API timings")
+
+        def measure():
+            seconds = time_pipeline(paths)
+            if client is not None:
+                seconds.update(time_api(client, paths))
+            return seconds
+
+        # The first run warms imports, caches and the worker pool
+        with client if client is not None else nullcontext():
+            measure()
+            runs = [measure() for _ in range(repeat)]
+    for run in runs:
+        for stage, seconds in run.items():
+            samples.setdefault(stage, []).append(seconds)
+    return {
+        stage: round(statistics.median(values), 6) for stage, values in samples.items()
+    }
+
+
+def machine_info():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def run_suite(
+    sizes=DEFAULT_SIZES,
+    mileage_rows_per_train=DEFAULT_MILEAGE_ROWS_PER_TRAIN,
+    repeat=DEFAULT_REPEAT,
+    seed=DEFAULT_SEED,
+    api=True,
+):
+    """Benchmark every fleet size; returns a baseline-shaped report"""
+    cases = {}
+    for trains in sizes:
+        mileage_rows = trains * mileage_rows_per_train
+        cases[case_name(trains, mileage_rows)] = {
+            "trains": trains,
+            "mileage_rows": mileage_rows,
+            "seconds": run_case(trains, mileage_rows, repeat, seed, api),
+        }
+    return {
+        "machine": machine_info(),
+        "repeat": repeat,
+        "seed": seed,
+        "cases": cases,
+    }
+
+
+def load_baseline(path=BASELINE_PATH):
+    if not os.path.exists(path):
+        return None
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def save_baseline(report, path=BASELINE_PATH, merge=True):
+    """Store `report` as the baseline, keeping cases it did not run"""
+    baseline = load_baseline(path) if merge else None
+    if baseline is not None:
+        cases = dict(baseline.get("cases", {}))
+        cases.update(report["cases"])
+        report = dict(report, cases=cases)
+    with open(path, "w") as fh:
+        json.dump(report, fh, indent=2, sort_keys=True)
+        fh.write("\n")
+
+
+def find_regressions(
+    report,
+    baseline,
+    tolerance=DEFAULT_TOLERANCE,
+    min_seconds=MIN_REGRESSION_SECONDS,
+):
+    """Stages slower than their baseline by more than `tolerance`.
+
+    Returns `(case, stage, baseline_seconds, seconds)` tuples; cases or
+    stages missing from the baseline are not compared.
+    """
+    regressions = []
+    stored = (baseline or {}).get("cases", {})
+    for case, result in report["cases"].items():
+        reference = stored.get(case, {}).get("seconds", {})
+        for stage, seconds in result["seconds"].items():
+            before = reference.get(stage)
+            if before is None:
+                continue
+            if seconds > before * (1 + tolerance) and seconds - before > min_seconds:
+                regressions.append((case, stage, before, seconds))
+    return regressions
+
+
+def format_report(report, baseline=None, regressions=()):
+    flagged = {(case, stage) for case, stage, _, _ in regressions}
+    stored = (baseline or {}).get("cases", {})
+    lines = []
+    for case, result in report["cases"].items():
+        reference = stored.get(case, {}).get("seconds", {})
+        lines.append(case)
+        lines.append(f"  {'stage':<24}{'ms':>10}{'baseline':>10}{'ratio':>8}")
+        for stage, seconds in result["seconds"].items():
+            before = reference.get(stage)
+            ratio = f"{seconds / before:.2f}" if before else "-"
+            lines.append(
+                f"  {stage:<24}{seconds * 1e3:>10.1f}"
+                f"{before * 1e3 if before is not None else float('nan'):>10.1f}"
+                f"{ratio:>8}" + ("  REGRESSED" if (case, stage) in flagged else "")
+            )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trains", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument(
+        "--mileage-rows-per-train", type=int, default=DEFAULT_MILEAGE_ROWS_PER_TRAIN
+    )
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="store these timings as the baseline instead of comparing",
+    )
+    parser.add_argument(
+        "--no-api", action="store_true", help="skip the end-to-end API timings"
+    )
+    parser.add_argument("--output", help="also write the report as JSON here")
+    args = parser.parse_args(argv)
+
+    report = run_suite(
+        args.trains,
+        args.mileage_rows_per_train,
+        args.repeat,
+        args.seed,
+        api=not args.no_api,
+    )
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(report, fh, indent=2, sort_keys=True)
+
+    if args.update_baseline:
+        save_baseline(report, args.baseline)
+        print(format_report(report))
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    baseline = load_baseline(args.baseline)
+    regressions = find_regressions(report, baseline, args.tolerance)
+    print(format_report(report, baseline, regressions))
+    if baseline is None:
+        print(f"No baseline at {args.baseline}; run with --update-baseline")
+    elif baseline.get("machine") != report["machine"]:
+        print("Baseline was recorded on a different machine; compare with care")
+    if regressions:
+        print(
+            f"{len(regressions)} stage(s) regressed by more than {args.tolerance:.0%}"
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
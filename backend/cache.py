@@ -0,0 +1,185 @@
+"""Content-addressed cache for serialized optimization results.
+
+Keys are digests of the uploaded file contents plus everything else that
+changes the output (planning time, scoring weights, cache format version).
+Values are the encoded response bodies. A small in-memory LRU sits in front
+of an on-disk tier that is trimmed by total size. Concurrent requests for
+the same key share one computation through `jobs.JobQueue`, not here.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Bump whenever the scoring or the response layout changes, so bodies
+# computed by older code are never served from a persisted cache
+CACHE_FORMAT_VERSION = 3
+
+DEFAULT_MEMORY_ENTRIES = 32
+DEFAULT_MEMORY_BYTES = 256 * 1024 * 1024
+DEFAULT_DISK_BYTES = 2 * 1024 * 1024 * 1024
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def hash_file(fileobj, digest):
+    """Feed a seekable file object into `digest` without loading it whole"""
+    fileobj.seek(0)
+    while True:
+        block = fileobj.read(HASH_BLOCK_SIZE)
+        if not block:
+            break
+        digest.update(block)
+    fileobj.seek(0)
+
+
+def result_key(named_files, **params):
+    """Digest of the named input files and the parameters that shape the result.
+
+    `named_files` maps input names to paths or seekable file objects (or
+    None for inputs that were not supplied); an object with a `digest`
+    attribute, such as a stored dataset, stands for content of that digest.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    header = {"version": CACHE_FORMAT_VERSION, "params": params}
+    digest.update(json.dumps(header, sort_keys=True, default=str).encode())
+    for name in sorted(named_files):
+        fileobj = named_files[name]
+        digest.update(f"\0{name}\0".encode())
+        if fileobj is None:
+            digest.update(b"-")
+            continue
+        if hasattr(fileobj, "digest"):
+            digest.update(fileobj.digest)
+            continue
+        file_digest = hashlib.blake2b(digest_size=20)
+        if isinstance(fileobj, (str, os.PathLike)):
+            with open(fileobj, "rb") as fh:
+                hash_file(fh, file_digest)
+        else:
+            hash_file(fileobj, file_digest)
+        digest.update(file_digest.digest())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Two-tier byte cache: an in-memory LRU over a size-trimmed directory"""
+
+    def __init__(
+        self,
+        disk_dir=None,
+        max_memory_entries=DEFAULT_MEMORY_ENTRIES,
+        max_memory_bytes=DEFAULT_MEMORY_BYTES,
+        max_disk_bytes=DEFAULT_DISK_BYTES,
+    ):
+        self.max_memory_entries = max_memory_entries
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.disk_dir = disk_dir
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_bytes = sum(size for _, _, size in self._disk_entries())
+
+    # Memory tier
+
+    def _remember(self, key, value):
+        if len(value) > self.max_memory_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._memory[key] = value
+        self._memory_bytes += len(value)
+        while self._memory and (
+            len(self._memory) > self.max_memory_entries
+            or self._memory_bytes > self.max_memory_bytes
+        ):
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    # Disk tier
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.bin")
+
+    def _disk_entries(self):
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".bin"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.disk_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, name, st.st_size))
+        return entries
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as fh:
+                value = fh.read()
+            os.utime(path)  # mark as recently used for eviction
+        except FileNotFoundError:
+            return None
+        return value
+
+    def _write_disk(self, key, value):
+        if not self.disk_dir or len(value) > self.max_disk_bytes:
+            return
+        fd, tmp = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(value)
+        path = self._path(key)
+        previous = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp, path)
+        self._disk_bytes += len(value) - previous
+        if self._disk_bytes > self.max_disk_bytes:
+            self._trim_disk()
+
+    def _trim_disk(self):
+        """Drop least recently used files until the tier fits its budget"""
+        entries = sorted(self._disk_entries())
+        total = sum(size for _, _, size in entries)
+        for _, name, size in entries:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.disk_dir, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._disk_bytes = total
+
+    # Public API
+
+    def get(self, key):
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+            else:
+                value = self._read_disk(key)
+                if value is not None:
+                    self._remember(key, value)
+            if value is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._remember(key, value)
+            self._write_disk(key, value)
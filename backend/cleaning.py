@@ -0,0 +1,240 @@
+"""Cleaning-bay and manpower occupancy timelines.
+
+Each cleaning job holds its bay and `manpower_required` cleaners from
+`scheduled_start` to `scheduled_end`; a job without a usable end (missing,
+unparsable or not after the start) lasts the fixed duration of its
+cleaning type. Occupancy is computed with one sweep over the sorted start
+and end events of all jobs, grouped by bay: a running sum of +1/-1 per
+event gives the level of every interval between consecutive events. A job
+ending when the next one starts does not overlap it.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .timeparse import UNIT, parse_timestamps
+
+CLEANING_DURATION_MINS = {"daily": 15, "outside_cleaning": 120, "heavy": 180}
+DEFAULT_CLEANING_TYPE = "daily"
+
+# Cleaning shifts: three of eight hours, the first starting at 06:00
+SHIFT_HOURS = 8
+SHIFT_START_HOUR = 6
+
+HOUR = np.timedelta64(1, "h").astype(f"timedelta64[{UNIT}]").astype(np.int64)
+
+
+def ticks(timestamp):
+    """A timestamp as an integer count of `UNIT` since the epoch"""
+    return np.datetime64(pd.Timestamp(timestamp), UNIT).astype(np.int64)
+
+
+def cleaning_duration_hours(cleaning_type):
+    """Vectorised fixed duration lookup by cleaning type"""
+    t = cleaning_type.astype(str).str.lower().str.strip().str.replace(" ", "_")
+    mins = t.map(CLEANING_DURATION_MINS).fillna(
+        CLEANING_DURATION_MINS[DEFAULT_CLEANING_TYPE]
+    )
+    return mins.astype(float) / 60.0
+
+
+class Sweep:
+    """Occupancy levels of weighted `[start, end)` spans, per group.
+
+    Events are sorted by group, time and kind (ends before starts), so
+    `level[k]` holds between `time[k]` and `time[k + 1]`. `first` and
+    `last` are each span's start and end event positions; the intervals
+    a span covers are `first <= k < last`.
+    """
+
+    def __init__(self, starts, ends, weights=None, groups=None):
+        n = len(starts)
+        weights = np.ones(n) if weights is None else np.asarray(weights, dtype=float)
+        groups = np.zeros(n, np.int64) if groups is None else np.asarray(groups)
+        times = np.concatenate([starts, ends])
+        is_start = np.repeat([1, 0], n)
+        order = np.lexsort((is_start, times, np.tile(groups, 2)))
+        self.time = times[order]
+        self.group = np.tile(groups, 2)[order]
+        self.level = np.cumsum(np.concatenate([weights, -weights])[order])
+        position = np.empty(2 * n, dtype=np.int64)
+        position[order] = np.arange(2 * n)
+        self.first, self.last = position[:n], position[n:]
+
+        # Length in hours of each interval; zero across group boundaries
+        length = np.zeros(2 * n)
+        same = self.group[1:] == self.group[:-1]
+        length[:-1] = np.where(same, np.diff(self.time) / HOUR, 0.0)
+        self.length = length
+
+    def intervals(self, above=0):
+        """Non-empty intervals with a level over `above`, as a frame"""
+        keep = (self.length > 0) & (self.level > above + 1e-9)
+        rows = np.flatnonzero(keep)
+        return pd.DataFrame(
+            {
+                "group": self.group[rows],
+                "start": self.time[rows],
+                "end": self.time[rows + 1],
+                "level": self.level[rows],
+            }
+        )
+
+    def hours_above(self, above):
+        """Hours of each span spent at a level over `above`"""
+        covered = np.concatenate(
+            [[0.0], np.cumsum(self.length * (self.level > above + 1e-9))]
+        )
+        return covered[self.last] - covered[self.first]
+
+
+class CleaningJobs:
+    """Parsed cleaning jobs: bay, train, crew and time span of each"""
+
+    def __init__(self, cleaning_df):
+        self.frame = cleaning_df
+        self.train_id = cleaning_df["train_id"].to_numpy()
+        bay = cleaning_df.get("bay_id", pd.Series(pd.NA, index=cleaning_df.index))
+        self.bay, self.bays = pd.factorize(bay, use_na_sentinel=True)
+        self.manpower = (
+            pd.to_numeric(cleaning_df["manpower_required"], errors="coerce")
+            .fillna(0.0)
+            .to_numpy(dtype=float)
+        )
+        start = parse_timestamps(cleaning_df["scheduled_start"], "scheduled_start")
+        start = start.to_numpy().astype(f"datetime64[{UNIT}]")
+        end = pd.Series(np.datetime64("NaT", UNIT), index=cleaning_df.index)
+        if "scheduled_end" in cleaning_df.columns:
+            end = parse_timestamps(cleaning_df["scheduled_end"], "scheduled_end")
+        end = end.to_numpy().astype(f"datetime64[{UNIT}]")
+        cleaning_type = cleaning_df.get(
+            "cleaning_type", pd.Series("", index=cleaning_df.index)
+        )
+        fixed = (cleaning_duration_hours(cleaning_type).to_numpy() * HOUR).astype(
+            np.int64
+        )
+        self.valid = ~np.isnat(start)
+        self.start = start.view(np.int64)
+        usable = ~np.isnat(end) & (end > start)
+        self.end = np.where(usable, end.view(np.int64), self.start + fixed)
+        self._bay_sweep = None
+
+    def __len__(self):
+        return len(self.start)
+
+    @property
+    def hours(self):
+        """Duration of each job in hours"""
+        return (self.end - self.start) / HOUR
+
+    def starting_between(self, begin, end):
+        """Jobs starting in `[begin, end)`"""
+        begin, end = ticks(begin), ticks(end)
+        return self.valid & (self.start >= begin) & (self.start < end)
+
+    def bay_sweep(self):
+        """Jobs per bay over time; jobs without a bay are left out"""
+        if self._bay_sweep is None:
+            rows = np.flatnonzero(self.valid & (self.bay >= 0))
+            self._bay_rows = rows
+            self._bay_sweep = Sweep(
+                self.start[rows], self.end[rows], groups=self.bay[rows]
+            )
+        return self._bay_sweep
+
+    def conflict_hours(self):
+        """Hours of each job during which its bay holds another job too"""
+        sweep = self.bay_sweep()
+        hours = np.zeros(len(self))
+        hours[self._bay_rows] = sweep.hours_above(1)
+        return hours
+
+    def overbooked(self):
+        """Maximal intervals in which a bay holds more than one job"""
+        runs = self.bay_sweep().intervals(above=1)
+        if runs.empty:
+            return pd.DataFrame(
+                {
+                    "bay_id": pd.Series(dtype=object),
+                    "start": _timestamps([]),
+                    "end": _timestamps([]),
+                    "jobs": pd.Series(dtype=int),
+                }
+            )
+        group = runs["group"].to_numpy()
+        start = runs["start"].to_numpy()
+        end = runs["end"].to_numpy()
+        new_run = np.ones(len(runs), dtype=bool)
+        new_run[1:] = (group[1:] != group[:-1]) | (start[1:] != end[:-1])
+        heads = np.flatnonzero(new_run)
+        return pd.DataFrame(
+            {
+                "bay_id": self.bays[group[heads]],
+                "start": _timestamps(start[heads]),
+                "end": _timestamps(np.maximum.reduceat(end, heads)),
+                "jobs": np.maximum.reduceat(runs["level"].to_numpy(), heads).astype(
+                    int
+                ),
+            }
+        )
+
+    def shifts(self, shift_hours=SHIFT_HOURS, first_hour=SHIFT_START_HOUR):
+        """Peak and total cleaners per shift over the whole schedule.
+
+        Shifts are `shift_hours` long and aligned to `first_hour` each day;
+        only shifts with some cleaning are listed.
+        """
+        rows = np.flatnonzero(self.valid)
+        if len(rows) == 0:
+            return pd.DataFrame(
+                {
+                    "shift_start": _timestamps([]),
+                    "shift_end": _timestamps([]),
+                    "peak_manpower": pd.Series(dtype=float),
+                    "man_hours": pd.Series(dtype=float),
+                    "jobs": pd.Series(dtype=int),
+                }
+            )
+        sweep = Sweep(self.start[rows], self.end[rows], self.manpower[rows])
+        busy = sweep.intervals()
+        length = shift_hours * HOUR
+        anchor = pd.Timestamp(self.start[rows].min(), unit=UNIT).normalize()
+        anchor = ticks(anchor) + first_hour * HOUR
+        anchor -= -(-(anchor - self.start[rows].min()) // length) * length
+
+        # Split the busy intervals at shift boundaries
+        start = busy["start"].to_numpy()
+        end = busy["end"].to_numpy()
+        first = (start - anchor) // length
+        count = (end - 1 - anchor) // length - first + 1
+        piece = np.repeat(np.arange(len(busy)), count)
+        shift = first[piece] + (
+            np.arange(len(piece)) - np.repeat(np.cumsum(count) - count, count)
+        )
+        lo = np.maximum(start[piece], anchor + shift * length)
+        hi = np.minimum(end[piece], anchor + (shift + 1) * length)
+        level = busy["level"].to_numpy()[piece]
+
+        shifts, index = np.unique(shift, return_inverse=True)
+        peak = np.zeros(len(shifts))
+        np.maximum.at(peak, index, level)
+        man_hours = np.bincount(index, weights=level * (hi - lo) / HOUR)
+        job_shift_first = (self.start[rows] - anchor) // length
+        job_shift_last = (self.end[rows] - 1 - anchor) // length
+        jobs = np.searchsorted(
+            np.sort(job_shift_first), shifts, side="right"
+        ) - np.searchsorted(np.sort(job_shift_last), shifts, side="left")
+        begin = anchor + shifts * length
+        return pd.DataFrame(
+            {
+                "shift_start": _timestamps(begin),
+                "shift_end": _timestamps(begin + length),
+                "peak_manpower": peak,
+                "man_hours": man_hours,
+                "jobs": jobs,
+            }
+        )
+
+
+def _timestamps(values):
+    return pd.to_datetime(np.asarray(values, dtype=np.int64), unit=UNIT)
@@ -0,0 +1,140 @@
+"""Server-side registry of parsed input datasets.
+
+An upload is parsed once with the declared schema of its input kind and
+kept on local disk as an Arrow IPC file, which later runs read without
+parsing. Its dataset ID is the kind plus a digest of the uploaded bytes
+and the schema, so uploading the same export again returns the stored
+version, and a schema change never serves a table parsed under the old
+one. Optimization requests can name a dataset ID in place of any upload.
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+
+from .cache import hash_file
+from .ingest import ARROW_FILE, INPUT_SCHEMAS, read_input, write_table
+
+DATASET_ID_RE = re.compile(r"^([a-z_]+)-([0-9a-f]{20})$")
+
+
+def dataset_dir():
+    return os.environ.get(
+        "GALACTUS_DATASET_DIR",
+        os.path.join(tempfile.gettempdir(), "galactus-datasets"),
+    )
+
+
+class Dataset:
+    """A stored dataset version: its ID, input kind and Arrow file"""
+
+    def __init__(self, dataset_id, path, meta):
+        self.id = dataset_id
+        self.kind = meta["kind"]
+        self.path = path
+        self.meta = meta
+
+    @property
+    def digest(self):
+        """Content digest, standing for the file in result cache keys"""
+        return f"dataset:{self.id}".encode()
+
+
+class DatasetRegistry:
+    """Parsed datasets under `root`, one `<id>.arrow` and `<id>.json` each"""
+
+    def __init__(self, root=None):
+        self.root = root or dataset_dir()
+
+    def _paths(self, dataset_id):
+        base = os.path.join(self.root, dataset_id)
+        return base + ".arrow", base + ".json"
+
+    def dataset_id(self, kind, source):
+        """ID the upload `source` of input `kind` is stored under"""
+        digest = hashlib.blake2b(digest_size=10)
+        digest.update(json.dumps(INPUT_SCHEMAS[kind], sort_keys=True).encode())
+        if isinstance(source, str):
+            with open(source, "rb") as fh:
+                hash_file(fh, digest)
+        else:
+            hash_file(source, digest)
+        return f"{kind}-{digest.hexdigest()}"
+
+    def put(self, kind, source):
+        """Parse and store an upload unless stored already.
+
+        Returns the `Dataset` and whether an earlier version was reused.
+        """
+        if kind not in INPUT_SCHEMAS:
+            raise ValueError(f"Unknown input kind: {kind}")
+        dataset_id = self.dataset_id(kind, source)
+        found = self.get(dataset_id)
+        if found is not None:
+            return found, True
+
+        df = read_input(source, kind)
+        os.makedirs(self.root, exist_ok=True)
+        data_path, meta_path = self._paths(dataset_id)
+        meta = {
+            "dataset_id": dataset_id,
+            "kind": kind,
+            "rows": len(df),
+            "columns": [str(c) for c in df.columns],
+            "bytes": 0,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".arrow.tmp")
+        os.close(fd)
+        try:
+            write_table(df, tmp, ARROW_FILE)
+            meta["bytes"] = os.path.getsize(tmp)
+            os.replace(tmp, data_path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        # The metadata goes last: a dataset exists once both files do
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".json.tmp")
+        with os.fdopen(fd, "w") as fh:
+            json.dump(meta, fh)
+        os.replace(tmp, meta_path)
+        return Dataset(dataset_id, data_path, meta), False
+
+    def get(self, dataset_id):
+        """The stored dataset with this ID, or None"""
+        if not DATASET_ID_RE.match(dataset_id or ""):
+            return None
+        data_path, meta_path = self._paths(dataset_id)
+        try:
+            with open(meta_path) as fh:
+                meta = json.load(fh)
+        except FileNotFoundError:
+            return None
+        if not os.path.exists(data_path):
+            return None
+        return Dataset(dataset_id, data_path, meta)
+
+    def list(self, kind=None):
+        """Metadata of the stored datasets, newest first"""
+        if not os.path.isdir(self.root):
+            return []
+        found = []
+        for name in os.listdir(self.root):
+            dataset = name.endswith(".json") and self.get(name[: -len(".json")])
+            if dataset and (kind is None or dataset.kind == kind):
+                found.append(dataset.meta)
+        return sorted(found, key=lambda m: m["created"], reverse=True)
+
+    def delete(self, dataset_id):
+        """Remove a dataset; returns whether it existed"""
+        if self.get(dataset_id) is None:
+            return False
+        for path in reversed(self._paths(dataset_id)):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        return True
@@ -0,0 +1,104 @@
+"""Per-train breakdown of the priority score from the kept fleet state.
+
+The priority score is the min-max normalised weighted sum of the feature
+scores. `explain_trains` lays that sum out for the requested trains: each
+score's raw feature value, the bounds it was normalised against, the
+score, its weight and its signed contribution, then the sum, its bounds
+and the train's rank position. Values are read from the state's feature
+and score frames for the requested rows only; nothing is rescored.
+"""
+
+import numpy as np
+
+from .scoring import eligibility, mileage_bounds, shunt_bounds
+
+# Score column -> (raw value column, weight name, sign in the sum)
+CONTRIBUTIONS = {
+    "fitness_score": ("fitness_priority_raw", "W_FITNESS", 1.0),
+    "job_score": ("open_wo_hours", "W_JOB", 1.0),
+    "branding_score": ("branding_hours", "W_BRANDING", 1.0),
+    "mileage_score": ("cumulative_km", "W_MILEAGE", 1.0),
+    "cleaning_score": ("cleaning_score_raw", "W_CLEAN", 1.0),
+    "shunt_penalty": ("shunt_depth", "SHUNT_LAMBDA", -1.0),
+}
+
+# How each score is scaled from its raw value
+SCALING = {
+    "fitness_score": "minmax",
+    "job_score": "inverted_minmax",
+    "branding_score": "minmax",
+    "mileage_score": "mean_deviation",
+    "cleaning_score": "minmax",
+    "shunt_penalty": "max",
+}
+
+
+def _number(value):
+    value = float(value)
+    return None if np.isnan(value) else value
+
+
+def _bounds(state, col):
+    bounds = state.bounds.get(col)
+    if bounds is None:
+        # States saved before these bounds were kept
+        raw = state.features[CONTRIBUTIONS[col][0]].to_numpy(dtype=float)
+        bounds = mileage_bounds(raw) if col == "mileage_score" else shunt_bounds(raw)
+    lo, hi = bounds
+    if SCALING.get(col) == "mean_deviation":
+        return {"mean": _number(lo), "scale": _number(hi)}
+    return {"min": _number(lo), "max": _number(hi)}
+
+
+def _column(state, col, rows):
+    frame = state.scores if col in state.scores.columns else state.features
+    return frame[col].to_numpy(dtype=float)[rows]
+
+
+def explain_trains(state, rows):
+    """Score breakdown of the trains at `rows` of `state.features`"""
+    rows = np.asarray(rows, dtype=np.int64)
+    weights = state.weights
+    positions = state.positions()[rows]
+    eligible = eligibility(state.features.iloc[rows])
+    train_ids = state.features["train_id"].to_numpy()[rows]
+    priority = _column(state, "priority_score", rows)
+    combined = state.combined[rows]
+    combined_bounds = _bounds(state, "priority_score")
+
+    columns = {}
+    for col, (raw, weight, sign) in CONTRIBUTIONS.items():
+        score = _column(state, col, rows)
+        columns[col] = (
+            _column(state, raw, rows),
+            score,
+            sign * weights[weight] * score,
+            _bounds(state, col),
+        )
+
+    explained = []
+    for i in range(len(rows)):
+        contributions = {
+            col: {
+                "raw": _number(raw[i]),
+                "scaling": SCALING[col],
+                "bounds": bounds,
+                "score": _number(score[i]),
+                "weight": CONTRIBUTIONS[col][1],
+                "weight_value": weights[CONTRIBUTIONS[col][1]],
+                "contribution": _number(contribution[i]),
+            }
+            for col, (raw, score, contribution, bounds) in columns.items()
+        }
+        explained.append(
+            {
+                "train_id": str(train_ids[i]),
+                "rank": int(positions[i]) + 1,
+                "eligible": bool(eligible[i]),
+                "priority_score": _number(priority[i]),
+                "combined_score": _number(combined[i]),
+                "combined_bounds": combined_bounds,
+                "contributions": contributions,
+            }
+        )
+    return explained
@@ -0,0 +1,260 @@
+"""Rolling multi-night planning horizon.
+
+Ranks the fleet for every night of a horizon in one pass. Branding
+contracts, cleaning jobs and cleaning completions are indexed by the
+interval of nights they touch and laid out on a `(trains, nights)` grid
+once, so each night's active set is a column lookup and the tables are
+never re-scanned per night. Work orders, mileage and stabling carry no
+time dimension and are taken from the first night's features.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .scoring import (
+    PLANNING_TIME,
+    CLEAN_FRESHNESS_HORIZON_HOURS,
+    MISSING_FITNESS_DAYS,
+    MISSING_CLEAN_AGE_HOURS,
+    build_features,
+    compute_scores,
+    minmax_columns,
+    rank_orders,
+    resolve_weights,
+)
+from .cleaning import CleaningJobs, ticks
+from .timeparse import parse_timestamps
+
+DEFAULT_NIGHTS = 30
+MAX_NIGHTS = 90
+
+# Certificates this close to expiry count towards a night's upcoming cliff
+EXPIRING_SOON_DAYS = 7
+
+DAY = pd.Timedelta(days=1)
+DAY_NS = DAY.value
+DAY_TICKS = ticks(PLANNING_TIME + DAY) - ticks(PLANNING_TIME)
+
+
+def _train_codes(trains, train_ids):
+    """Position of each row's train in the fleet, -1 for unknown trains"""
+    return pd.Index(trains).get_indexer(train_ids)
+
+
+def _night_grid(codes, nights, values, n, num_nights):
+    """Sum `values` into a `(n, num_nights)` grid at `(codes, nights)`"""
+    keep = (codes >= 0) & (nights >= 0) & (nights < num_nights)
+    grid = np.zeros((n, num_nights))
+    np.add.at(grid, (codes[keep], nights[keep]), values[keep])
+    return grid
+
+
+def branding_grid(branding_df, trains, start, num_nights):
+    """Required exposure hours per train and night.
+
+    Each contract covers the interval of nights between its start and end
+    dates; it is added at the first night and removed after the last one,
+    and a running sum over nights yields the active hours.
+    """
+    n = len(trains)
+    if branding_df is None or branding_df.empty:
+        return np.zeros((n, num_nights))
+    today = start.normalize()
+    first = (
+        parse_timestamps(branding_df["start_date"], "start_date").dt.normalize() - today
+    ) // DAY
+    last = (
+        parse_timestamps(branding_df["end_date"], "end_date").dt.normalize() - today
+    ) // DAY
+    first = first.to_numpy(dtype=float, na_value=np.nan)
+    last = last.to_numpy(dtype=float, na_value=np.nan)
+    hours = pd.to_numeric(
+        branding_df["required_exposure_hours_per_day"], errors="coerce"
+    ).to_numpy(dtype=float, na_value=np.nan)
+    codes = _train_codes(trains, branding_df["train_id"])
+
+    valid = (
+        (codes >= 0)
+        & ~np.isnan(first)
+        & ~np.isnan(last)
+        & ~np.isnan(hours)
+        & (last >= np.maximum(first, 0))
+        & (first < num_nights)
+    )
+    codes, hours = codes[valid], hours[valid]
+    opens = np.maximum(first[valid], 0).astype(np.int64)
+    closes = np.minimum(last[valid], num_nights - 1).astype(np.int64) + 1
+    delta = np.zeros((n, num_nights + 1))
+    np.add.at(delta, (codes, opens), hours)
+    np.add.at(delta, (codes, closes), -hours)
+    return np.cumsum(delta[:, :num_nights], axis=1)
+
+
+def clean_load_grid(cleaning_df, trains, start, num_nights):
+    """Cleaning man-hours per train starting in each night's 24h window.
+
+    Returns the booked man-hours and those booked while the bay is
+    double-booked, as two `(trains, nights)` grids.
+    """
+    n = len(trains)
+    if cleaning_df is None or cleaning_df.empty:
+        return np.zeros((n, num_nights)), np.zeros((n, num_nights))
+    jobs = CleaningJobs(cleaning_df)
+    night = np.where(jobs.valid, (jobs.start - ticks(start)) // DAY_TICKS, -1)
+    codes = _train_codes(trains, cleaning_df["train_id"])
+    load = _night_grid(codes, night, jobs.hours * jobs.manpower, n, num_nights)
+    conflict = jobs.conflict_hours() * jobs.manpower
+    return load, _night_grid(codes, night, conflict, n, num_nights)
+
+
+def last_clean_grid(cleaning_df_prev, cleaning_df, trains, start, num_nights):
+    """End of the latest cleaning per train as of each night, in ns.
+
+    Completed cleanings apply from the first night; scheduled ones from the
+    first night at or after their end. Trains never cleaned hold the
+    minimum int64.
+    """
+    n = len(trains)
+    missing = np.iinfo(np.int64).min
+    grid = np.full((n, num_nights), missing, dtype=np.int64)
+    for df, completed in ((cleaning_df_prev, True), (cleaning_df, False)):
+        if df is None or df.empty:
+            continue
+        end = parse_timestamps(df["scheduled_end"], "scheduled_end").dt.as_unit("ns")
+        known = end.notna().to_numpy()
+        end_ns = end.to_numpy().view(np.int64)
+        night = np.zeros(len(df), dtype=np.int64)
+        if not completed:
+            # First night t with t >= end
+            night[known] = np.maximum(-((start.value - end_ns[known]) // DAY_NS), 0)
+        codes = _train_codes(trains, df["train_id"])
+        keep = (codes >= 0) & known & (night < num_nights)
+        np.maximum.at(grid, (codes[keep], night[keep]), end_ns[keep])
+    return np.maximum.accumulate(grid, axis=1)
+
+
+def plan_horizon(
+    fitness_df,
+    wo_df,
+    branding_df,
+    mileage_df,
+    cleaning_df,
+    stabling_df=None,
+    cleaning_df_prev=None,
+    start=PLANNING_TIME,
+    nights=DEFAULT_NIGHTS,
+    weights=None,
+):
+    """Rank the fleet for each of `nights` nights starting at `start`.
+
+    Returns `(summary, rankings)`: one row per night with eligible trains,
+    certificate expiries and branding hours at risk, and one row per night
+    and train in ranked order. Night 0 matches `rank_trains` at `start`.
+    """
+    if not 1 <= nights <= MAX_NIGHTS:
+        raise ValueError(f"Horizon must be between 1 and {MAX_NIGHTS} nights")
+    start = pd.Timestamp(start)
+    w = resolve_weights(weights)
+
+    # Time-independent features and scores come from the first night
+    base = build_features(
+        fitness_df,
+        wo_df,
+        branding_df,
+        mileage_df,
+        cleaning_df,
+        stabling_df=stabling_df,
+        cleaning_df_prev=cleaning_df_prev,
+        planning_time=start,
+    )
+    base_scores = compute_scores(base, w)
+    trains = base["train_id"].to_numpy()
+    n = len(trains)
+    offsets = np.arange(nights)
+    night_times = pd.date_range(start, periods=nights, freq=DAY).as_unit("ns")
+
+    if "fitness_valid_till" in base.columns:
+        first_days = (base["fitness_valid_till"] - start) // DAY
+        first_days = first_days.to_numpy(dtype=float, na_value=np.nan)[:, None]
+        days = np.where(
+            np.isnan(first_days), MISSING_FITNESS_DAYS, first_days - offsets
+        )
+    else:
+        days = np.zeros((n, nights))
+    fitness_days_left = np.maximum(days, 0)
+
+    branding = branding_grid(branding_df, trains, start, nights)
+    clean_load, clean_conflict = clean_load_grid(cleaning_df, trains, start, nights)
+    last_clean = last_clean_grid(cleaning_df_prev, cleaning_df, trains, start, nights)
+    no_clean = last_clean == np.iinfo(np.int64).min
+    elapsed = night_times.asi8[None, :] - np.where(no_clean, 0, last_clean)
+    age = np.where(no_clean, MISSING_CLEAN_AGE_HOURS, elapsed / 1e9 / 3600.0)
+    freshness = np.clip(
+        1.0
+        - np.minimum(age, CLEAN_FRESHNESS_HORIZON_HOURS)
+        / CLEAN_FRESHNESS_HORIZON_HOURS,
+        0.0,
+        1.0,
+    )
+
+    # Same arithmetic as `compute_scores`, one column per night
+    fitness_score = minmax_columns(1.0 / (1.0 + fitness_days_left))
+    job_score = base_scores["job_score"].to_numpy()[:, None]
+    branding_score = minmax_columns(branding)
+    mileage_score = base_scores["mileage_score"].to_numpy()[:, None]
+    clean_today_penalty = minmax_columns(clean_load + clean_conflict)
+    cleaning_score = minmax_columns(
+        np.clip(
+            freshness * (1.0 - w["CLEAN_UPCOMING_ALPHA"] * clean_today_penalty),
+            0.0,
+            1.0,
+        )
+    )
+    shunt_penalty = base_scores["shunt_penalty"].to_numpy()[:, None]
+    combined = (
+        w["W_FITNESS"] * fitness_score
+        + w["W_JOB"] * job_score
+        + w["W_BRANDING"] * branding_score
+        + w["W_MILEAGE"] * mileage_score
+        + w["W_CLEAN"] * cleaning_score
+    ) - w["SHUNT_LAMBDA"] * shunt_penalty
+    priority = minmax_columns(combined)
+
+    open_work = (base["open_wo_hours"].to_numpy() > 0)[:, None]
+    eligible = (fitness_days_left > 0) & ~open_work
+    orders = rank_orders(eligible, priority)
+
+    fit = fitness_days_left > 0
+    expiring = fit & (fitness_days_left <= EXPIRING_SOON_DAYS)
+    expired_tonight = ~fit & np.concatenate(
+        [np.zeros((n, 1), dtype=bool), fit[:, :-1]], axis=1
+    )
+    summary = pd.DataFrame(
+        {
+            "night": night_times,
+            "eligible_trains": eligible.sum(axis=0),
+            "certificate_expiries": expired_tonight.sum(axis=0),
+            "expiring_soon": expiring.sum(axis=0),
+            "branded_trains": (branding > 0).sum(axis=0),
+            "branding_hours_required": branding.sum(axis=0),
+            "branding_hours_at_risk": np.where(eligible, 0.0, branding).sum(axis=0),
+            "clean_load_hours": clean_load.sum(axis=0),
+        }
+    )
+
+    cols = orders.T.ravel()
+    nights_idx = np.repeat(offsets, n)
+    rankings = pd.DataFrame(
+        {
+            "night": night_times[nights_idx],
+            "rank": np.tile(np.arange(1, n + 1), nights),
+            "train_id": trains[cols],
+            "priority_score": priority[cols, nights_idx],
+            "eligible": eligible[cols, nights_idx],
+            "fitness_days_left": fitness_days_left[cols, nights_idx],
+            "branding_hours": branding[cols, nights_idx],
+            "today_clean_load": clean_load[cols, nights_idx],
+            "clean_age_hours": age[cols, nights_idx],
+        }
+    )
+    return summary, rankings
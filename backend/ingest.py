@@ -0,0 +1,484 @@
+"""Chunked streaming ingestion for the large history exports.
+
+Mileage logs, Maximo work orders and fitness certificates can span years of
+history. The aggregates here fold such files chunk by chunk into per-train
+running state, so peak memory is bounded by fleet size, not history length.
+Mileage keeps a little more: each train's readings inside the longest span
+its features look back over (the widest rolling window, or back to its
+last maintenance if that is earlier), plus the reading in force at its
+start.
+"""
+
+import csv
+import os
+
+import numpy as np
+import pandas as pd
+
+from .metrics import span, timed
+from .mileage_store import DAY_SECONDS, WINDOWS, MileageStore, seconds
+from .scoring import (
+    PLANNING_TIME,
+    aggregate_branding,
+    aggregate_clean_load,
+    aggregate_fitness,
+    aggregate_last_clean,
+    aggregate_maintenance,
+    aggregate_stabling,
+    aggregate_work_orders,
+    assemble_features,
+    collect_train_ids,
+)
+
+DEFAULT_CHUNKSIZE = 500_000
+
+TEXT = "str"
+NUMBER = "float64"
+
+# Columns the scorer (and the fleet state keys) read from each input kind
+# and their types; any other column of an export is skipped while parsing.
+# Timestamps are kept as text for the stages that parse them.
+INPUT_SCHEMAS = {
+    "fitness_certificates": {"cert_id": TEXT, "train_id": TEXT, "valid_to": TEXT},
+    "work_order_maximo": {
+        "wo_id": TEXT,
+        "train_id": TEXT,
+        "status": TEXT,
+        "estimated_hours": NUMBER,
+        "closed_at": TEXT,
+    },
+    "branding_schedule": {
+        "train_id": TEXT,
+        "start_date": TEXT,
+        "end_date": TEXT,
+        "required_exposure_hours_per_day": NUMBER,
+    },
+    "mileage_logs": {
+        "train_id": TEXT,
+        "recorded_at": TEXT,
+        "odometer_km": NUMBER,
+        "delta_km": NUMBER,
+    },
+    "cleaning_schedule": {
+        "bay_id": TEXT,
+        "train_id": TEXT,
+        "scheduled_start": TEXT,
+        "scheduled_end": TEXT,
+        "cleaning_type": TEXT,
+        "manpower_required": NUMBER,
+    },
+    "stabling_layout": {"train_id": TEXT, "position": TEXT, "track_type": TEXT},
+    "cleaning_schedule_prev": {
+        "train_id": TEXT,
+        "scheduled_start": TEXT,
+        "scheduled_end": TEXT,
+    },
+}
+INPUT_COLUMNS = {kind: list(schema) for kind, schema in INPUT_SCHEMAS.items()}
+
+CSV = "csv"
+PARQUET = "parquet"
+ARROW_FILE = "arrow"
+ARROW_STREAM = "arrow_stream"
+TABLE_EXTENSIONS = {
+    ".parquet": PARQUET,
+    ".feather": ARROW_FILE,
+    ".arrow": ARROW_FILE,
+    ".arrows": ARROW_STREAM,
+    ".csv": CSV,
+}
+
+
+def _text_dtypes(kind, columns):
+    """Chunk dtypes keeping the declared text columns of `kind` as `str`.
+
+    Train IDs such as `001` would otherwise be read as numbers and never
+    match the same train in the other inputs.
+    """
+    schema = INPUT_SCHEMAS[kind]
+    return {c: str for c in columns if schema.get(c) == TEXT}
+
+
+class StreamingAggregate:
+    """Per-train running aggregate fed one chunk at a time"""
+
+    columns = ("train_id",)
+    dtypes = {"train_id": str}
+
+    def __init__(self):
+        self.train_ids = pd.Index([], dtype=object)
+        self.rows = 0
+
+    def update(self, chunk):
+        self.rows += len(chunk)
+        seen = pd.Index(chunk["train_id"].dropna().unique())
+        self.train_ids = self.train_ids.union(seen, sort=False)
+        self._fold(chunk)
+
+    def _fold(self, chunk):
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+
+class FitnessAggregate(StreamingAggregate):
+    """Minimum certificate `valid_to` per train"""
+
+    columns = ("train_id", "valid_to")
+    dtypes = _text_dtypes("fitness_certificates", columns)
+
+    def __init__(self):
+        super().__init__()
+        self.valid_till = None
+
+    def _fold(self, chunk):
+        chunk_min = aggregate_fitness(chunk)
+        if chunk_min is None:
+            return
+        if self.valid_till is None:
+            self.valid_till = chunk_min
+        else:
+            both = pd.concat([self.valid_till, chunk_min])
+            self.valid_till = both.groupby(level=0).min()
+
+    def result(self):
+        return self.valid_till
+
+
+class WorkOrderAggregate(StreamingAggregate):
+    """Open work-order count and estimated hours, and last maintenance, per train"""
+
+    columns = ("train_id", "status", "estimated_hours", "closed_at")
+    dtypes = _text_dtypes("work_order_maximo", columns)
+
+    def __init__(self, planning_time=PLANNING_TIME):
+        super().__init__()
+        self.planning_time = planning_time
+        self.open_orders = None
+        self.last_maintenance = None
+
+    def _fold(self, chunk):
+        chunk_done = aggregate_maintenance(chunk, self.planning_time)
+        if chunk_done is not None and not chunk_done.empty:
+            if self.last_maintenance is None:
+                self.last_maintenance = chunk_done
+            else:
+                both = pd.concat([self.last_maintenance, chunk_done])
+                self.last_maintenance = both.groupby(level=0).max()
+        chunk_open = aggregate_work_orders(chunk)
+        if chunk_open is None or chunk_open.empty:
+            return
+        if self.open_orders is None:
+            self.open_orders = chunk_open
+        else:
+            self.open_orders = self.open_orders.add(chunk_open, fill_value=0)
+
+    def result(self):
+        if self.open_orders is None:
+            return None
+        out = self.open_orders.copy()
+        out["open_wo_count"] = out["open_wo_count"].astype(int)
+        return out
+
+
+class MileageAggregate(StreamingAggregate):
+    """Odometer history per train, kept in an in-memory `MileageStore`.
+
+    A `history` store seeds it with the readings kept from earlier runs,
+    whose segments are read as they are. Chunks are merged into one more
+    segment, so readings are ordered the same way the in-memory path
+    orders them: missing timestamps sort last and later rows win ties.
+
+    With a `planning_time`, `since` (each train's last maintenance) is
+    final, and readings the features at that time cannot read are dropped
+    as chunks arrive: a train keeps those after the start of the widest
+    window or its last maintenance, whichever is earlier, and the last
+    one before.
+    """
+
+    columns = ("train_id", "recorded_at", "odometer_km", "delta_km")
+    dtypes = _text_dtypes("mileage_logs", columns)
+
+    def __init__(self, history=None, planning_time=None, since=None):
+        super().__init__()
+        self.store = MileageStore() if history is None else history.with_rows()
+        self.history = len(self.store.segments)
+        self.planning_time = planning_time
+        self.since = since
+
+    def _bounds(self, trains):
+        now = seconds([pd.Timestamp(self.planning_time).to_datetime64()])[0]
+        bounds = np.full(len(trains), now - max(WINDOWS.values()) * DAY_SECONDS)
+        if self.since is not None:
+            since = seconds(self.since.reindex(trains).to_numpy())
+            bounds = np.minimum(bounds, since)
+        return bounds
+
+    def _fold(self, chunk):
+        keep = [c for c in self.columns if c in chunk.columns]
+        bounds = None if self.planning_time is None else self._bounds
+        self.store.fold(chunk[keep], first=self.history, bounds=bounds)
+
+    def result(self, planning_time=PLANNING_TIME, since=None, trains=None):
+        """Latest reading and window kilometres; `since` is last maintenance.
+
+        Only `trains` (by default every train with readings) are computed.
+        """
+        if len(self.store) == 0:
+            return None
+        trains = self.store.trains if trains is None else pd.Index(trains, dtype=object)
+        if since is not None:
+            since = since.reindex(trains).to_numpy()
+        return self.store.features(trains, planning_time, since)
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Reading Parquet or Arrow input requires `pyarrow`")
+    return pyarrow
+
+
+def _pyarrow_csv():
+    """pyarrow with its CSV reader, or None when it is not installed"""
+    try:
+        import pyarrow
+        import pyarrow.csv
+    except ImportError:
+        return None
+    return pyarrow
+
+
+def sniff_format(source):
+    """Detect CSV, Parquet or Arrow IPC (file or stream) from magic bytes"""
+    if isinstance(source, str):
+        with open(source, "rb") as fh:
+            head = fh.read(8)
+    else:
+        source.seek(0)
+        head = source.read(8)
+        source.seek(0)
+    if head[:4] == b"PAR1":
+        return PARQUET
+    if head[:6] == b"ARROW1":
+        return ARROW_FILE
+    if head[:4] == b"\xff\xff\xff\xff":
+        return ARROW_STREAM
+    return CSV
+
+
+def _present(names, columns):
+    return None if columns is None else [c for c in columns if c in names]
+
+
+def _csv_header(source):
+    """Column names on the first line of a CSV path or file object"""
+    if isinstance(source, str):
+        with open(source, "rb") as fh:
+            line = fh.readline()
+    else:
+        source.seek(0)
+        line = source.readline()
+        source.seek(0)
+    if isinstance(line, bytes):
+        line = line.decode("utf-8-sig")
+    return next(csv.reader([line]), [])
+
+
+def read_csv(source, columns=None, schema=None):
+    """Parse a CSV path or file object, keeping only `columns`.
+
+    Declared `schema` types are applied while parsing instead of being
+    inferred. The file is handed to pyarrow's multithreaded reader as is
+    (pandas when pyarrow is missing). A numeric column holding text is
+    read as text and left for the scorer to coerce.
+    """
+    wanted = _present(_csv_header(source), columns)
+    schema = {c: t for c, t in (schema or {}).items() if wanted is None or c in wanted}
+    pa = _pyarrow_csv()
+    if pa is None:
+        try:
+            return pd.read_csv(source, usecols=wanted, dtype=schema or None)
+        except ValueError:
+            if hasattr(source, "seek"):
+                source.seek(0)
+        return pd.read_csv(source, usecols=wanted, dtype=TEXT)
+
+    types = {TEXT: pa.string(), NUMBER: pa.float64()}
+
+    def parse(column_types):
+        if hasattr(source, "seek"):
+            source.seek(0)
+        options = pa.csv.ConvertOptions(
+            include_columns=wanted,
+            column_types=column_types,
+            strings_can_be_null=True,
+        )
+        return pa.csv.read_csv(
+            source,
+            read_options=pa.csv.ReadOptions(use_threads=True),
+            convert_options=options,
+        )
+
+    try:
+        table = parse({c: types[t] for c, t in schema.items()})
+    except pa.ArrowInvalid:
+        table = parse({c: pa.string() for c in schema})
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return table.to_pandas()
+
+
+def _arrow_batches(source, fmt, columns=None, batch_size=DEFAULT_CHUNKSIZE):
+    """Record batches of a Parquet or Arrow IPC source, projected to `columns`"""
+    pa = _pyarrow()
+    if fmt == PARQUET:
+        pf = pa.parquet.ParquetFile(source)
+        wanted = _present(pf.schema_arrow.names, columns)
+        yield from pf.iter_batches(batch_size=batch_size, columns=wanted)
+        return
+    if fmt == ARROW_FILE:
+        reader = pa.ipc.open_file(source)
+        wanted = _present(reader.schema.names, columns)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            yield batch if wanted is None else batch.select(wanted)
+        return
+    reader = pa.ipc.open_stream(source)
+    wanted = _present(reader.schema.names, columns)
+    for batch in reader:
+        yield batch if wanted is None else batch.select(wanted)
+
+
+def read_table(source, columns=None, fmt=None, schema=None):
+    """Read a CSV, Parquet or Arrow IPC table from a path or file object.
+
+    Only `columns` (those that exist) are read; CSV columns are parsed
+    with the types in `schema`.
+    """
+    fmt = fmt or sniff_format(source)
+    if fmt == CSV:
+        return read_csv(source, columns, schema)
+    pa = _pyarrow()
+    if fmt == PARQUET:
+        schema = pa.parquet.read_schema(source)
+        if not isinstance(source, str):
+            source.seek(0)
+        return pd.read_parquet(source, columns=_present(schema.names, columns))
+    batches = list(_arrow_batches(source, fmt, columns))
+    if not batches:
+        return pd.DataFrame(columns=columns or [])
+    return pa.Table.from_batches(batches).to_pandas()
+
+
+def read_input(source, kind, fmt=None):
+    """Read an export of the given input kind with its declared schema"""
+    return read_table(source, INPUT_COLUMNS.get(kind), fmt, INPUT_SCHEMAS.get(kind))
+
+
+def write_table(df, path, fmt=None):
+    """Write `df` as CSV, Parquet or Feather (Arrow IPC), by extension or `fmt`"""
+    fmt = fmt or TABLE_EXTENSIONS.get(os.path.splitext(path)[1].lower(), CSV)
+    if fmt == CSV:
+        df.to_csv(path, index=False)
+    elif fmt == PARQUET:
+        _pyarrow()
+        df.to_parquet(path, index=False)
+    elif fmt == ARROW_FILE:
+        _pyarrow()
+        df.reset_index(drop=True).to_feather(path)
+    else:
+        raise ValueError(f"Unsupported output format: {fmt}")
+    return path
+
+
+def stream_table(source, aggregate, chunksize=DEFAULT_CHUNKSIZE):
+    """Feed a CSV, Parquet or Arrow IPC source through `aggregate` in chunks"""
+    fmt = sniff_format(source)
+    if fmt == CSV:
+        return stream_csv(source, aggregate, chunksize)
+    for batch in _arrow_batches(source, fmt, list(aggregate.columns), chunksize):
+        aggregate.update(batch.to_pandas())
+    return aggregate
+
+
+def stream_csv(source, aggregate, chunksize=DEFAULT_CHUNKSIZE):
+    """Feed a CSV path or file object through `aggregate` in chunks"""
+    wanted = set(aggregate.columns)
+    reader = pd.read_csv(
+        source,
+        usecols=lambda c: c in wanted,
+        dtype=aggregate.dtypes,
+        chunksize=chunksize,
+    )
+    with reader:
+        for chunk in reader:
+            aggregate.update(chunk)
+    return aggregate
+
+
+def stream_features(
+    fitness_source,
+    wo_source,
+    branding_df,
+    mileage_source,
+    cleaning_df,
+    stabling_df=None,
+    cleaning_df_prev=None,
+    planning_time=PLANNING_TIME,
+    chunksize=DEFAULT_CHUNKSIZE,
+    mileage_store=None,
+):
+    """Build the per-train feature frame, streaming the three history exports.
+
+    The fitness, work-order and mileage sources are CSV, Parquet or Arrow
+    IPC paths or file objects read in chunks; the small schedule tables are
+    DataFrames. A `mileage_store` adds its odometer history to the log.
+    """
+
+    def stream(name, source, aggregate):
+        with span(name) as s:
+            stream_table(source, aggregate, chunksize)
+            s.rows = aggregate.rows
+        return aggregate
+
+    fitness = stream("stream_fitness", fitness_source, FitnessAggregate())
+    work_orders = stream(
+        "stream_work_orders", wo_source, WorkOrderAggregate(planning_time)
+    )
+    # The last maintenance per train tells which readings can be dropped
+    mileage = stream(
+        "stream_mileage",
+        mileage_source,
+        MileageAggregate(mileage_store, planning_time, work_orders.last_maintenance),
+    )
+
+    small_ids = collect_train_ids(branding_df, cleaning_df, stabling_df)
+    streamed_ids = fitness.train_ids.union(work_orders.train_ids, sort=False).union(
+        mileage.train_ids, sort=False
+    )
+    trains = np.array(
+        sorted(streamed_ids.union(pd.Index(small_ids), sort=False)), dtype=object
+    )
+
+    aggregates = {
+        "fitness": fitness.result(),
+        "work_orders": work_orders.result(),
+        "branding": timed(
+            "aggregate_branding", aggregate_branding, branding_df, planning_time
+        ),
+        "mileage": mileage.result(planning_time, work_orders.last_maintenance),
+        "last_clean": timed(
+            "aggregate_last_clean", aggregate_last_clean, cleaning_df_prev
+        ),
+        "clean_load": timed(
+            "aggregate_clean_load", aggregate_clean_load, cleaning_df, planning_time
+        ),
+        "stabling": timed("aggregate_stabling", aggregate_stabling, stabling_df),
+    }
+    with span("assemble_features", rows=len(trains)):
+        return assemble_features(trains, aggregates, planning_time)
@@ -0,0 +1,228 @@
+"""Bounded job queue that runs optimizations off the event loop.
+
+Jobs execute in a process pool so CPU-heavy pandas work never blocks the
+uvicorn event loop. Admission is bounded: once `max_pending` jobs are
+queued or running, new submissions are rejected with `QueueFull`. Jobs that
+share a key (the result cache key) are collapsed into one execution.
+Every job runs under a trace and its stage spans travel back with the
+result.
+"""
+
+import asyncio
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import BrokenExecutor, Future, ProcessPoolExecutor
+
+from .metrics import Traced, observe_spans, traced_call
+
+DEFAULT_RETENTION_SECONDS = 3600
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class QueueFull(Exception):
+    """Raised when the job queue is at capacity"""
+
+
+class Job:
+    """One submitted computation and, once finished, its result"""
+
+    def __init__(self, key=None, future=None, result=None):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.future = future
+        self.created_at = time.time()
+        self.finished_at = None if future is not None else self.created_at
+        self.result = result
+        self.error = None
+        self.cached = future is None
+        # Resolved once the outcome is recorded and the queue's completion
+        # callback (caching, publishing) has run
+        self._finished = Future()
+        if future is None:
+            self._finished.set_result(None)
+        # Stage spans (and profile) recorded by the worker that ran the job
+        self.spans = []
+        self.profile = None
+
+    @property
+    def status(self):
+        # Finished once `_finish` has stored the result, not when the future
+        # completes: its done callbacks run after that
+        if self.finished_at is not None:
+            return FAILED if self.error is not None else DONE
+        return RUNNING if self.future.running() else QUEUED
+
+    def done(self):
+        return self.status in (DONE, FAILED)
+
+    def _finish(self, future):
+        try:
+            error = future.exception()
+            if error is not None:
+                self.error = error
+            else:
+                result = future.result()
+                if isinstance(result, Traced):
+                    self.spans, self.profile = result.spans, result.profile
+                    result = result.value
+                self.result = result
+        finally:
+            self.finished_at = time.time()
+
+    async def wait(self, timeout=None):
+        """Wait for the job and its completion callback without blocking the
+        event loop; True if finished"""
+        if self._finished.done():
+            return True
+        try:
+            await asyncio.wait_for(
+                asyncio.shield(asyncio.wrap_future(self._finished)), timeout
+            )
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def describe(self):
+        info = {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+        if self.error is not None:
+            info["error"] = str(self.error)
+        return info
+
+
+class JobQueue:
+    """Process pool with bounded admission and per-key deduplication"""
+
+    def __init__(
+        self,
+        max_workers=None,
+        max_pending=None,
+        retention_seconds=DEFAULT_RETENTION_SECONDS,
+        executor_factory=ProcessPoolExecutor,
+    ):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending or 2 * self.max_workers
+        self.retention_seconds = retention_seconds
+        self._executor_factory = executor_factory
+        self._executor = None
+        self._jobs = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        # Created on first use so importing the module in a worker is cheap
+        if self._executor is None:
+            self._executor = self._executor_factory(max_workers=self.max_workers)
+        return self._executor
+
+    def _run(self, fn, args):
+        """Submit to the pool, replacing it if a crashed worker broke it.
+
+        Jobs running when the worker died fail with `BrokenProcessPool`;
+        later ones get a fresh pool.
+        """
+        try:
+            return self._pool().submit(traced_call, fn, *args)
+        except BrokenExecutor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+            return self._pool().submit(traced_call, fn, *args)
+
+    def _purge(self, now):
+        expired = [
+            job_id
+            for job_id, job in self._jobs.items()
+            if job.finished_at is not None
+            and now - job.finished_at > self.retention_seconds
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def pending(self):
+        """Number of jobs queued or running"""
+        with self._lock:
+            return len(self._in_flight)
+
+    def add_finished(self, result, key=None):
+        """Register an already available result (e.g. a cache hit) as a job"""
+        job = Job(key=key, result=result)
+        with self._lock:
+            self._purge(time.time())
+            self._jobs[job.id] = job
+        return job
+
+    def submit(self, key, fn, *args, on_done=None):
+        """Queue `fn(*args)`; returns `(job, joined)`.
+
+        If a job with the same `key` is already in flight it is returned
+        instead (`joined` is True) and `fn` is not queued again.
+        """
+        return self.submit_many([(key, fn, args, on_done)])[0]
+
+    def submit_many(self, entries):
+        """Queue several `(key, fn, args, on_done)` entries at once.
+
+        Admission is all or nothing: if the entries that do not join an
+        in-flight job would overflow the queue, none are queued.
+        """
+        with self._lock:
+            self._purge(time.time())
+            fresh = {
+                key
+                for key, _, _, _ in entries
+                if key is None or key not in self._in_flight
+            }
+            new_jobs = sum(1 for key, _, _, _ in entries if key is None) + len(
+                fresh - {None}
+            )
+            if len(self._in_flight) + new_jobs > self.max_pending:
+                raise QueueFull(f"Job queue is full ({self.max_pending} jobs pending)")
+            submitted = []
+            for key, fn, args, on_done in entries:
+                if key is not None and key in self._in_flight:
+                    submitted.append((self._in_flight[key], True, None))
+                    continue
+                future = self._run(fn, args)
+                job = Job(key=key, future=future)
+                flight_key = key if key is not None else job.id
+                self._jobs[job.id] = job
+                self._in_flight[flight_key] = job
+                submitted.append((job, False, (flight_key, on_done)))
+
+        for job, joined, callback in submitted:
+            if not joined:
+                job.future.add_done_callback(self._finisher(job, *callback))
+        return [(job, joined) for job, joined, _ in submitted]
+
+    def _finisher(self, job, flight_key, on_done):
+        def finished(future):
+            try:
+                job._finish(future)
+                observe_spans(job.spans)
+                with self._lock:
+                    self._in_flight.pop(flight_key, None)
+                if on_done is not None:
+                    on_done(job)
+            finally:
+                job._finished.set_result(None)
+
+        return finished
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,526 @@
+"""Stage timing spans, latency histograms and opt-in profiles.
+
+A `Trace` collects the spans of one request or job. `span()` marks a
+stage with its wall time and row count; with no active trace it costs a
+context variable lookup, so the pipeline is instrumented unconditionally.
+Peak memory per stage is only tracked (with `tracemalloc`) while a trace
+is being profiled.
+
+Finished spans feed process-wide histograms exposed in the Prometheus
+text format. Jobs run in worker processes return their spans with the
+result (`Traced`) so they can be recorded by the server.
+"""
+
+import bisect
+import cProfile
+import contextvars
+import io
+import json
+import marshal
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+PROFILE_TOP_FUNCTIONS = 40
+
+# Saved profiles kept in the profile directory; older ones are removed
+PROFILE_KEEP = 20
+
+_current = contextvars.ContextVar("galactus_trace", default=None)
+
+
+class Span:
+    """One timed stage: wall seconds, rows handled, rows rejected as bad
+    and peak traced bytes"""
+
+    __slots__ = (
+        "name",
+        "seconds",
+        "rows",
+        "bad_rows",
+        "peak_bytes",
+        "_start",
+        "_base",
+        "_peak",
+    )
+
+    def __init__(self, name, rows=None):
+        self.name = name
+        self.rows = rows
+        self.bad_rows = None
+        self.seconds = 0.0
+        self.peak_bytes = None
+        self._base = self._peak = 0
+
+    def to_dict(self):
+        out = {"name": self.name, "seconds": self.seconds}
+        if self.rows is not None:
+            out["rows"] = int(self.rows)
+        if self.bad_rows:
+            out["bad_rows"] = int(self.bad_rows)
+        if self.peak_bytes is not None:
+            out["peak_bytes"] = self.peak_bytes
+        return out
+
+
+# Handed out when no trace is active so callers can still set `rows`
+_NULL_SPAN = Span("")
+
+
+class Trace:
+    """Spans recorded while the trace is active, in completion order.
+
+    `remote` holds spans recorded elsewhere (a worker process) that belong
+    to the same request; they are reported but not observed again.
+    """
+
+    def __init__(self, memory=False):
+        self.spans = []
+        self.remote = []
+        self.memory = memory
+        self.profile = None
+        self._stack = []
+        self._lock = threading.Lock()
+
+    def _open(self, s):
+        if self.memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                parent = self._stack[-1]
+                parent._peak = max(parent._peak, peak)
+            tracemalloc.reset_peak()
+            s._base = s._peak = current
+        self._stack.append(s)
+        s._start = time.perf_counter()
+
+    def _close(self, s):
+        s.seconds = time.perf_counter() - s._start
+        if self._stack and self._stack[-1] is s:
+            self._stack.pop()
+        if self.memory and tracemalloc.is_tracing():
+            s._peak = max(s._peak, tracemalloc.get_traced_memory()[1])
+            s.peak_bytes = s._peak - s._base
+            if self._stack:
+                parent = self._stack[-1]
+                parent._peak = max(parent._peak, s._peak)
+        with self._lock:
+            self.spans.append(s.to_dict())
+
+    def attach(self, spans):
+        """Add spans recorded in another process to this trace's report"""
+        with self._lock:
+            self.remote.extend(spans)
+
+    def all_spans(self):
+        return self.spans + self.remote
+
+
+@contextmanager
+def tracing(memory=False):
+    """Activate a new trace for the enclosed block and yield it"""
+    trace = Trace(memory)
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+def current_trace():
+    return _current.get()
+
+
+@contextmanager
+def span(name, rows=None):
+    """Time the enclosed stage in the active trace, if there is one"""
+    trace = _current.get()
+    if trace is None:
+        yield _NULL_SPAN
+        return
+    s = Span(name, rows)
+    trace._open(s)
+    try:
+        yield s
+    finally:
+        trace._close(s)
+
+
+def timed(name, fn, df, *args, **kwargs):
+    """`fn(df, *args)` inside a span counting the rows of `df`"""
+    with span(name, rows=0 if df is None or isinstance(df, str) else len(df)):
+        return fn(df, *args, **kwargs)
+
+
+def attach_spans(spans):
+    """Report spans from a worker with the current request, if traced"""
+    trace = _current.get()
+    if trace is not None and spans:
+        trace.attach(spans)
+
+
+def server_timing(spans, total=None):
+    """`Server-Timing` header value for a list of span dicts.
+
+    Stages that rejected input rows say how many in their description.
+    """
+    entries = [
+        f"{s['name']};dur={s['seconds'] * 1e3:.2f}"
+        + (f';desc="bad_rows={s["bad_rows"]}"' if s.get("bad_rows") else "")
+        for s in spans
+    ]
+    if total is not None:
+        entries.append(f"total;dur={total * 1e3:.2f}")
+    return ", ".join(entries)
+
+
+# Worker side
+
+
+class Traced:
+    """A job's return value with the spans (and profile) recorded for it"""
+
+    __slots__ = ("value", "spans", "profile")
+
+    def __init__(self, value, spans, profile=None):
+        self.value = value
+        self.spans = spans
+        self.profile = profile
+
+    def __getstate__(self):
+        return (self.value, self.spans, self.profile)
+
+    def __setstate__(self, state):
+        self.value, self.spans, self.profile = state
+
+
+def traced_call(fn, *args):
+    """Run `fn(*args)` under a fresh trace; returns a `Traced`"""
+    with tracing() as trace:
+        with span(getattr(fn, "__name__", "job")):
+            value = fn(*args)
+    return Traced(value, trace.spans, trace.profile)
+
+
+def profile_call(fn, *args):
+    """Run `fn(*args)` under cProfile with per-span peak memory.
+
+    The profile is kept on the active trace as marshalled `pstats` data.
+    """
+    trace = _current.get()
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    if trace is not None:
+        trace.memory = True
+    profiler = cProfile.Profile()
+    try:
+        with span(getattr(fn, "__name__", "profiled")):
+            profiler.enable()
+            try:
+                return fn(*args)
+            finally:
+                profiler.disable()
+    finally:
+        if started:
+            tracemalloc.stop()
+        if trace is not None:
+            trace.memory = False
+            profiler.create_stats()
+            trace.profile = marshal.dumps(profiler.stats)
+
+
+# Profile dumps
+
+
+def profile_dir():
+    from tempfile import gettempdir
+
+    return os.environ.get(
+        "GALACTUS_PROFILE_DIR", os.path.join(gettempdir(), "galactus-profiles")
+    )
+
+
+def save_profile(spans, stats, directory=None, keep=PROFILE_KEEP):
+    """Write a profile (`pstats` file plus spans JSON); returns its id.
+
+    Only the newest `keep` profiles are kept.
+    """
+    directory = directory or profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    profile_id = uuid.uuid4().hex
+    with open(os.path.join(directory, f"{profile_id}.prof"), "wb") as fh:
+        fh.write(stats or marshal.dumps({}))
+    with open(os.path.join(directory, f"{profile_id}.json"), "w") as fh:
+        json.dump({"spans": spans}, fh)
+    _prune_profiles(directory, keep, profile_id)
+    return profile_id
+
+
+def _prune_profiles(directory, keep, current):
+    saved = []
+    for name in os.listdir(directory):
+        if not name.endswith(".prof"):
+            continue
+        try:
+            saved.append((os.stat(os.path.join(directory, name)).st_mtime_ns, name))
+        except FileNotFoundError:
+            continue
+    for _, name in sorted(saved)[:-keep]:
+        profile_id = name[: -len(".prof")]
+        if profile_id == current:
+            continue
+        for suffix in (".prof", ".json"):
+            try:
+                os.unlink(os.path.join(directory, profile_id + suffix))
+            except FileNotFoundError:
+                pass
+
+
+def profile_path(profile_id, directory=None):
+    """Path of a saved `pstats` file, or None for unknown ids"""
+    if not profile_id.isalnum():
+        return None
+    path = os.path.join(directory or profile_dir(), f"{profile_id}.prof")
+    return path if os.path.exists(path) else None
+
+
+def load_profile(profile_id, directory=None, top=PROFILE_TOP_FUNCTIONS):
+    """Spans and the `top` functions by cumulative time of a saved profile"""
+    path = profile_path(profile_id, directory)
+    if path is None:
+        return None
+    with open(path[: -len(".prof")] + ".json") as fh:
+        report = json.load(fh)
+    stats = pstats.Stats(path, stream=io.StringIO())
+    rows = sorted(
+        stats.stats.items(), key=lambda item: item[1][3], reverse=True
+    )  # (cc, nc, tt, ct, callers)
+    report["functions"] = [
+        {
+            "function": f"{filename}:{line}({name})",
+            "calls": nc,
+            "total_seconds": tt,
+            "cumulative_seconds": ct,
+        }
+        for (filename, line, name), (_, nc, tt, ct, _) in rows[:top]
+    ]
+    return report
+
+
+# Prometheus metrics
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by label values"""
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [
+                    [0] * (len(self.buckets) + 1),
+                    0.0,
+                ]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: (list(c), s) for k, (c, s) in self._series.items()}
+        for values, (counts, total) in sorted(series.items()):
+            running = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                running += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _labels(self.labels + ("le",), values + (le,))
+                lines.append(f"{self.name}_bucket{labels} {running}")
+            labels = _labels(self.labels, values)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {running}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter keyed by label values"""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            lines.append(f"{self.name}{_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    """Last or maximum observed value keyed by label values"""
+
+    kind = "gauge"
+
+    def max(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = max(
+                self._values.get(label_values, value), value
+            )
+
+
+class Registry:
+    """The metrics of this process plus collectors sampled at render time"""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, fn):
+        """Register `fn() -> [(name, kind, help, value)]` sampled on render"""
+        self.collectors.append(fn)
+        return fn
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collect in self.collectors:
+            for name, kind, help, value in collect():
+                lines.extend(
+                    [
+                        f"# HELP {name} {help}",
+                        f"# TYPE {name} {kind}",
+                        f"{name} {value}",
+                    ]
+                )
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+REQUEST_SECONDS = REGISTRY.add(
+    Histogram(
+        "galactus_http_request_duration_seconds",
+        "Time to produce response headers",
+        ("method", "route", "status"),
+    )
+)
+STAGE_SECONDS = REGISTRY.add(
+    Histogram(
+        "galactus_stage_duration_seconds",
+        "Wall time of pipeline stages",
+        ("stage",),
+    )
+)
+STAGE_ROWS = REGISTRY.add(
+    Counter("galactus_stage_rows_total", "Input rows handled by stages", ("stage",))
+)
+STAGE_BAD_ROWS = REGISTRY.add(
+    Counter(
+        "galactus_stage_bad_rows_total",
+        "Input rows a stage could not parse and treated as missing",
+        ("stage",),
+    )
+)
+STAGE_PEAK_BYTES = REGISTRY.add(
+    Gauge(
+        "galactus_stage_peak_memory_bytes",
+        "Largest traced allocation peak of a stage in profiled runs",
+        ("stage",),
+    )
+)
+
+
+def observe_spans(spans):
+    """Feed finished span dicts into the stage metrics"""
+    for s in spans:
+        STAGE_SECONDS.observe(s["seconds"], s["name"])
+        if "rows" in s:
+            STAGE_ROWS.inc(s["rows"], s["name"])
+        if s.get("bad_rows"):
+            STAGE_BAD_ROWS.inc(s["bad_rows"], s["name"])
+        if s.get("peak_bytes") is not None:
+            STAGE_PEAK_BYTES.max(s["peak_bytes"], s["name"])
+
+
+def observe_request(method, route, status, seconds):
+    REQUEST_SECONDS.observe(seconds, method, route, str(status))
+
+
+@REGISTRY.collector
+def _process():
+    if resource is None:
+        return []
+    # ru_maxrss is in kilobytes on Linux
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return [
+        (
+            "galactus_process_max_rss_bytes",
+            "gauge",
+            "Peak resident set size of the server process",
+            rss,
+        )
+    ]
+
+
+def render_metrics():
+    return REGISTRY.render()
@@ -0,0 +1,467 @@
+"""Append-only odometer history per train with rolling-window queries.
+
+Readings live in columnar segments: `key`, `odometer_km` and `delta_km`
+arrays sorted by `key = code << 32 | seconds`, where `code` numbers the
+train in the store's dictionary and `seconds` is the reading time since
+the epoch. All readings of a train are therefore contiguous and in time
+order, and the reading in force at any time is one `searchsorted` away.
+Readings without a time sort after every timed reading of their train,
+and within a segment later rows win ties, matching how the scorer orders
+a mileage log. Across segments the later segment wins.
+
+A store with a directory writes each append as a new segment of `.npy`
+files and then atomically replaces `manifest.json` (train dictionary and
+segment list), so readers always see whole segments. Segments are opened
+memory-mapped; `compact` merges them into one. A store without a
+directory keeps its segments in memory. One process writes a store; any
+number may read it.
+"""
+
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+
+from .timeparse import parse_timestamps
+
+TIME_BITS = 32
+TIME_MASK = (1 << TIME_BITS) - 1
+# Key time of readings without a timestamp: after every real one
+UNTIMED = TIME_MASK
+
+# Rolling windows kept as features, in days
+WINDOWS = {"km_7d": 7, "km_30d": 30}
+DAY_SECONDS = 86_400
+
+# Appends beyond this many segments merge the store
+MAX_SEGMENTS = 32
+
+MANIFEST = "manifest.json"
+COLUMNS = ("key", "odometer_km", "delta_km")
+
+
+def seconds(values):
+    """Timestamps as int64 seconds since the epoch; `UNTIMED` where missing"""
+    values = np.asarray(values, dtype="datetime64[s]")
+    out = values.astype(np.int64)
+    known = ~np.isnat(values)
+    return np.where(known, np.clip(out, 0, UNTIMED - 1), UNTIMED)
+
+
+class Segment:
+    """One batch of readings sorted by key"""
+
+    def __init__(self, key, odometer_km, delta_km):
+        self.key = key
+        self.odometer_km = odometer_km
+        self.delta_km = delta_km
+
+    def __len__(self):
+        return len(self.key)
+
+    @classmethod
+    def from_rows(cls, codes, times, odometer_km, delta_km=None):
+        """Segment of the rows with a code (>= 0), in stable key order"""
+        codes = np.asarray(codes, dtype=np.int64)
+        odometer_km = np.asarray(odometer_km, dtype=float)
+        if delta_km is None:
+            delta_km = np.full(len(codes), np.nan)
+        keep = codes >= 0
+        key = (codes[keep] << TIME_BITS) | seconds(times)[keep]
+        order = np.argsort(key, kind="stable")
+        return cls(
+            key[order],
+            odometer_km[keep][order],
+            np.asarray(delta_km, dtype=float)[keep][order],
+        )
+
+    @classmethod
+    def load(cls, prefix, mmap=True):
+        mode = "r" if mmap else None
+        return cls(*(np.load(f"{prefix}.{col}.npy", mmap_mode=mode) for col in COLUMNS))
+
+    def save(self, prefix):
+        for col in COLUMNS:
+            np.save(f"{prefix}.{col}.npy", np.asarray(getattr(self, col)))
+
+
+def merge(segments):
+    """One segment holding every reading, later segments winning ties"""
+    if len(segments) == 1:
+        return segments[0]
+    if len(segments) == 2:
+        # A small batch into a large segment: insert it rather than re-sort
+        old, new = segments
+        at = np.searchsorted(old.key, new.key, side="right")
+        return Segment(
+            *(np.insert(getattr(old, col), at, getattr(new, col)) for col in COLUMNS)
+        )
+    merged = Segment(
+        *(np.concatenate([getattr(s, col) for s in segments]) for col in COLUMNS)
+    )
+    order = np.argsort(merged.key, kind="stable")
+    return Segment(*(getattr(merged, col)[order] for col in COLUMNS))
+
+
+class Readings:
+    """One reading per query: found flag, key time, odometer and delta"""
+
+    def __init__(self, n):
+        self.found = np.zeros(n, dtype=bool)
+        self.time = np.zeros(n, dtype=np.int64)
+        self.odometer_km = np.full(n, np.nan)
+        self.delta_km = np.full(n, np.nan)
+
+    def take(self, rows, segment, at):
+        self.found[rows] = True
+        self.time[rows] = segment.key[at] & TIME_MASK
+        self.odometer_km[rows] = segment.odometer_km[at]
+        self.delta_km[rows] = segment.delta_km[at]
+
+
+def last_at(segments, codes, upto):
+    """Each train's latest reading at or before `upto` seconds"""
+    codes = np.asarray(codes, dtype=np.int64)
+    upto = np.broadcast_to(np.asarray(upto, dtype=np.int64), codes.shape)
+    out = Readings(len(codes))
+    valid = codes >= 0
+    query = (np.maximum(codes, 0) << TIME_BITS) | upto
+    for segment in segments:
+        if len(segment) == 0:
+            continue
+        at = np.searchsorted(segment.key, query, side="right") - 1
+        safe = np.maximum(at, 0)
+        key = segment.key[safe]
+        hit = valid & (at >= 0) & ((key >> TIME_BITS) == codes)
+        hit &= ~out.found | ((key & TIME_MASK) >= out.time)
+        rows = np.flatnonzero(hit)
+        out.take(rows, segment, safe[rows])
+    return out
+
+
+def first_after(segments, codes, after, upto):
+    """Each train's earliest reading after `after` and at or before `upto`"""
+    codes = np.asarray(codes, dtype=np.int64)
+    after = np.broadcast_to(np.asarray(after, dtype=np.int64), codes.shape)
+    upto = np.broadcast_to(np.asarray(upto, dtype=np.int64), codes.shape)
+    out = Readings(len(codes))
+    valid = codes >= 0
+    query = (np.maximum(codes, 0) << TIME_BITS) | after
+    for segment in segments:
+        if len(segment) == 0:
+            continue
+        at = np.searchsorted(segment.key, query, side="right")
+        safe = np.minimum(at, len(segment) - 1)
+        key = segment.key[safe]
+        time = key & TIME_MASK
+        hit = valid & (at < len(segment)) & ((key >> TIME_BITS) == codes)
+        hit &= time <= upto
+        hit &= ~out.found | (time <= out.time)
+        rows = np.flatnonzero(hit)
+        out.take(rows, segment, safe[rows])
+    return out
+
+
+def km_between(segments, codes, start, end):
+    """Kilometres run by each train between `start` and `end` seconds.
+
+    The odometer at `start` is the last reading at or before it; a train
+    first seen inside the window starts from its first reading less that
+    reading's `delta_km`. Trains without readings, or with `start` of
+    `UNTIMED`, get NaN.
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    start = np.broadcast_to(np.asarray(start, dtype=np.int64), codes.shape)
+    stop = last_at(segments, codes, end)
+    base = last_at(segments, codes, start)
+    first = first_after(segments, codes, start, end)
+    odometer = np.where(
+        base.found,
+        base.odometer_km,
+        first.odometer_km - np.nan_to_num(first.delta_km, nan=0.0),
+    )
+    known = stop.found & (base.found | first.found) & (start != UNTIMED)
+    km = np.where(known, np.maximum(stop.odometer_km - odometer, 0.0), np.nan)
+    return km
+
+
+def latest(segments, codes):
+    """Each train's latest reading, untimed readings counting as latest"""
+    return last_at(segments, codes, UNTIMED)
+
+
+def mileage_features(segments, codes, now, since=None):
+    """Latest odometer reading and rolling-window kilometres per train.
+
+    `now` is the planning time; `since` the time of each train's last
+    maintenance. Without one, the whole odometer reading counts as run
+    since maintenance. Returns a dict of arrays and the trains with any
+    reading.
+    """
+    now = int(seconds([pd.Timestamp(now).to_datetime64()])[0])
+    last = latest(segments, codes)
+    out = {
+        "cumulative_km": np.nan_to_num(last.odometer_km, nan=0.0),
+        "delta_km": last.delta_km,
+    }
+    for name, days in WINDOWS.items():
+        km = km_between(segments, codes, now - days * DAY_SECONDS, now)
+        out[name] = np.nan_to_num(km, nan=0.0)
+    since = np.full(len(codes), UNTIMED) if since is None else seconds(since)
+    km = km_between(segments, codes, since, now)
+    out["km_since_maintenance"] = np.where(
+        since == UNTIMED, out["cumulative_km"], np.nan_to_num(km, nan=0.0)
+    )
+    return out, last.found
+
+
+def prune(segment, bounds):
+    """Drop the readings no query starting at `bounds` can read.
+
+    `bounds[code]` is the earliest key time a query for that train starts
+    at; the train keeps its readings after it and the last one at or
+    before it, which is what `last_at` would find there.
+    """
+    code = segment.key >> TIME_BITS
+    old = (segment.key & TIME_MASK) <= bounds[code]
+    keep = ~old
+    keep[:-1] |= old[:-1] & ~(old[1:] & (code[1:] == code[:-1]))
+    keep[-1:] |= old[-1:]
+    if keep.all():
+        return segment
+    return Segment(*(getattr(segment, col)[keep] for col in COLUMNS))
+
+
+def readings_frame(frame, codes):
+    """Segment of a mileage log whose rows are numbered by `codes`"""
+    times = parse_timestamps(frame["recorded_at"], "recorded_at").to_numpy()
+    odometer = pd.to_numeric(frame["odometer_km"], errors="coerce")
+    delta = None
+    if "delta_km" in frame.columns:
+        delta = pd.to_numeric(frame["delta_km"], errors="coerce").to_numpy(float)
+    return Segment.from_rows(codes, times, odometer.to_numpy(dtype=float), delta)
+
+
+class MileageStore:
+    """Odometer history of a fleet, in memory or in a directory"""
+
+    def __init__(self, root=None):
+        self.root = root
+        self.trains = pd.Index([], dtype=object)
+        self.segments = []
+        self.names = []
+        self.lock = threading.Lock()
+        if root is not None:
+            os.makedirs(root, exist_ok=True)
+            self._open()
+
+    def __len__(self):
+        return sum(len(s) for s in self.segments)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    @property
+    def version(self):
+        """Changes whenever readings are added or merged"""
+        return f"{len(self.trains)}:{'+'.join(self.names) or len(self)}"
+
+    def _open(self, attempts=3):
+        path = os.path.join(self.root, MANIFEST)
+        if not os.path.exists(path):
+            return
+        for attempt in range(attempts):
+            with open(path) as fh:
+                manifest = json.load(fh)
+            try:
+                segments = [
+                    Segment.load(os.path.join(self.root, name))
+                    for name in manifest["segments"]
+                ]
+                break
+            except FileNotFoundError:
+                # Compacted away by the writer after we read the manifest
+                if attempt == attempts - 1:
+                    raise
+        self.trains = pd.Index(manifest["trains"], dtype=object)
+        self.names = list(manifest["segments"])
+        self.segments = segments
+
+    def _next_name(self):
+        number = int(self.names[-1].split("-")[1]) + 1 if self.names else 0
+        return f"seg-{number:06d}"
+
+    def _publish(self, trains, names):
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        with os.fdopen(fd, "w") as fh:
+            json.dump({"trains": list(trains), "segments": names}, fh)
+        os.replace(tmp, os.path.join(self.root, MANIFEST))
+
+    def codes(self, train_ids):
+        """Codes of the given trains; -1 for trains the store has not seen"""
+        return self.trains.get_indexer(pd.Index(train_ids, dtype=object))
+
+    def _register(self, train_ids):
+        ids = pd.Index(pd.unique(pd.Series(train_ids, dtype=object).dropna()))
+        new = ids.difference(self.trains, sort=False)
+        trains = self.trains.append(new) if len(new) else self.trains
+        return trains, trains.get_indexer(pd.Index(train_ids, dtype=object))
+
+    def with_rows(self, frame=None):
+        """An in-memory copy of this store plus a mileage log, sharing its
+        segments; appending to the copy leaves this store unchanged"""
+        view = MileageStore()
+        view.trains, view.segments = self.trains, list(self.segments)
+        if frame is not None and not frame.empty:
+            view.trains, codes = self._register(frame["train_id"])
+            view.segments.append(readings_frame(frame, codes))
+        return view
+
+    def fold(self, frame, first=0, bounds=None):
+        """Merge a mileage log into the in-memory segments from `first` on.
+
+        Segments before `first` are left as they are. `bounds`, if given,
+        maps the store's trains to the key time each one's queries start
+        at, and readings before it are `prune`d.
+        """
+        with self.lock:
+            self.trains, codes = self._register(frame["train_id"])
+            merged = merge(self.segments[first:] + [readings_frame(frame, codes)])
+            if bounds is not None:
+                merged = prune(merged, bounds(self.trains))
+            self.segments = self.segments[:first] + [merged]
+
+    def append(self, frame):
+        """Add the readings of a mileage log; returns the rows stored"""
+        with self.lock:
+            trains, codes = self._register(frame["train_id"])
+            segment = readings_frame(frame, codes)
+            if len(segment) == 0:
+                return 0
+            segments = self.segments + [segment]
+            if self.root is None:
+                self.trains, self.segments = trains, segments
+            else:
+                name = self._next_name()
+                segment.save(os.path.join(self.root, name))
+                self._publish(trains, self.names + [name])
+                self.trains, self.names = trains, self.names + [name]
+                self.segments = self.segments + [
+                    Segment.load(os.path.join(self.root, name))
+                ]
+            if len(self.segments) > MAX_SEGMENTS:
+                self._compact()
+            return len(segment)
+
+    def compact(self):
+        """Merge every segment into one"""
+        with self.lock:
+            self._compact()
+
+    def _compact(self):
+        if len(self.segments) <= 1:
+            return
+        merged = merge(self.segments)
+        if self.root is None:
+            self.segments = [Segment(*(np.array(getattr(merged, c)) for c in COLUMNS))]
+            return
+        old = self.names
+        name = self._next_name()
+        merged.save(os.path.join(self.root, name))
+        self._publish(self.trains, [name])
+        self.names = [name]
+        self.segments = [Segment.load(os.path.join(self.root, name))]
+        for stale in old:
+            for col in COLUMNS:
+                try:
+                    os.remove(os.path.join(self.root, f"{stale}.{col}.npy"))
+                except OSError:
+                    pass
+
+    def features(self, train_ids, now, since=None):
+        """`mileage_features` for the given trains as a train-indexed frame"""
+        values, found = mileage_features(
+            self.segments, self.codes(train_ids), now, since
+        )
+        index = pd.Index(train_ids, dtype=object, name="train_id")
+        return pd.DataFrame(values, index=index)[found]
+
+    def _reading(self, code, after, upto, first=False):
+        """One train's last reading at or before `upto`, or with `first` its
+        first reading after `after` (and at or before `upto`)"""
+        best = None
+        for segment in self.segments:
+            if first:
+                at = int(segment.key.searchsorted((code << TIME_BITS) | after, "right"))
+            else:
+                at = int(segment.key.searchsorted((code << TIME_BITS) | upto, "right"))
+                at -= 1
+            if at < 0 or at >= len(segment):
+                continue
+            key = int(segment.key[at])
+            time = key & TIME_MASK
+            if key >> TIME_BITS != code or time > upto:
+                continue
+            if best is None or (time <= best[0] if first else time >= best[0]):
+                best = (time, segment.odometer_km[at], segment.delta_km[at])
+        return best
+
+    def km(self, train_id, start, end):
+        """Kilometres one train ran between two timestamps; NaN if unknown.
+
+        The single-train form of `km_between`: a few binary searches.
+        """
+        try:
+            code = self.trains.get_loc(train_id)
+        except KeyError:
+            return np.nan
+        start, end = _second(start), _second(end)
+        stop = self._reading(code, start, end)
+        base = self._reading(code, start, start) or self._reading(
+            code, start, end, first=True
+        )
+        if stop is None or base is None:
+            return np.nan
+        odometer = base[1]
+        if base[0] > start:
+            odometer -= 0.0 if np.isnan(base[2]) else base[2]
+        return float(max(stop[1] - odometer, 0.0))
+
+    def odometer(self, train_id, at):
+        """One train's odometer reading in force at `at`; NaN if unknown"""
+        try:
+            code = self.trains.get_loc(train_id)
+        except KeyError:
+            return np.nan
+        reading = self._reading(code, 0, _second(at))
+        return np.nan if reading is None else float(reading[1])
+
+    def windows(self, train_id, now, since=None):
+        """Rolling-window kilometres of one train at `now`.
+
+        Without a last maintenance `since`, the whole odometer reading
+        counts as run since maintenance, as in `mileage_features`.
+        """
+        out = {
+            name: self.km(train_id, pd.Timestamp(now) - pd.Timedelta(days=days), now)
+            for name, days in WINDOWS.items()
+        }
+        out["km_since_maintenance"] = (
+            self.odometer(train_id, now)
+            if since is None or pd.isna(since)
+            else self.km(train_id, since, now)
+        )
+        return out
+
+
+def _second(timestamp):
+    return int(np.datetime64(pd.Timestamp(timestamp), "s").astype(np.int64))
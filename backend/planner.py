@@ -0,0 +1,402 @@
+"""Constrained induction plan: which trains run, stand by or stay in maintenance.
+
+Every eligible train either goes into service or stays on standby; the
+rest go to maintenance. The service set is chosen to maximise the summed
+`priority_score`, less a cost per shunt move to pull it out of the yard,
+subject to
+
+- the fleet size: `service_trains` trains, `DEFAULT_STANDBY` short of
+  the eligible fleet unless given;
+- the cleaning bays: cleaning booked tonight for the service trains must
+  fit in `cleaning_bays` bays over the cleaning window (bookings of
+  trains that are not inducted are deferred);
+- manpower: the man-hours of those cleanings must fit in `manpower`
+  cleaners over the window;
+- branding: the service trains should carry `branding_share` of the
+  exposure hours booked on eligible trains.
+
+Capacities are hard limits. The service count and the branding exposure
+are met as far as the capacities allow: a plan short of either is only
+chosen when no feasible swap closes the gap. Plans are compared by
+service shortfall, then branding shortfall, then objective.
+
+The plan starts from a greedy fill (branded trains until the exposure
+target is met, then by priority; when capacity runs out first, a second
+fill keeps room for the lightest trains still needed) and is improved by
+a first-improvement local search over add and swap moves until it is
+locally optimal or the time budget runs out. Every plan it holds is
+feasible, so the best one found so far is returned when time is up.
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+
+from .scoring import (
+    DEFAULT_STANDBY,
+    INDUCT,
+    PLANNING_TIME,
+    STANDBY,
+    _ranked,
+    compute_scores,
+    eligibility,
+    rank_order,
+)
+from .cleaning import CleaningJobs
+from .yard import Yard
+
+MAINTENANCE = "maintenance"
+
+# Hours between the planning time and the morning induction in which the
+# cleaning bays work
+CLEANING_WINDOW_HOURS = 8.0
+
+# Objective cost of one shunt move, in priority-score units
+SHUNT_MOVE_COST = 0.05
+
+DEFAULT_TIME_BUDGET = 1.0
+MAX_TIME_BUDGET = 10.0
+
+# Service and standby trains considered for swaps in each search pass
+SEARCH_WIDTH = 256
+
+GREEDY = "greedy"
+LOCAL_SEARCH = "local_search"
+
+EPS = 1e-9
+
+
+def cleaning_bookings(cleaning_df, trains, planning_time=PLANNING_TIME):
+    """Bay hours booked per train tonight and the number of bays in use"""
+    hours = np.zeros(len(trains))
+    if cleaning_df is None or cleaning_df.empty:
+        return hours, 0
+    jobs = CleaningJobs(cleaning_df)
+    tonight = jobs.starting_between(
+        planning_time, planning_time + pd.Timedelta(hours=24)
+    )
+    codes = pd.Index(trains, dtype=object).get_indexer(jobs.train_id)
+    rows = tonight & (codes >= 0)
+    np.add.at(hours, codes[rows], jobs.hours[rows])
+    bays = len(np.unique(jobs.bay[tonight & (jobs.bay >= 0)]))
+    return hours, bays
+
+
+def _capacity(units, window_hours):
+    return np.inf if units is None else float(units) * window_hours
+
+
+def _share(hours, capacity):
+    """Fraction of `capacity` each train takes; with none, any use is inf"""
+    if capacity > 0:
+        return hours / capacity
+    return np.where(hours > EPS, np.inf, 0.0)
+
+
+class _Plan:
+    """A service set with its running totals"""
+
+    def __init__(self, problem, service):
+        self.problem = problem
+        self.service = np.asarray(service, dtype=bool)
+        rows = self.service
+        self.count = int(rows.sum())
+        self.bay_hours = float(problem.bay_hours[rows].sum())
+        self.man_hours = float(problem.man_hours[rows].sum())
+        self.exposure = float(problem.exposure[rows].sum())
+        self.score = float(problem.priority[rows].sum())
+        self.moves = problem.moves(np.flatnonzero(rows))
+
+    @property
+    def objective(self):
+        return self.score - self.problem.shunt_cost * self.moves
+
+    def key(self):
+        """Sort key; smaller is better"""
+        p = self.problem
+        return (
+            max(p.target - self.count, 0),
+            round(max(p.exposure_target - self.exposure, 0.0), 6),
+            -self.objective,
+        )
+
+
+class _Problem:
+    """Per-train arrays and limits of one planning run"""
+
+    def __init__(
+        self,
+        features,
+        priority,
+        bay_hours,
+        target,
+        bay_capacity,
+        man_capacity,
+        branding_share,
+        shunt_cost,
+    ):
+        self.priority = np.nan_to_num(priority, nan=0.0)
+        self.eligible = eligibility(features)
+        self.bay_hours = bay_hours
+        self.man_hours = features["today_clean_load"].to_numpy(dtype=float)
+        self.exposure = np.where(
+            self.eligible, features["branding_hours"].to_numpy(dtype=float), 0.0
+        )
+        self.target = target
+        self.bay_capacity = bay_capacity
+        self.man_capacity = man_capacity
+        self.exposure_target = branding_share * float(self.exposure.sum())
+        self.shunt_cost = shunt_cost
+        self.yard = Yard.from_features(features)
+
+    def induction_order(self, rows):
+        """Service rows in the order they are pulled out: best first"""
+        return rows[np.lexsort((rows, -self.priority[rows]))]
+
+    def moves(self, rows):
+        if len(rows) == 0:
+            return 0
+        return int(self.yard.shunt_moves(self.induction_order(rows)).sum())
+
+    def fits(self, bay_hours, man_hours):
+        return (
+            bay_hours <= self.bay_capacity + EPS
+            and man_hours <= self.man_capacity + EPS
+        )
+
+
+def _smallest_sum(values, count):
+    """Sum of the `count` smallest values"""
+    if count <= 0:
+        return 0.0
+    if count >= len(values):
+        return float(values.sum())
+    return float(np.partition(values, count - 1)[:count].sum())
+
+
+def _reachable(problem):
+    """Service trains that fit the capacities when the lightest go first"""
+    rows = np.flatnonzero(problem.eligible)
+    bay, man = problem.bay_hours[rows], problem.man_hours[rows]
+    weight = _share(bay, problem.bay_capacity) + _share(man, problem.man_capacity)
+    order = np.argsort(weight, kind="stable")
+    fits = (np.cumsum(bay[order]) <= problem.bay_capacity + EPS) & (
+        np.cumsum(man[order]) <= problem.man_capacity + EPS
+    )
+    return min(int(np.argmin(fits)) if not fits.all() else len(rows), problem.target)
+
+
+def _greedy(problem, reserve=False, deadline=np.inf):
+    """Branded trains until the exposure target is met, then by priority.
+
+    With `reserve` a train is only taken if the capacity left could still
+    hold the lightest trains needed to reach the service count; this costs
+    a pass over the fleet per train, so it gives up at `deadline`.
+    """
+    service = np.zeros(len(problem.priority), dtype=bool)
+    order = rank_order(problem.eligible, problem.priority)
+    order = order[problem.eligible[order]]
+    bay = man = exposure = 0.0
+    count = 0
+    reach = _reachable(problem) if reserve else problem.target
+    branded = order[problem.exposure[order] > 0]
+    for rows in (branded, order):
+        for i in rows.tolist():
+            if count >= problem.target:
+                break
+            if rows is branded and exposure >= problem.exposure_target - EPS:
+                break
+            if service[i]:
+                continue
+            next_bay = bay + problem.bay_hours[i]
+            next_man = man + problem.man_hours[i]
+            if not problem.fits(next_bay, next_man):
+                continue
+            if reserve:
+                if time.perf_counter() > deadline:
+                    return None
+                rest = problem.eligible & ~service
+                rest[i] = False
+                need = reach - count - 1
+                if not problem.fits(
+                    next_bay + _smallest_sum(problem.bay_hours[rest], need),
+                    next_man + _smallest_sum(problem.man_hours[rest], need),
+                ):
+                    continue
+            service[i] = True
+            bay, man = next_bay, next_man
+            exposure += problem.exposure[i]
+            count += 1
+    return _Plan(problem, service)
+
+
+def _candidates(problem, rows, best):
+    """At most `SEARCH_WIDTH` rows by priority and by exposure"""
+    if len(rows) <= SEARCH_WIDTH:
+        return rows
+    sign = -1 if best else 1
+    by_priority = rows[np.argsort(sign * problem.priority[rows], kind="stable")]
+    by_exposure = rows[np.argsort(sign * problem.exposure[rows], kind="stable")]
+    return np.unique(
+        np.concatenate([by_priority[:SEARCH_WIDTH], by_exposure[:SEARCH_WIDTH]])
+    )
+
+
+def _moves(problem, plan):
+    """Candidate `(out, in)` moves, most promising first; `out` is -1 for adds"""
+    spare = np.flatnonzero(problem.eligible & ~plan.service)
+    ins = _candidates(problem, spare, best=True)
+    if plan.count < problem.target:
+        add = ins[
+            (plan.bay_hours + problem.bay_hours[ins] <= problem.bay_capacity + EPS)
+            & (plan.man_hours + problem.man_hours[ins] <= problem.man_capacity + EPS)
+        ]
+        add = add[np.argsort(-problem.priority[add], kind="stable")]
+        yield from ((-1, int(i)) for i in add)
+
+    outs = _candidates(problem, np.flatnonzero(plan.service), best=False)
+    if len(ins) == 0 or len(outs) == 0:
+        return
+    o, i = np.meshgrid(outs, ins, indexing="ij")
+    o, i = o.ravel(), i.ravel()
+    bay = plan.bay_hours - problem.bay_hours[o] + problem.bay_hours[i]
+    man = plan.man_hours - problem.man_hours[o] + problem.man_hours[i]
+    gain = problem.priority[i] - problem.priority[o]
+    short = max(problem.exposure_target - plan.exposure, 0.0)
+    new_short = np.maximum(
+        problem.exposure_target
+        - (plan.exposure - problem.exposure[o] + problem.exposure[i]),
+        0.0,
+    )
+    ok = (
+        (bay <= problem.bay_capacity + EPS)
+        & (man <= problem.man_capacity + EPS)
+        & (new_short <= short + EPS)
+    )
+    # Swaps that close some of the exposure gap come first; otherwise
+    # a swap can only win if its priority gain beats the shunt savings
+    helps = new_short < short - EPS
+    ok &= helps | (gain > -problem.shunt_cost * plan.moves - EPS)
+    o, i, gain, helps = o[ok], i[ok], gain[ok], helps[ok]
+    order = np.lexsort((-gain, ~helps))
+    yield from zip(o[order].tolist(), i[order].tolist())
+
+
+def _local_search(problem, plan, deadline):
+    """Improve `plan` until no move helps or the deadline passes.
+
+    Returns the best plan, the number of accepted moves and whether the
+    search stopped on the deadline.
+    """
+    accepted = 0
+    while True:
+        improved = False
+        for out, into in _moves(problem, plan):
+            if time.perf_counter() > deadline:
+                return plan, accepted, True
+            service = plan.service.copy()
+            if out >= 0:
+                service[out] = False
+            service[into] = True
+            candidate = _Plan(problem, service)
+            if candidate.key() < plan.key():
+                plan = candidate
+                accepted += 1
+                improved = True
+                break
+        if not improved:
+            return plan, accepted, False
+
+
+def plan_induction(
+    features,
+    scores=None,
+    service_trains=None,
+    standby=DEFAULT_STANDBY,
+    cleaning_hours=None,
+    cleaning_bays=None,
+    manpower=None,
+    branding_share=1.0,
+    shunt_cost=SHUNT_MOVE_COST,
+    time_budget=DEFAULT_TIME_BUDGET,
+    window_hours=CLEANING_WINDOW_HOURS,
+):
+    """Assign every train to service, standby or maintenance.
+
+    `cleaning_hours` are the bay hours booked tonight per feature row (see
+    `cleaning_bookings`); `cleaning_bays` and `manpower` of None leave
+    that capacity unlimited. With `time_budget` 0 the greedy plan is
+    returned as is.
+
+    Returns the same `(ranked, scores)` pair as `rank_trains`, ordered
+    service trains (in induction order), standby, then maintenance, with
+    a `role` column and the plan totals in `ranked.attrs`.
+    """
+    started = time.perf_counter()
+    if scores is None:
+        scores = compute_scores(features)
+    priority = scores["priority_score"].to_numpy(dtype=float)
+    eligible = eligibility(features)
+    if service_trains is None:
+        service_trains = max(int(eligible.sum()) - standby, 0)
+    if cleaning_hours is None:
+        cleaning_hours = np.zeros(len(features))
+
+    problem = _Problem(
+        features,
+        priority,
+        np.asarray(cleaning_hours, dtype=float),
+        min(int(service_trains), int(eligible.sum())),
+        _capacity(cleaning_bays, window_hours),
+        _capacity(manpower, window_hours),
+        branding_share,
+        shunt_cost,
+    )
+    deadline = started + time_budget
+    plan = _greedy(problem)
+    if plan.count < problem.target:
+        reserved = _greedy(problem, reserve=True, deadline=deadline)
+        if reserved is not None and reserved.key() < plan.key():
+            plan = reserved
+    solver, accepted, timed_out = GREEDY, 0, False
+    if time_budget > 0:
+        plan, accepted, timed_out = _local_search(problem, plan, deadline)
+        solver = LOCAL_SEARCH
+
+    service = problem.induction_order(np.flatnonzero(plan.service))
+    spare = np.flatnonzero(eligible & ~plan.service)
+    spare = spare[np.lexsort((spare, -problem.priority[spare]))]
+    rest = rank_order(eligible, priority)
+    rest = rest[~eligible[rest]]
+    rows = np.concatenate([service, spare, rest])
+
+    ranked, scores = _ranked(features, scores, rows)
+    ranked["role"] = np.repeat(
+        [INDUCT, STANDBY, MAINTENANCE], [len(service), len(spare), len(rest)]
+    )
+
+    def limit(value):
+        return None if np.isinf(value) else round(value, 4)
+
+    ranked.attrs.update(
+        {
+            "total_trains": len(features),
+            "eligible_trains": int(eligible.sum()),
+            "service_target": problem.target,
+            "service_trains": plan.count,
+            "shunt_moves": plan.moves,
+            "objective": round(plan.objective, 6),
+            "cleaning_bay_hours": round(plan.bay_hours, 4),
+            "cleaning_bay_capacity": limit(problem.bay_capacity),
+            "cleaning_man_hours": round(plan.man_hours, 4),
+            "cleaning_man_capacity": limit(problem.man_capacity),
+            "branding_hours": round(plan.exposure, 4),
+            "branding_target": round(problem.exposure_target, 4),
+            "solver": solver,
+            "moves_accepted": accepted,
+            "timed_out": timed_out,
+            "solve_seconds": round(time.perf_counter() - started, 4),
+        }
+    )
+    return ranked, scores
@@ -1,14 +1,32 @@
 import os
-import re
 import pandas as pd
-import numpy as np
-from datetime import datetime, timedelta
 
-def safe_read_csv(path, **kwargs):
-    """Safely read CSV file with error handling"""
+from .ingest import DEFAULT_CHUNKSIZE, read_input, stream_features, write_table
+from .metrics import span
+from .reasons import comparative_reason_text
+from .scoring import PLANNING_TIME, build_features, rank_trains
+
+# Checked in order, so a columnar export wins over a CSV of the same name
+INPUT_EXTENSIONS = ['.parquet', '.feather', '.arrow', '.csv']
+OUTPUT_EXTENSIONS = {'csv': '.csv', 'parquet': '.parquet', 'feather': '.feather'}
+
+def find_input(data_dir, stem):
+    """Path of the first existing `stem` export, defaulting to the CSV name"""
+    for ext in INPUT_EXTENSIONS:
+        path = os.path.join(data_dir, stem + ext)
+        if os.path.exists(path):
+            return path
+    return os.path.join(data_dir, stem + '.csv')
+
+def safe_read_table(path, kind=None):
+    """Safely read a CSV, Parquet or Feather export of an input kind with error handling"""
     if os.path.exists(path):
         try:
-            return pd.read_csv(path, **kwargs)
+            stem = os.path.splitext(os.path.basename(path))[0]
+            with span(f"read_{stem}") as s:
+                df = read_input(path, kind)
+                s.rows = len(df)
+            return df
         except Exception as e:
             print(f"Error reading {path}: {str(e)}")
             return None
@@ -16,8 +34,16 @@ def safe_read_csv(path, **kwargs):
         print(f"File not found: {path}")
         return None
 
-def generate_priority_df():
-    """Generate priority DataFrame from uploaded CSV files"""
+def generate_priority_df(streaming=False, chunksize=DEFAULT_CHUNKSIZE, output_format='csv'):
+    """Generate priority DataFrame from uploaded CSV files
+
+    Each input may also be a Parquet or Feather export of the same name.
+    With `streaming=True` the fitness, work-order and mileage histories are
+    read in chunks of `chunksize` rows and reduced to per-train aggregates.
+    `output_format` selects `csv`, `parquet` or `feather` for the output.
+    """
+    if output_format not in OUTPUT_EXTENSIONS:
+        raise ValueError(f"Unsupported output format: {output_format}")
     
     # Get the absolute path to the data directory
     current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -25,342 +51,80 @@ def generate_priority_df():
     DATA_DIR = os.path.abspath(DATA_DIR)  # Convert to absolute path
     
     print(f"Looking for data files in: {DATA_DIR}")
-    
-    PLANNING_TIME = pd.Timestamp("2025-09-01T21:00:00")
 
-    # Read CSV files with updated names
-    fitness_df = safe_read_csv(os.path.join(DATA_DIR, "fitness_certificates.csv"))
-    wo_df = safe_read_csv(os.path.join(DATA_DIR, "work_orders_maximo.csv"))
-    branding_df = safe_read_csv(os.path.join(DATA_DIR, "branding_schedule.csv"))
-    mileage_df = safe_read_csv(os.path.join(DATA_DIR, "mileage_logs.csv"))
-    cleaning_df = safe_read_csv(os.path.join(DATA_DIR, "cleaning_schedule.csv"))
+    # Read input files with updated names
+    fitness_path = find_input(DATA_DIR, "fitness_certificates")
+    wo_path = find_input(DATA_DIR, "work_orders_maximo")
+    mileage_path = find_input(DATA_DIR, "mileage_logs")
+    if streaming:
+        # History exports are only opened later, one chunk at a time
+        fitness_df, wo_df, mileage_df = (
+            path if os.path.exists(path) else None
+            for path in (fitness_path, wo_path, mileage_path)
+        )
+    else:
+        fitness_df = safe_read_table(fitness_path, 'fitness_certificates')
+        wo_df = safe_read_table(wo_path, 'work_order_maximo')
+        mileage_df = safe_read_table(mileage_path, 'mileage_logs')
+    branding_path = find_input(DATA_DIR, "branding_schedule")
+    cleaning_path = find_input(DATA_DIR, "cleaning_schedule")
+    branding_df = safe_read_table(branding_path, 'branding_schedule')
+    cleaning_df = safe_read_table(cleaning_path, 'cleaning_schedule')
     
     # Optional files - create empty DataFrames if not present
-    stabling_df = safe_read_csv(os.path.join(DATA_DIR, "stabling_layout.csv"))
+    stabling_df = safe_read_table(find_input(DATA_DIR, "stabling_layout"), 'stabling_layout')
     if stabling_df is None:
         stabling_df = pd.DataFrame(columns=['train_id', 'position'])
     
-    cleaning_df_prev = safe_read_csv(os.path.join(DATA_DIR, "cleaning_schedule_prev.csv"))
+    cleaning_df_prev = safe_read_table(find_input(DATA_DIR, "cleaning_schedule_prev"), 'cleaning_schedule_prev')
     if cleaning_df_prev is None:
         cleaning_df_prev = pd.DataFrame(columns=['train_id', 'scheduled_end', 'scheduled_start', 'cleaning_type', 'manpower_required'])
 
     # Validate required files
     required_files = {
-        'fitness_certificates.csv': fitness_df,
-        'work_orders_maximo.csv': wo_df,
-        'branding_schedule.csv': branding_df,
-        'mileage_logs.csv': mileage_df,
-        'cleaning_schedule.csv': cleaning_df
+        os.path.basename(fitness_path): fitness_df,
+        os.path.basename(wo_path): wo_df,
+        os.path.basename(branding_path): branding_df,
+        os.path.basename(mileage_path): mileage_df,
+        os.path.basename(cleaning_path): cleaning_df
     }
     
     missing_files = [name for name, df in required_files.items() if df is None]
     if missing_files:
         raise RuntimeError(f"Required files missing: {missing_files}")
 
-    # Collect all train IDs
-    all_train_ids = set()
-    for df_name, df in required_files.items():
-        if df is not None and 'train_id' in df.columns:
-            all_train_ids.update(df['train_id'].dropna().unique())
-    
-    # Add train IDs from optional files
-    if stabling_df is not None and 'train_id' in stabling_df.columns:
-        all_train_ids.update(stabling_df['train_id'].dropna().unique())
-
-    all_trains = sorted(list(all_train_ids))
-    if len(all_trains) == 0:
-        raise RuntimeError("No train IDs found in provided files. Ensure `train_id` column is present in your CSVs.")
-
-    print(f"Found {len(all_trains)} unique train IDs")
-    df = pd.DataFrame({"train_id": all_trains})
-
-    # Process fitness certificates
-    if not fitness_df.empty:
-        fitness_df['valid_to_dt'] = pd.to_datetime(fitness_df['valid_to'], errors='coerce')
-        fitness_min = fitness_df.groupby('train_id')['valid_to_dt'].min().reset_index().rename(columns={'valid_to_dt':'fitness_valid_till'})
-        df = df.merge(fitness_min, on='train_id', how='left')
-        df['fitness_days_left'] = (df['fitness_valid_till'] - PLANNING_TIME).dt.days
-    else:
-        df['fitness_days_left'] = 0
-    
-    df['fitness_days_left'] = df['fitness_days_left'].fillna(-9999).clip(lower=0)
-
-    def fitness_priority(days_left):
-        if days_left < 0:
-            return 0.0   # expired
-        return 1.0 / (1.0 + days_left)
-
-    df['fitness_priority_raw'] = df['fitness_days_left'].apply(fitness_priority)
-
-    # Process work orders
-    if not wo_df.empty:
-        wo_df['status_norm'] = wo_df['status'].str.lower().fillna('')
-        wo_open = wo_df[wo_df['status_norm'].str.contains('open', na=False)]
-
-        open_counts = wo_open.groupby('train_id').size().rename('open_wo_count')
-        open_hours = wo_open.groupby('train_id')['estimated_hours'].sum(min_count=1).rename('open_wo_hours')
-
-        wo_summary = pd.concat([open_counts, open_hours], axis=1).reset_index().fillna(0)
-        wo_summary['open_wo_count'] = wo_summary['open_wo_count'].astype(int)
-        wo_summary['open_wo_hours'] = wo_summary['open_wo_hours'].astype(float)
-        df = df.merge(wo_summary, on='train_id', how='left')
-    
-    df[['open_wo_count', 'open_wo_hours']] = df[['open_wo_count', 'open_wo_hours']].fillna(0)
-
-    # Process branding schedule
-    if not branding_df.empty:
-        branding_df['start_date_dt'] = pd.to_datetime(branding_df['start_date'], errors='coerce').dt.date
-        branding_df['end_date_dt'] = pd.to_datetime(branding_df['end_date'], errors='coerce').dt.date
-        today_date = PLANNING_TIME.date()
-        branding_df['active'] = (~branding_df['start_date_dt'].isna()) & (~branding_df['end_date_dt'].isna()) & (branding_df['start_date_dt'] <= today_date) & (branding_df['end_date_dt'] >= today_date)
-        active_brand = branding_df[branding_df['active']].copy()
-        brand_hours = active_brand.groupby('train_id')['required_exposure_hours_per_day'].sum().rename('branding_hours').reset_index()
-        df = df.merge(brand_hours, on='train_id', how='left')
-    
-    df['branding_hours'] = df['branding_hours'].fillna(0).astype(float)
-
-    # Process mileage logs
-    if not mileage_df.empty:
-        mileage_df['odometer_km'] = pd.to_numeric(mileage_df['odometer_km'], errors='coerce').fillna(0)
-        odom = mileage_df.sort_values('recorded_at').groupby('train_id').tail(1)[['train_id','odometer_km']].rename(columns={'odometer_km':'cumulative_km'})
-        if 'delta_km' in mileage_df.columns:
-            delta = mileage_df.sort_values('recorded_at').groupby('train_id').tail(1)[['train_id','delta_km']]
-            df = df.merge(delta, on='train_id', how='left')
-        df = df.merge(odom, on='train_id', how='left')
-    
-    df['cumulative_km'] = pd.to_numeric(df['cumulative_km'].fillna(0), errors='coerce').astype(float)
-    df['delta_km'] = pd.to_numeric(df['delta_km'].fillna(0), errors='coerce').astype(float)
-
-    # Process previous cleaning schedule
-    if not cleaning_df_prev.empty:
-        cleaning_df_prev['scheduled_end_dt'] = pd.to_datetime(cleaning_df_prev['scheduled_end'], errors='coerce')
-        cleaning_df_prev['scheduled_start_dt'] = pd.to_datetime(cleaning_df_prev['scheduled_start'], errors='coerce')
-        last_clean = cleaning_df_prev.sort_values('scheduled_end_dt').groupby('train_id').tail(1)[['train_id','scheduled_end_dt','scheduled_start_dt','cleaning_type','manpower_required']].copy()
-        last_clean = last_clean.rename(columns={'scheduled_end_dt':'last_clean_end','scheduled_start_dt':'last_clean_start','cleaning_type':'last_clean_type','manpower_required':'last_clean_manpower'})
-        df = df.merge(last_clean[['train_id', 'last_clean_end']], on='train_id', how='left')
-        df['clean_age_hours'] = (PLANNING_TIME - df['last_clean_end']).dt.total_seconds() / 3600.0
-    else:
-        df['clean_age_hours'] = 99999.0
-    
-    df['clean_age_hours'] = df['clean_age_hours'].fillna(99999.0)
-    df['clean_freshness_raw'] = (1.0 - (np.minimum(df['clean_age_hours'], 72.0) / 72.0)).clip(0.0, 1.0)
-
-    # Process current cleaning schedule
-    type_duration_mins = {
-        'daily': 15,
-        'outside_cleaning': 120,
-        'heavy': 180
-    }
-    
-    if not cleaning_df.empty:
-        start_window = PLANNING_TIME
-        end_window = PLANNING_TIME + pd.Timedelta(hours=24)
-        cleaning_df['scheduled_start_dt'] = pd.to_datetime(cleaning_df['scheduled_start'], errors='coerce')
-        cleaning_df['scheduled_end_dt'] = pd.to_datetime(cleaning_df['scheduled_end'], errors='coerce')
-        mask_window = (cleaning_df['scheduled_start_dt'] >= start_window) & (cleaning_df['scheduled_start_dt'] < end_window)
-        today_jobs = cleaning_df[mask_window].copy()
-
-        def duration_hours(row):
-            t = str(row.get('cleaning_type', '')).lower().strip()
-            t = t.replace(' ', '_')         
-            mins = type_duration_mins.get(t, type_duration_mins['daily'])
-            return float(mins) / 60.0
-
-        if not today_jobs.empty:
-            today_jobs['duration_hours'] = today_jobs.apply(duration_hours, axis=1)
-            today_jobs['manpower_required'] = pd.to_numeric(today_jobs['manpower_required'], errors='coerce').fillna(0.0)
-            today_jobs['load'] = today_jobs['duration_hours'] * today_jobs['manpower_required']
-            load_by_train = today_jobs.groupby('train_id')['load'].sum().rename('today_clean_load').reset_index()
-        else:
-            load_by_train = pd.DataFrame(columns=['train_id','today_clean_load'])
-    else:
-        load_by_train = pd.DataFrame(columns=['train_id','today_clean_load'])
-
-    df = df.merge(load_by_train, on='train_id', how='left')
-    df['today_clean_load'] = df['today_clean_load'].fillna(0.0)
-
-    # Process stabling layout
-    def parse_position(position):
-        if pd.isna(position):
-            return (None, None)
-        pid = str(position).strip()
-
-        m = re.search(r'(?i)\bline[_\-]?(\d+)[_\-]?pos[_\-]?(\d+)\b', pid)
-        if m:
-            line_num = m.group(1)
-            slot_num = int(m.group(2))
-            return (f"line_{line_num}", int(slot_num))
-
-        return (pid, None)
-
-    if not stabling_df.empty:
-        pos_map = stabling_df[['train_id','position']].dropna()
-        pos_map['parsed'] = pos_map['position'].apply(parse_position)
-        pos_map[['line_id','slot_idx']] = pd.DataFrame(pos_map['parsed'].tolist(), index=pos_map.index)
-        df = df.merge(pos_map[['train_id','position','line_id','slot_idx']], on='train_id', how='left')
-    else:
-        df['position'] = df['train_id']  # Use train_id as position if no stabling data
-        df['line_id'] = 'default_line'
-        df['slot_idx'] = None
-
-    # Assign slots by group
-    def assign_slots_by_group(g):
-        if g['slot_idx'].notna().any():
-            used = set([int(x) for x in g['slot_idx'].dropna().astype(int).tolist()])
-            next_slot = 0
-            res = []
-            for _, r in g.iterrows():
-                if pd.notna(r['slot_idx']):
-                    res.append(int(r['slot_idx']))
-                else:
-                    while next_slot in used:
-                        next_slot += 1
-                    res.append(next_slot)
-                    used.add(next_slot)
-            g['slot_idx_assigned'] = res
-        else:
-            g = g.sort_values(by=['position','train_id'])
-            g['slot_idx_assigned'] = list(range(len(g)))
-        return g
-
-    group_key = 'line_id' if 'line_id' in df.columns and df['line_id'].notna().any() else 'position'
-    df[group_key] = df[group_key].fillna(df.get('position', df['train_id']))
-
-    assigned = df.groupby(group_key, group_keys=False).apply(assign_slots_by_group).reset_index(drop=True)
-    if 'slot_idx_assigned' in assigned.columns:
-        assigned['shunt_depth'] = assigned['slot_idx_assigned'].fillna(0).astype(int)
-    else:
-        assigned['shunt_depth'] = 0
-    df = assigned
-
-    max_depth = max(1, int(df['shunt_depth'].max()))
-    if 'position' in df.columns:
-        df.drop('position', axis=1, inplace=True)
-
-    # Constants for scoring
-    SHUNT_LAMBDA = 0.25
-    W_FITNESS = 0.15
-    W_JOB = 0.20
-    W_BRANDING = 0.25
-    W_MILEAGE = 0.25
-    W_CLEAN = 0.15
-    
-    CLEAN_UPCOMING_ALPHA = 0.8
-
-    def minmax_col(s):
-        s2 = s.copy().astype(float)
-        if s2.isna().all():
-            return s2.fillna(0.0)
-        lo, hi = s2.min(), s2.max()
-        if hi == lo:
-            return pd.Series(0.0, index=s2.index)
-        return (s2 - lo) / (hi - lo)
-
-    def compute_scores(df):
-        feature_scores = pd.DataFrame({'train_id': df['train_id']})
-
-        feature_scores['fitness_score'] = minmax_col(df['fitness_priority_raw'])
-        feature_scores['job_score'] = 1.0 - minmax_col(df['open_wo_hours'].astype(float))
-        feature_scores['branding_score'] = minmax_col(df['branding_hours'].astype(float))
-
-        km = df['cumulative_km'].astype(float)
-        km_mean = km.mean() if not km.isna().all() else 0.0
-        max_abs = max(1.0, (km - km_mean).abs().max())
-        feature_scores['mileage_score'] = (1.0 - (km - km_mean).abs() / max_abs).clip(0.0, 1.0)
-
-        df['clean_today_penalty'] = minmax_col(df['today_clean_load'])
-        df['cleaning_score_raw'] = df['clean_freshness_raw'] * (1.0 - CLEAN_UPCOMING_ALPHA * df['clean_today_penalty'])
-        df['cleaning_score_raw'] = df['cleaning_score_raw'].clip(0.0, 1.0)
-        df['clean_freshness'] = minmax_col(df['clean_freshness_raw'])
-        df['clean_today_penalty_norm'] = df['clean_today_penalty']
-        df['cleaning_score'] = minmax_col(df['cleaning_score_raw'])
-        
-        feature_scores = feature_scores.merge(df[['train_id', 'cleaning_score']], on='train_id', how='left')
-
-        df['S'] = df['shunt_depth'].astype(float) / float(max_depth)
-        feature_scores['shunt_penalty'] = df['S']
-
-        df['priority_score'] = (
-            W_FITNESS * feature_scores['fitness_score'] +
-            W_JOB * feature_scores['job_score'] +
-            W_BRANDING * feature_scores['branding_score'] +
-            W_MILEAGE * feature_scores['mileage_score'] +
-            W_CLEAN * feature_scores['cleaning_score']
-        ) - SHUNT_LAMBDA * feature_scores['shunt_penalty']
-
-        df['priority_score'] = minmax_col(df['priority_score'])
-
-        return df, feature_scores
-
-    def rank_trains(df):
-        df, feature_scores = compute_scores(df)
-        df['eligible'] = (df['fitness_days_left'] > 0) & (df['open_wo_hours'] <= 0)
-        df = df.sort_values(
-            by=['eligible', 'priority_score'],
-            ascending=[False, False]
-        ).reset_index(drop=True)
-        return df, feature_scores
-
-    priority_df, feature_scores = rank_trains(df)
+    # Collect all train IDs and reduce every input to per-train features
+    build = stream_features if streaming else build_features
+    options = {"chunksize": chunksize} if streaming else {}
+    try:
+        df = build(
+            fitness_df,
+            wo_df,
+            branding_df,
+            mileage_df,
+            cleaning_df,
+            stabling_df=stabling_df,
+            cleaning_df_prev=cleaning_df_prev,
+            planning_time=PLANNING_TIME,
+            **options,
+        )
+    except ValueError as e:
+        raise RuntimeError(str(e))
+
+    print(f"Found {len(df)} unique train IDs")
+    df.drop('position', axis=1, inplace=True)
+
+    with span("rank", rows=len(df)):
+        priority_df, feature_scores = rank_trains(df)
 
     # Generate reasons for ranking
-    avg_fitness_days = df['fitness_days_left'].mean()
-    avg_branding_hours = df['branding_hours'].mean()
-    avg_delta_km = df['delta_km'].mean()
-    avg_clean_age = df['clean_age_hours'].mean()
-    avg_clean_load = df['today_clean_load'].mean()
-    median_position = df['slot_idx'].median() if 'slot_idx' in df.columns else 0
-
-    def get_comparative_reasons(row):
-        reasons = []
-
-        if row['fitness_days_left'] <= 0:
-            reasons.append("-Expired fitness certificate")
-        elif row['fitness_days_left'] > avg_fitness_days * 1.1:
-            reasons.append(f"+Fitness: High days left ({row['fitness_days_left']:.1f} vs. avg {avg_fitness_days:.1f})")
-        elif row['fitness_days_left'] < avg_fitness_days * 0.9:
-            reasons.append(f"-Fitness: Low days left ({row['fitness_days_left']:.1f} vs. avg {avg_fitness_days:.1f})")
-
-        if row['open_wo_count'] > 0:
-            reasons.append(f"Ineligible: Open work orders ({row['open_wo_hours']:.1f} hrs estimated)")
+    with span("reasons", rows=len(priority_df)):
+        priority_df['reasons'] = comparative_reason_text(priority_df)
 
-        if row['branding_hours'] > avg_branding_hours * 1.1:
-            reasons.append(f"+Branding: High exposure hours ({row['branding_hours']:.1f} vs. avg {avg_branding_hours:.1f})")
-        elif row['branding_hours'] < avg_branding_hours * 0.9:
-            reasons.append(f"-Branding: Low exposure hours ({row['branding_hours']:.1f} vs. avg {avg_branding_hours:.1f})")
-
-        if row['delta_km'] > avg_delta_km * 1.1:
-            reasons.append(f"-Mileage: High traveled distance ({row['delta_km']:.1f} km vs. avg {avg_delta_km:.1f})")
-        elif row['delta_km'] < avg_delta_km * 0.9:
-            reasons.append(f"+Mileage: Low traveled distance ({row['delta_km']:.1f} km vs. avg {avg_delta_km:.1f})")
-
-        if row['clean_age_hours'] < avg_clean_age * 0.9:
-            reasons.append(f"+Cleaning: Recently cleaned ({row['clean_age_hours']:.1f} hrs ago vs. avg {avg_clean_age:.1f})")
-        elif row['clean_age_hours'] > avg_clean_age * 1.1:
-            reasons.append(f"-Cleaning: Long since last clean ({row['clean_age_hours']:.1f} hrs ago vs. avg {avg_clean_age:.1f})")
-        
-        if row['today_clean_load'] > avg_clean_load * 1.1:
-            reasons.append(f"-Cleaning: High load today ({row['today_clean_load']:.1f} hrs vs. avg {avg_clean_load:.1f})")
-
-        if 'slot_idx' in row and pd.notna(row['slot_idx']):
-            if row['slot_idx'] < median_position:
-                reasons.append("+Stabling: Forward position on stabling line - minimal shunting")
-            elif row['slot_idx'] > median_position:
-                reasons.append("-Stabling: Rear position on stabling line - high shunting")
-
-        return " | ".join(reasons) if reasons else "Balanced across features"
-
-    df['reasons'] = df.apply(get_comparative_reasons, axis=1)
-
-    priority_df = priority_df.merge(
-        df[['train_id', 'reasons']],
-        on='train_id',
-        how='left'
-    )
-    
     # Save to output file
-    output_path = os.path.join(DATA_DIR, "priority_score.csv")
-    priority_df.to_csv(output_path, index=False)
+    output_path = os.path.join(DATA_DIR, "priority_score" + OUTPUT_EXTENSIONS[output_format])
+    with span("write_output", rows=len(priority_df)):
+        write_table(priority_df, output_path)
     print(f"Priority scores saved to: {output_path}")
     
     return priority_df
\ No newline at end of file
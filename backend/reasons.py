@@ -0,0 +1,269 @@
+"""Columnar reason codes for ranked trains.
+
+Each catalogue entry is one bit of a per-train `reason_mask`. Masks are
+computed with vectorised comparisons over the whole fleet; text is only
+rendered for the rows a caller actually returns.
+"""
+
+import numpy as np
+import pandas as pd
+
+# (code, reason template or None, recommendation or None)
+REASONS = [
+    (1, "Expired fitness certificate", "Renew fitness certificate immediately"),
+    (
+        2,
+        "Fitness expiring soon ({fitness_days_left:.0f} days)",
+        "Schedule fitness renewal",
+    ),
+    (
+        3,
+        "Open work orders ({open_wo_hours:.1f} hrs estimated)",
+        "Complete pending maintenance work",
+    ),
+    (
+        4,
+        "High branding exposure required ({branding_hours:.1f} hrs)",
+        "Prioritize for passenger service",
+    ),
+    (5, None, "Consider for freight or non-passenger service"),
+    (6, "High recent mileage ({km_7d:.1f} km)", "Schedule for maintenance check"),
+    (
+        7,
+        "Long since last cleaning ({clean_age_hours:.1f} hrs ago)",
+        "Schedule cleaning before service",
+    ),
+    (
+        8,
+        "High cleaning workload scheduled today",
+        "Consider alternative trains to reduce cleaning bottleneck",
+    ),
+    (
+        9,
+        "Requires significant shunting operations",
+        "Plan shunting operations in advance",
+    ),
+]
+DEFAULT_REASON = "Balanced performance across all metrics"
+DEFAULT_RECOMMENDATION = "Ready for immediate deployment"
+
+COMPARATIVE_REASONS = [
+    (101, "-Expired fitness certificate", None),
+    (
+        102,
+        "+Fitness: High days left ({fitness_days_left:.1f} vs. avg {avg_fitness_days:.1f})",
+        None,
+    ),
+    (
+        103,
+        "-Fitness: Low days left ({fitness_days_left:.1f} vs. avg {avg_fitness_days:.1f})",
+        None,
+    ),
+    (104, "Ineligible: Open work orders ({open_wo_hours:.1f} hrs estimated)", None),
+    (
+        105,
+        "+Branding: High exposure hours ({branding_hours:.1f} vs. avg {avg_branding_hours:.1f})",
+        None,
+    ),
+    (
+        106,
+        "-Branding: Low exposure hours ({branding_hours:.1f} vs. avg {avg_branding_hours:.1f})",
+        None,
+    ),
+    (
+        107,
+        "-Mileage: High traveled distance ({km_7d:.1f} km vs. avg {avg_km_7d:.1f})",
+        None,
+    ),
+    (
+        108,
+        "+Mileage: Low traveled distance ({km_7d:.1f} km vs. avg {avg_km_7d:.1f})",
+        None,
+    ),
+    (
+        109,
+        "+Cleaning: Recently cleaned ({clean_age_hours:.1f} hrs ago vs. avg {avg_clean_age:.1f})",
+        None,
+    ),
+    (
+        110,
+        "-Cleaning: Long since last clean ({clean_age_hours:.1f} hrs ago vs. avg {avg_clean_age:.1f})",
+        None,
+    ),
+    (
+        111,
+        "-Cleaning: High load today ({today_clean_load:.1f} hrs vs. avg {avg_clean_load:.1f})",
+        None,
+    ),
+    (112, "+Stabling: Forward position on stabling line - minimal shunting", None),
+    (113, "-Stabling: Rear position on stabling line - high shunting", None),
+]
+DEFAULT_COMPARATIVE_REASON = "Balanced across features"
+
+PARAM_COLUMNS = [
+    "fitness_days_left",
+    "open_wo_hours",
+    "branding_hours",
+    "km_7d",
+    "clean_age_hours",
+    "today_clean_load",
+]
+
+FITNESS_EXPIRED = 1
+FITNESS_EXPIRING_DAYS = 30
+STALE_CLEAN_HOURS = 48
+
+
+def _col(df, name):
+    return df[name].to_numpy(dtype=float)
+
+
+def _safe_mean(values):
+    values = values[~np.isnan(values)]
+    return float(values.mean()) if values.size else 0.0
+
+
+def _pack(masks):
+    """Fold an ordered list of boolean masks into one integer per row"""
+    packed = np.zeros(len(masks[0]), dtype=np.uint32)
+    for bit, mask in enumerate(masks):
+        packed |= np.asarray(mask, dtype=np.uint32) << np.uint32(bit)
+    return packed
+
+
+def fleet_context(df):
+    """Fleet averages the reason thresholds are measured against"""
+    slot_idx = _col(df, "slot_idx") if "slot_idx" in df.columns else np.array([])
+    slot_idx = slot_idx[~np.isnan(slot_idx)]
+    return {
+        "avg_fitness_days": _safe_mean(_col(df, "fitness_days_left")),
+        "avg_branding_hours": _safe_mean(_col(df, "branding_hours")),
+        "avg_km_7d": _safe_mean(_col(df, "km_7d")),
+        "avg_clean_age": _safe_mean(_col(df, "clean_age_hours")),
+        "avg_clean_load": _safe_mean(_col(df, "today_clean_load")),
+        "median_position": float(np.median(slot_idx)) if slot_idx.size else np.nan,
+    }
+
+
+def reason_codes(df, context=None):
+    """Bitmask over `REASONS` for every row of a ranked frame"""
+    ctx = context or fleet_context(df)
+    days = _col(df, "fitness_days_left")
+    branding = _col(df, "branding_hours")
+    slot_idx = (
+        _col(df, "slot_idx") if "slot_idx" in df.columns else np.full(len(df), np.nan)
+    )
+    high_brand = branding > ctx["avg_branding_hours"] * 1.1
+    return _pack(
+        [
+            days <= 0,
+            (days > 0) & (days < FITNESS_EXPIRING_DAYS),
+            _col(df, "open_wo_count") > 0,
+            high_brand,
+            ~high_brand & (branding < ctx["avg_branding_hours"] * 0.5),
+            _col(df, "km_7d") > ctx["avg_km_7d"] * 1.2,
+            _col(df, "clean_age_hours") > STALE_CLEAN_HOURS,
+            _col(df, "today_clean_load") > ctx["avg_clean_load"] * 1.2,
+            slot_idx > ctx["median_position"],
+        ]
+    )
+
+
+def comparative_reason_codes(df, context=None):
+    """Bitmask over `COMPARATIVE_REASONS` for every row of a ranked frame"""
+    ctx = context or fleet_context(df)
+    days = _col(df, "fitness_days_left")
+    branding = _col(df, "branding_hours")
+    km = _col(df, "km_7d")
+    age = _col(df, "clean_age_hours")
+    slot_idx = (
+        _col(df, "slot_idx") if "slot_idx" in df.columns else np.full(len(df), np.nan)
+    )
+
+    expired = days <= 0
+    high_days = ~expired & (days > ctx["avg_fitness_days"] * 1.1)
+    high_brand = branding > ctx["avg_branding_hours"] * 1.1
+    high_km = km > ctx["avg_km_7d"] * 1.1
+    recent = age < ctx["avg_clean_age"] * 0.9
+    forward = slot_idx < ctx["median_position"]
+    return _pack(
+        [
+            expired,
+            high_days,
+            ~expired & ~high_days & (days < ctx["avg_fitness_days"] * 0.9),
+            _col(df, "open_wo_count") > 0,
+            high_brand,
+            ~high_brand & (branding < ctx["avg_branding_hours"] * 0.9),
+            high_km,
+            ~high_km & (km < ctx["avg_km_7d"] * 0.9),
+            recent,
+            ~recent & (age > ctx["avg_clean_age"] * 1.1),
+            _col(df, "today_clean_load") > ctx["avg_clean_load"] * 1.1,
+            forward,
+            ~forward & (slot_idx > ctx["median_position"]),
+        ]
+    )
+
+
+def decode(mask, catalogue=REASONS):
+    """Reason codes set in a single row's bitmask"""
+    mask = int(mask)
+    return [code for bit, (code, _, _) in enumerate(catalogue) if mask >> bit & 1]
+
+
+def render_reasons(
+    df,
+    rows=None,
+    mask_column="reason_mask",
+    catalogue=REASONS,
+    context=None,
+    default_reason=DEFAULT_REASON,
+    default_recommendation=DEFAULT_RECOMMENDATION,
+):
+    """Render reason and recommendation text for the selected rows only.
+
+    Returns two lists (one entry per row) of string lists.
+    """
+    rows = np.arange(len(df)) if rows is None else np.asarray(rows)
+    masks = df[mask_column].to_numpy()[rows]
+    params = {
+        col: df[col].to_numpy()[rows] for col in PARAM_COLUMNS if col in df.columns
+    }
+    ctx = context or {}
+
+    reasons, recommendations = [], []
+    for i, mask in enumerate(masks):
+        mask = int(mask)
+        row_reasons, row_recs = [], []
+        if mask:
+            values = {col: v[i] for col, v in params.items()}
+            values.update(ctx)
+            for bit, (_, reason, recommendation) in enumerate(catalogue):
+                if mask >> bit & 1:
+                    if reason is not None:
+                        row_reasons.append(reason.format(**values))
+                    if recommendation is not None:
+                        row_recs.append(recommendation)
+        reasons.append(row_reasons or [default_reason])
+        recommendations.append(row_recs or [default_recommendation])
+    return reasons, recommendations
+
+
+def has_reason(masks, code, catalogue=REASONS):
+    """Vectorised test of one reason code across an array of bitmasks"""
+    bit = next(i for i, (c, _, _) in enumerate(catalogue) if c == code)
+    return (np.asarray(masks, dtype=np.uint32) >> np.uint32(bit) & 1).astype(bool)
+
+
+def comparative_reason_text(df, context=None):
+    """`" | "`-joined comparative reasons for every row, for flat file output"""
+    ctx = context or fleet_context(df)
+    masks = pd.Series(comparative_reason_codes(df, ctx), index=df.index)
+    reasons, _ = render_reasons(
+        df.assign(_mask=masks),
+        mask_column="_mask",
+        catalogue=COMPARATIVE_REASONS,
+        context=ctx,
+        default_reason=DEFAULT_COMPARATIVE_REASON,
+    )
+    return [" | ".join(r) for r in reasons]
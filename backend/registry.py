@@ -0,0 +1,86 @@
+"""Fleet-wide registry of train IDs and their dense integer codes.
+
+Train IDs are mapped to codes `0..n-1` once, in sorted ID order, when the
+input tables are ingested. Per-train values then live in plain arrays
+indexed by code: feature rows are laid out in registry order, so a train's
+code is also its row position, and stages reduce their input rows straight
+into those arrays instead of joining on `train_id`.
+"""
+
+import numpy as np
+import pandas as pd
+
+MISSING = -1
+
+
+class TrainRegistry:
+    """Sorted train IDs and the code (array position) of each"""
+
+    def __init__(self, ids=()):
+        self.ids = np.array(
+            sorted(pd.unique(pd.Series(ids, dtype=object).dropna())), dtype=object
+        )
+        self.index = pd.Index(self.ids, dtype=object)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, train_id):
+        return train_id in self.index
+
+    @classmethod
+    def from_frames(cls, *frames):
+        """Registry of every `train_id` in the given frames"""
+        return cls.encode_frames(*frames)[0]
+
+    @classmethod
+    def encode_frames(cls, *frames):
+        """Registry of the given frames plus the codes of their rows.
+
+        Each frame's `train_id` column is hashed once; the codes list has
+        one int64 array per frame (None for frames without train IDs) with
+        `MISSING` for rows without an ID.
+        """
+        local = []
+        for frame in frames:
+            if frame is None or "train_id" not in frame.columns:
+                local.append(None)
+            else:
+                local.append(pd.factorize(frame["train_id"], use_na_sentinel=True))
+        seen = [uniques for _, uniques in filter(None, local)]
+        registry = cls(pd.Index(np.concatenate(seen), dtype=object) if seen else ())
+        codes = []
+        for item in local:
+            if item is None:
+                codes.append(None)
+                continue
+            rows, uniques = item
+            positions = registry.index.get_indexer(pd.Index(uniques, dtype=object))
+            codes.append(
+                np.where(rows >= 0, positions[np.maximum(rows, 0)], MISSING).astype(
+                    np.int64
+                )
+            )
+        return registry, codes
+
+    def encode(self, train_ids):
+        """Codes of the given IDs; `MISSING` for missing or unknown IDs"""
+        values = pd.Index(np.asarray(train_ids, dtype=object), dtype=object)
+        return self.index.get_indexer(values).astype(np.int64)
+
+    def code(self, train_id):
+        """Code of one train ID; KeyError if it is not registered"""
+        return self.index.get_loc(train_id)
+
+    def decode(self, codes):
+        return self.ids[np.asarray(codes)]
+
+    def full(self, fill, dtype=float):
+        """A per-train array with every train set to `fill`"""
+        return np.full(len(self), fill, dtype=dtype)
+
+    def align(self, per_train, fill=np.nan):
+        """A train-indexed Series as a per-train array, filling the gaps"""
+        if per_train is None or len(per_train) == 0:
+            return self.full(fill)
+        return per_train.reindex(self.index).to_numpy(dtype=float, na_value=fill)
@@ -0,0 +1,173 @@
+"""What-if weight sweeps: score many weight vectors in one vectorized pass.
+
+Only the weights change between scenarios, so the normalised per-train
+scores from `compute_scores` are computed once. Every scenario's priority
+is then one column of a matrix product between the fleet's score matrix
+and the matrix of weight vectors, and all scenarios are ranked together.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .scoring import (
+    DEFAULT_WEIGHTS,
+    compute_scores,
+    eligibility,
+    minmax_columns,
+    rank_orders,
+    resolve_weights,
+)
+
+# Column order of weight matrices
+WEIGHT_NAMES = tuple(DEFAULT_WEIGHTS)
+
+# Linear weights and the score column each one multiplies
+LINEAR_TERMS = (
+    ("W_FITNESS", "fitness_score"),
+    ("W_JOB", "job_score"),
+    ("W_BRANDING", "branding_score"),
+    ("W_MILEAGE", "mileage_score"),
+)
+
+DEFAULT_TOP_N = 10
+MAX_SCENARIOS = 100_000
+
+# Upper bound on trains x scenarios held in memory at once
+BLOCK_CELLS = 4_000_000
+
+
+def weight_matrix(scenarios):
+    """Normalise scenarios into a `(k, len(WEIGHT_NAMES))` float matrix.
+
+    `scenarios` is a 2-D array whose columns follow `WEIGHT_NAMES`, or a
+    list whose items are such rows or dicts of weight overrides merged
+    over the defaults.
+    """
+    if len(scenarios) == 0:
+        raise ValueError("At least one scenario is required")
+    if len(scenarios) > MAX_SCENARIOS:
+        raise ValueError(f"At most {MAX_SCENARIOS} scenarios per sweep")
+    if isinstance(scenarios, np.ndarray):
+        matrix = scenarios.astype(float)
+    else:
+        matrix = np.array(
+            [
+                (
+                    [resolve_weights(s)[name] for name in WEIGHT_NAMES]
+                    if isinstance(s, dict)
+                    else s
+                )
+                for s in scenarios
+            ],
+            dtype=float,
+        )
+    if matrix.ndim != 2 or matrix.shape[1] != len(WEIGHT_NAMES):
+        raise ValueError(
+            f"Weight rows must have {len(WEIGHT_NAMES)} values: {list(WEIGHT_NAMES)}"
+        )
+    return matrix
+
+
+def scenario_priorities(features, scores, weights):
+    """Priority score of every train under every scenario, shape `(n, k)`.
+
+    `scores` are the weight-independent columns from `compute_scores`;
+    `weights` is a matrix from `weight_matrix`.
+    """
+    col = {name: i for i, name in enumerate(WEIGHT_NAMES)}
+    linear = scores[[column for _, column in LINEAR_TERMS]].to_numpy(dtype=float)
+    combined = linear @ weights[:, [col[name] for name, _ in LINEAR_TERMS]].T
+
+    # CLEAN_UPCOMING_ALPHA reshapes the cleaning score before normalisation
+    freshness = features["clean_freshness_raw"].to_numpy(dtype=float)[:, None]
+    penalty = scores["clean_today_penalty"].to_numpy(dtype=float)[:, None]
+    alpha = weights[:, col["CLEAN_UPCOMING_ALPHA"]][None, :]
+    cleaning = minmax_columns(np.clip(freshness * (1.0 - alpha * penalty), 0.0, 1.0))
+    combined += cleaning * weights[:, col["W_CLEAN"]][None, :]
+
+    shunt = scores["shunt_penalty"].to_numpy(dtype=float)[:, None]
+    combined -= shunt * weights[:, col["SHUNT_LAMBDA"]][None, :]
+    return minmax_columns(combined)
+
+
+def _ranks(orders):
+    """1-based rank of each row under each scenario, from `rank_orders`"""
+    ranks = np.empty_like(orders)
+    np.put_along_axis(ranks, orders, np.arange(1, len(orders) + 1)[:, None], axis=0)
+    return ranks
+
+
+def sweep(features, scenarios, top_n=DEFAULT_TOP_N, scores=None):
+    """Rank the fleet under every scenario and summarise rank stability.
+
+    Returns `(orders, train_stats, scenario_stats)`:
+
+    - `orders`: `(k, n)` array of row positions into `features`, best first
+    - `train_stats`: per train baseline rank (default weights), mean,
+      std, min and max rank and the share of scenarios with it in the top N
+    - `scenario_stats`: per scenario Spearman correlation with the
+      baseline ranking and the overlap of its top N with the baseline's
+    """
+    weights = weight_matrix(scenarios)
+    if scores is None:
+        scores = compute_scores(features)
+    n, k = len(features), len(weights)
+    top_n = max(0, min(int(top_n), n))
+    eligible = eligibility(features)
+
+    baseline_weights = weight_matrix([resolve_weights()])
+    baseline = _ranks(
+        rank_orders(eligible, scenario_priorities(features, scores, baseline_weights))
+    )[:, 0]
+    baseline_top = baseline <= top_n
+
+    orders = np.empty((k, n), dtype=np.int64)
+    rank_sum = np.zeros(n)
+    rank_sq = np.zeros(n)
+    rank_min = np.full(n, n, dtype=np.int64)
+    rank_max = np.zeros(n, dtype=np.int64)
+    in_top = np.zeros(n, dtype=np.int64)
+    spearman = np.empty(k)
+    overlap = np.empty(k, dtype=np.int64)
+
+    centred = baseline - baseline.mean()
+    denominator = np.sqrt((centred**2).sum())
+    block = max(1, BLOCK_CELLS // max(n, 1))
+    for start in range(0, k, block):
+        stop = min(start + block, k)
+        block_orders = rank_orders(
+            eligible, scenario_priorities(features, scores, weights[start:stop])
+        )
+        ranks = _ranks(block_orders)
+        orders[start:stop] = block_orders.T
+        rank_sum += ranks.sum(axis=1)
+        rank_sq += (ranks.astype(float) ** 2).sum(axis=1)
+        rank_min = np.minimum(rank_min, ranks.min(axis=1))
+        rank_max = np.maximum(rank_max, ranks.max(axis=1))
+        top = ranks <= top_n
+        in_top += top.sum(axis=1)
+        overlap[start:stop] = (top & baseline_top[:, None]).sum(axis=0)
+        # Ranks are permutations of 1..n, so their spread equals the baseline's
+        if denominator > 0:
+            spearman[start:stop] = (centred @ (ranks - ranks.mean(axis=0))) / (
+                denominator**2
+            )
+        else:
+            spearman[start:stop] = 1.0
+
+    mean_rank = rank_sum / k
+    train_stats = pd.DataFrame(
+        {
+            "train_id": features["train_id"].to_numpy(),
+            "baseline_rank": baseline,
+            "mean_rank": mean_rank,
+            "std_rank": np.sqrt(np.maximum(rank_sq / k - mean_rank**2, 0.0)),
+            "min_rank": rank_min,
+            "max_rank": rank_max,
+            "top_n_share": in_top / k,
+        }
+    ).sort_values(["baseline_rank"], kind="stable", ignore_index=True)
+    scenario_stats = pd.DataFrame({"spearman": spearman, "top_n_overlap": overlap})
+    for i, name in enumerate(WEIGHT_NAMES):
+        scenario_stats[name] = weights[:, i]
+    return orders, train_stats, scenario_stats
@@ -0,0 +1,697 @@
+"""Columnar scoring core shared by the API and the batch ranking script.
+
+Train IDs are encoded once into a `TrainRegistry`, and every stage reduces
+one input table straight into per-train arrays indexed by those codes, so no
+stage needs a join on `train_id`.
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+
+from .cleaning import CleaningJobs
+from .metrics import span, timed
+from .mileage_store import WINDOWS, mileage_features, readings_frame
+from .registry import MISSING, TrainRegistry
+from .timeparse import parse_timestamps
+from .work_orders import CLOSED, open_mask, order_states
+from .yard import DEAD_END, Yard, assign_slots, line_groups, track_types
+
+PLANNING_TIME = pd.Timestamp("2025-09-01T21:00:00")
+
+# Constants for scoring
+SHUNT_LAMBDA = 0.25
+W_FITNESS = 0.15
+W_JOB = 0.20
+W_BRANDING = 0.25
+W_MILEAGE = 0.25
+W_CLEAN = 0.15
+CLEAN_UPCOMING_ALPHA = 0.8
+
+DEFAULT_WEIGHTS = {
+    "W_FITNESS": W_FITNESS,
+    "W_JOB": W_JOB,
+    "W_BRANDING": W_BRANDING,
+    "W_MILEAGE": W_MILEAGE,
+    "W_CLEAN": W_CLEAN,
+    "SHUNT_LAMBDA": SHUNT_LAMBDA,
+    "CLEAN_UPCOMING_ALPHA": CLEAN_UPCOMING_ALPHA,
+}
+
+# Top-K induction: trains listed after the winners as standby by default
+DEFAULT_STANDBY = 3
+INDUCT = "induct"
+STANDBY = "standby"
+
+MISSING_FITNESS_DAYS = -9999
+MISSING_CLEAN_AGE_HOURS = 99999.0
+CLEAN_FRESHNESS_HORIZON_HOURS = 72.0
+
+POSITION_RE = re.compile(r"(?i)\bline[_\-]?(\d+)[_\-]?pos[_\-]?(\d+)\b")
+
+
+def resolve_weights(weights=None):
+    """Merge user supplied weight overrides over the defaults"""
+    resolved = dict(DEFAULT_WEIGHTS)
+    if weights:
+        unknown = sorted(set(weights) - set(DEFAULT_WEIGHTS))
+        if unknown:
+            raise ValueError(f"Unknown scoring weights: {unknown}")
+        resolved.update({k: float(v) for k, v in weights.items()})
+    return resolved
+
+
+def minmax(values):
+    """Min-max normalise an array, ignoring NaN like `Series.min/max` do"""
+    v = np.asarray(values, dtype=float)
+    if v.size == 0:
+        return v.copy()
+    finite = ~np.isnan(v)
+    if not finite.any():
+        return np.zeros_like(v)
+    lo, hi = v[finite].min(), v[finite].max()
+    if hi == lo:
+        return np.zeros_like(v)
+    return (v - lo) / (hi - lo)
+
+
+def minmax_columns(values):
+    """Column-wise `minmax` of a 2-D array: NaN ignored, constant columns become zero"""
+    with np.errstate(invalid="ignore"):
+        finite = ~np.isnan(values)
+        any_finite = finite.any(axis=0)
+        lo = np.where(finite, values, np.inf).min(axis=0)
+        hi = np.where(finite, values, -np.inf).max(axis=0)
+        span = hi - lo
+        flat = ~any_finite | (span == 0)
+        out = (values - lo) / np.where(flat, 1.0, span)
+    out[:, flat] = 0.0
+    return out
+
+
+def collect_train_ids(*frames):
+    """Return the sorted union of `train_id` values across the given frames"""
+    return TrainRegistry.from_frames(*frames).ids
+
+
+def _encoded(frame, registry, codes):
+    """Registry and row codes for an aggregate's input table.
+
+    Without a registry the table is encoded on its own and the aggregate
+    returns train-indexed results rather than registry-aligned arrays.
+    """
+    if registry is None:
+        registry, (codes,) = TrainRegistry.encode_frames(frame)
+        return registry, codes, False
+    if codes is None:
+        codes = registry.encode(frame["train_id"])
+    return registry, codes, True
+
+
+def _per_train(registry, aligned, present, values, name=None):
+    """Aggregate arrays as returned: aligned with the registry, or by train id.
+
+    `values` is one array (a Series result) or a dict of arrays (a frame).
+    """
+    if aligned:
+        return values
+    index = pd.Index(registry.ids[present], name="train_id")
+    if isinstance(values, dict):
+        return pd.DataFrame({k: v[present] for k, v in values.items()}, index=index)
+    return pd.Series(values[present], index=index, name=name)
+
+
+def _counts(codes, rows, size):
+    """Number of the selected rows per code"""
+    return np.bincount(codes[rows], minlength=size)
+
+
+def _sums(codes, rows, values, size):
+    """Sum of `values` over the selected rows per code, NaN counted as zero"""
+    weights = np.nan_to_num(np.asarray(values, dtype=float)[rows], nan=0.0)
+    return np.bincount(codes[rows], weights=weights, minlength=size)
+
+
+def _last_rows(codes, order, size):
+    """Row of each code's last occurrence along `order`; `MISSING` if absent"""
+    ordered = codes[order]
+    keep = ordered >= 0
+    last = np.full(size, MISSING, dtype=np.int64)
+    np.maximum.at(last, ordered[keep], np.flatnonzero(keep))
+    return np.where(last >= 0, order[np.maximum(last, 0)], MISSING)
+
+
+def _stable_order(values):
+    """Row positions of `values` in stable sorted order, missing values last"""
+    return values.reset_index(drop=True).sort_values(kind="stable").index.to_numpy()
+
+
+def _datetimes(values, column):
+    """Parsed timestamps as a numpy datetime64 array (NaT where unparsable)"""
+    return parse_timestamps(values, column).to_numpy()
+
+
+def _take(values, rows, fill):
+    """`values[rows]`, with `fill` where a row is `MISSING`"""
+    out = np.asarray(values)[np.maximum(rows, 0)].copy()
+    out[rows < 0] = fill
+    return out
+
+
+def aggregate_fitness(fitness_df, registry=None, codes=None):
+    """Earliest certificate expiry per train"""
+    if fitness_df is None or fitness_df.empty:
+        return None
+    registry, codes, aligned = _encoded(fitness_df, registry, codes)
+    valid_to = _datetimes(fitness_df["valid_to"], "valid_to")
+    known = (codes >= 0) & ~np.isnat(valid_to)
+    earliest = registry.full(np.iinfo(np.int64).max, np.int64)
+    np.minimum.at(earliest, codes[known], valid_to[known].view(np.int64))
+    earliest = earliest.view(valid_to.dtype)
+    earliest[~_counts(codes, known, len(registry)).astype(bool)] = np.datetime64("NaT")
+    present = _counts(codes, codes >= 0, len(registry)) > 0
+    return _per_train(registry, aligned, present, earliest, "fitness_valid_till")
+
+
+def aggregate_work_orders(wo_df, registry=None, codes=None):
+    """Count and estimated hours of open work orders per train"""
+    if wo_df is None or wo_df.empty:
+        return None
+    registry, codes, aligned = _encoded(wo_df, registry, codes)
+    rows = open_mask(wo_df["status"]) & (codes >= 0)
+    hours = pd.to_numeric(wo_df["estimated_hours"], errors="coerce")
+    count = _counts(codes, rows, len(registry))
+    return _per_train(
+        registry,
+        aligned,
+        count > 0,
+        {
+            "open_wo_count": count,
+            "open_wo_hours": _sums(codes, rows, hours, len(registry)),
+        },
+    )
+
+
+def aggregate_branding(
+    branding_df, planning_time=PLANNING_TIME, registry=None, codes=None
+):
+    """Required exposure hours of the contracts active on the planning day"""
+    if branding_df is None or branding_df.empty:
+        return None
+    registry, codes, aligned = _encoded(branding_df, registry, codes)
+    today = planning_time.normalize()
+    start = parse_timestamps(branding_df["start_date"], "start_date").dt.normalize()
+    end = parse_timestamps(branding_df["end_date"], "end_date").dt.normalize()
+    active = ((start <= today) & (end >= today)).to_numpy() & (codes >= 0)
+    hours = pd.to_numeric(
+        branding_df["required_exposure_hours_per_day"], errors="coerce"
+    )
+    return _per_train(
+        registry,
+        aligned,
+        _counts(codes, active, len(registry)) > 0,
+        _sums(codes, active, hours, len(registry)),
+        "branding_hours",
+    )
+
+
+def aggregate_maintenance(
+    wo_df, planning_time=PLANNING_TIME, registry=None, codes=None
+):
+    """Latest `closed_at` of a closed work order, up to the planning time"""
+    if wo_df is None or wo_df.empty or "closed_at" not in wo_df.columns:
+        return None
+    registry, codes, aligned = _encoded(wo_df, registry, codes)
+    closed = (order_states(wo_df["status"]) == CLOSED).to_numpy(na_value=False)
+    closed_at = _datetimes(wo_df["closed_at"], "closed_at")
+    done = closed & (codes >= 0) & ~np.isnat(closed_at)
+    done &= closed_at <= np.datetime64(planning_time)
+    latest = registry.full(np.iinfo(np.int64).min, np.int64)
+    np.maximum.at(latest, codes[done], closed_at[done].view(np.int64))
+    present = _counts(codes, done, len(registry)) > 0
+    latest = latest.view(closed_at.dtype)
+    latest[~present] = np.datetime64("NaT")
+    return _per_train(registry, aligned, present, latest, "last_maintenance")
+
+
+def aggregate_mileage(
+    mileage_df,
+    planning_time=PLANNING_TIME,
+    registry=None,
+    codes=None,
+    since=None,
+    store=None,
+):
+    """Latest odometer reading and rolling-window kilometres per train.
+
+    `since` is each train's last maintenance (`aggregate_maintenance`).
+    Given a registry, a `MileageStore`'s history is read with the log.
+    """
+    if store is not None and registry is not None:
+        view = store.with_rows(mileage_df)
+        segments, train_codes, aligned = view.segments, view.codes(registry.ids), True
+    else:
+        if mileage_df is None or mileage_df.empty:
+            return None
+        registry, codes, aligned = _encoded(mileage_df, registry, codes)
+        segments = [readings_frame(mileage_df, codes)]
+        train_codes = np.arange(len(registry))
+    if since is not None and not isinstance(since, np.ndarray):
+        since = _align_values(since, registry)
+    out, present = mileage_features(segments, train_codes, planning_time, since)
+    return _per_train(registry, aligned, present, out)
+
+
+def aggregate_last_clean(cleaning_df_prev, registry=None, codes=None):
+    """End of the most recent completed cleaning per train"""
+    if cleaning_df_prev is None or cleaning_df_prev.empty:
+        return None
+    registry, codes, aligned = _encoded(cleaning_df_prev, registry, codes)
+    end = parse_timestamps(cleaning_df_prev["scheduled_end"], "scheduled_end")
+    latest = _last_rows(codes, _stable_order(end), len(registry))
+    return _per_train(
+        registry,
+        aligned,
+        latest >= 0,
+        _take(end.to_numpy(), latest, np.datetime64("NaT")),
+        "last_clean_end",
+    )
+
+
+def aggregate_clean_load(
+    cleaning_df, planning_time=PLANNING_TIME, registry=None, codes=None
+):
+    """Cleaning booked in the 24h after the planning time, per train.
+
+    `today_clean_load` is the booked man-hours; `clean_conflict_hours` the
+    hours of those bookings in which their bay is double-booked, and
+    `clean_conflict_load` the man-hours booked in that time.
+    """
+    if cleaning_df is None or cleaning_df.empty:
+        return None
+    jobs = CleaningJobs(cleaning_df)
+    in_window = jobs.starting_between(
+        planning_time, planning_time + pd.Timedelta(hours=24)
+    )
+    if not in_window.any():
+        return None
+    registry, codes, aligned = _encoded(cleaning_df, registry, codes)
+    conflict = jobs.conflict_hours()
+    rows = in_window & (codes >= 0)
+    size = len(registry)
+    return _per_train(
+        registry,
+        aligned,
+        _counts(codes, rows, size) > 0,
+        {
+            "today_clean_load": _sums(codes, rows, jobs.hours * jobs.manpower, size),
+            "clean_conflict_hours": _sums(codes, rows, conflict, size),
+            "clean_conflict_load": _sums(codes, rows, conflict * jobs.manpower, size),
+        },
+    )
+
+
+def parse_positions(position):
+    """Split stabling positions like `line_3_pos_1` into line id and slot"""
+    pid = position.astype(str).str.strip()
+    parts = pid.str.extract(POSITION_RE)
+    matched = parts[0].notna()
+    line_id = pid.where(~matched, "line_" + parts[0].fillna(""))
+    slot_idx = pd.to_numeric(parts[1], errors="coerce")
+    return line_id, slot_idx
+
+
+def aggregate_stabling(stabling_df, registry=None, codes=None):
+    """Stabling position, line, slot and track type per train"""
+    if stabling_df is None or stabling_df.empty:
+        return None
+    registry, codes, aligned = _encoded(stabling_df, registry, codes)
+    placed = np.where(stabling_df["position"].notna().to_numpy(), codes, MISSING)
+    # The first listed position of a train wins
+    first = _last_rows(placed, np.arange(len(placed))[::-1], len(registry))
+    present = first >= 0
+    position = stabling_df["position"].to_numpy(dtype=object)[first[present]]
+    line_id, slot_idx = parse_positions(pd.Series(position, dtype=object))
+    out = {
+        "position": registry.full(np.nan, object),
+        "line_id": registry.full(np.nan, object),
+        "slot_idx": registry.full(np.nan),
+    }
+    out["position"][present] = position
+    out["line_id"][present] = line_id.to_numpy(dtype=object)
+    out["slot_idx"][present] = slot_idx.to_numpy(dtype=float)
+    out["track_type"] = registry.full(DEAD_END, object)
+    if "track_type" in stabling_df.columns:
+        declared = stabling_df["track_type"].to_numpy(dtype=object)[first[present]]
+        out["track_type"][present] = track_types(declared)
+    return _per_train(registry, aligned, present, out)
+
+
+def _align(per_train, registry, fill):
+    """An aggregate column as a float array in registry order, gaps filled.
+
+    Registry-aligned arrays are used as they are; train-indexed Series are
+    looked up by ID.
+    """
+    if isinstance(per_train, np.ndarray):
+        values = per_train.astype(float)
+        return np.where(np.isnan(values), fill, values)
+    return registry.align(per_train, fill)
+
+
+def _align_values(per_train, registry):
+    """Like `_align` for non-numeric columns, leaving the gaps missing"""
+    if isinstance(per_train, np.ndarray):
+        return per_train
+    return per_train.reindex(registry.index).to_numpy()
+
+
+def assemble_features(trains, aggregates, planning_time=PLANNING_TIME):
+    """Lay the per-train aggregates out as columns aligned with `trains`.
+
+    `trains` is a `TrainRegistry` or a sorted array of train IDs. Aggregates
+    are either arrays aligned with the registry or train-indexed Series and
+    frames.
+    """
+    registry = trains if isinstance(trains, TrainRegistry) else TrainRegistry(trains)
+    trains = registry.ids
+    if len(trains) == 0:
+        raise ValueError(
+            "No train IDs found in provided files. Ensure `train_id` column is present in your CSVs."
+        )
+    df = pd.DataFrame({"train_id": trains})
+
+    valid_till = aggregates.get("fitness")
+    if valid_till is not None:
+        df["fitness_valid_till"] = _align_values(valid_till, registry)
+        days = (df["fitness_valid_till"] - planning_time).dt.days.to_numpy(
+            dtype=float, na_value=np.nan
+        )
+        days = np.where(np.isnan(days), MISSING_FITNESS_DAYS, days)
+    else:
+        days = np.zeros(len(trains))
+    df["fitness_days_left"] = np.maximum(days, 0)
+    df["fitness_priority_raw"] = 1.0 / (1.0 + df["fitness_days_left"].to_numpy())
+
+    wo = aggregates.get("work_orders")
+    wo_count = None if wo is None else wo["open_wo_count"]
+    wo_hours = None if wo is None else wo["open_wo_hours"]
+    df["open_wo_count"] = _align(wo_count, registry, 0).astype(int)
+    df["open_wo_hours"] = _align(wo_hours, registry, 0.0)
+
+    df["branding_hours"] = _align(aggregates.get("branding"), registry, 0.0)
+
+    mileage = aggregates.get("mileage")
+    km = None if mileage is None else mileage["cumulative_km"]
+    df["cumulative_km"] = _align(km, registry, 0.0)
+    for col in ("delta_km", *WINDOWS, "km_since_maintenance"):
+        values = None if mileage is None else mileage.get(col)
+        df[col] = _align(values, registry, 0.0)
+
+    last_clean = aggregates.get("last_clean")
+    if last_clean is not None:
+        df["last_clean_end"] = _align_values(last_clean, registry)
+        age = (planning_time - df["last_clean_end"]).dt.total_seconds() / 3600.0
+        df["clean_age_hours"] = age.fillna(MISSING_CLEAN_AGE_HOURS)
+    else:
+        df["clean_age_hours"] = MISSING_CLEAN_AGE_HOURS
+    age = df["clean_age_hours"].to_numpy(dtype=float)
+    df["clean_freshness_raw"] = np.clip(
+        1.0
+        - np.minimum(age, CLEAN_FRESHNESS_HORIZON_HOURS)
+        / CLEAN_FRESHNESS_HORIZON_HOURS,
+        0.0,
+        1.0,
+    )
+
+    clean = aggregates.get("clean_load")
+    if isinstance(clean, pd.Series):
+        # Aggregates kept before bay conflicts were tracked
+        clean = clean.to_frame("today_clean_load")
+    for col in ("today_clean_load", "clean_conflict_hours", "clean_conflict_load"):
+        df[col] = _align(None if clean is None else clean.get(col), registry, 0.0)
+    # Booked time the bay cannot give has to be rebooked, so it counts twice
+    df["clean_effective_load"] = (
+        df["today_clean_load"].to_numpy() + df["clean_conflict_load"].to_numpy()
+    )
+
+    stabling = aggregates.get("stabling")
+    if stabling is not None:
+        df["position"] = _align_values(stabling["position"], registry)
+        df["line_id"] = _align_values(stabling["line_id"], registry)
+        df["slot_idx"] = _align(stabling["slot_idx"], registry, np.nan)
+        track_type = stabling.get("track_type")
+        if track_type is None:
+            df["track_type"] = DEAD_END
+        else:
+            track_type = _align_values(track_type, registry)
+            df["track_type"] = np.where(pd.isna(track_type), DEAD_END, track_type)
+    else:
+        df["position"] = df["train_id"]
+        df["line_id"] = "default_line"
+        df["slot_idx"] = np.nan
+        df["track_type"] = DEAD_END
+    with span("slot_assignment", rows=len(trains)):
+        groups = line_groups(df["line_id"], trains)
+        df["slot_assigned"] = assign_slots(
+            groups, df["position"], df["slot_idx"], trains
+        )
+        yard = Yard(groups, df["slot_assigned"].to_numpy(), df["track_type"])
+        df["shunt_depth"] = yard.blockers()
+    return df
+
+
+def build_features(
+    fitness_df,
+    wo_df,
+    branding_df,
+    mileage_df,
+    cleaning_df,
+    stabling_df=None,
+    cleaning_df_prev=None,
+    planning_time=PLANNING_TIME,
+    mileage_store=None,
+):
+    """Reduce the raw input tables to one row of features per train.
+
+    Train IDs are encoded once into a `TrainRegistry`; every aggregate then
+    reduces its table straight into arrays aligned with it. A
+    `mileage_store` adds its odometer history to the mileage log.
+    """
+    with span("encode_train_ids"):
+        registry, codes = TrainRegistry.encode_frames(
+            fitness_df, wo_df, branding_df, mileage_df, cleaning_df, stabling_df
+        )
+    fitness, wo, branding, mileage, cleaning, stabling = codes
+    maintenance = timed(
+        "aggregate_maintenance",
+        aggregate_maintenance,
+        wo_df,
+        planning_time,
+        registry,
+        wo,
+    )
+    aggregates = {
+        "fitness": timed(
+            "aggregate_fitness", aggregate_fitness, fitness_df, registry, fitness
+        ),
+        "work_orders": timed(
+            "aggregate_work_orders", aggregate_work_orders, wo_df, registry, wo
+        ),
+        "branding": timed(
+            "aggregate_branding",
+            aggregate_branding,
+            branding_df,
+            planning_time,
+            registry,
+            branding,
+        ),
+        "maintenance": maintenance,
+        "mileage": timed(
+            "aggregate_mileage",
+            aggregate_mileage,
+            mileage_df,
+            planning_time,
+            registry,
+            mileage,
+            maintenance,
+            mileage_store,
+        ),
+        "last_clean": timed(
+            "aggregate_last_clean", aggregate_last_clean, cleaning_df_prev, registry
+        ),
+        "clean_load": timed(
+            "aggregate_clean_load",
+            aggregate_clean_load,
+            cleaning_df,
+            planning_time,
+            registry,
+            cleaning,
+        ),
+        "stabling": timed(
+            "aggregate_stabling", aggregate_stabling, stabling_df, registry, stabling
+        ),
+    }
+    with span("assemble_features", rows=len(registry)):
+        return assemble_features(registry, aggregates, planning_time)
+
+
+def mileage_bounds(km):
+    """Fleet mean km and the deviation that scores zero, for `mileage_score`"""
+    km_mean = np.nanmean(km) if not np.isnan(km).all() else 0.0
+    km_dev = np.abs(km - km_mean)
+    return km_mean, max(1.0, np.nanmax(km_dev) if len(km_dev) else 0.0)
+
+
+def shunt_bounds(depth):
+    """`(0, deepest slot)`: the range `shunt_penalty` divides depths by"""
+    return 0, max(1, int(depth.max(initial=0)))
+
+
+def compute_scores(features, weights=None):
+    """Normalised feature scores and the combined priority score per train"""
+    w = resolve_weights(weights)
+
+    km = features["cumulative_km"].to_numpy(dtype=float)
+    km_mean, max_abs = mileage_bounds(km)
+    km_dev = np.abs(km - km_mean)
+
+    clean_today_penalty = minmax(features["clean_effective_load"])
+    cleaning_score_raw = np.clip(
+        features["clean_freshness_raw"].to_numpy(dtype=float)
+        * (1.0 - w["CLEAN_UPCOMING_ALPHA"] * clean_today_penalty),
+        0.0,
+        1.0,
+    )
+
+    depth = features["shunt_depth"].to_numpy(dtype=float)
+    _, max_depth = shunt_bounds(depth)
+
+    scores = pd.DataFrame(
+        {
+            "train_id": features["train_id"].to_numpy(),
+            "fitness_score": minmax(features["fitness_priority_raw"]),
+            "job_score": 1.0 - minmax(features["open_wo_hours"]),
+            "branding_score": minmax(features["branding_hours"]),
+            "mileage_score": np.clip(1.0 - km_dev / max_abs, 0.0, 1.0),
+            "clean_freshness": minmax(features["clean_freshness_raw"]),
+            "clean_today_penalty": clean_today_penalty,
+            "cleaning_score_raw": cleaning_score_raw,
+            "cleaning_score": minmax(cleaning_score_raw),
+            "shunt_penalty": depth / float(max_depth),
+        },
+        index=features.index,
+    )
+    combined = (
+        w["W_FITNESS"] * scores["fitness_score"].to_numpy()
+        + w["W_JOB"] * scores["job_score"].to_numpy()
+        + w["W_BRANDING"] * scores["branding_score"].to_numpy()
+        + w["W_MILEAGE"] * scores["mileage_score"].to_numpy()
+        + w["W_CLEAN"] * scores["cleaning_score"].to_numpy()
+    ) - w["SHUNT_LAMBDA"] * scores["shunt_penalty"].to_numpy()
+    scores["priority_score"] = minmax(combined)
+    return scores
+
+
+def eligibility(features):
+    """Trains with a valid fitness certificate and no open work orders"""
+    return (features["fitness_days_left"].to_numpy() > 0) & (
+        features["open_wo_hours"].to_numpy() <= 0
+    )
+
+
+def rank_order(eligible, priority):
+    """Stable ordering: eligible first, then by descending priority"""
+    return np.lexsort((-np.asarray(priority, dtype=float), ~np.asarray(eligible)))
+
+
+def rank_orders(eligible, priorities):
+    """Column-wise `rank_order` over `(n, k)` priorities; row positions best first.
+
+    `eligible` is either one flag per row or an `(n, k)` array.
+    """
+    by_priority = np.argsort(-priorities, axis=0, kind="stable")
+    if eligible.ndim == 1:
+        flags = eligible[by_priority]
+    else:
+        flags = np.take_along_axis(eligible, by_priority, axis=0)
+    by_eligibility = np.argsort(~flags, axis=0, kind="stable")
+    return np.take_along_axis(by_priority, by_eligibility, axis=0)
+
+
+def top_k_order(eligible, priority, count):
+    """The first `count` eligible positions of `rank_order`, by partial selection.
+
+    Only the selected rows are sorted, so the cost beyond one linear pass
+    grows with `count` rather than with the fleet. Ties are broken by row
+    position exactly as the stable full sort does.
+    """
+    rows = np.flatnonzero(np.asarray(eligible))
+    if count <= 0:
+        return rows[:0]
+    p = np.asarray(priority, dtype=float)[rows]
+    p = np.where(np.isnan(p), -np.inf, p)
+    if count < len(rows):
+        kth = np.partition(p, len(p) - count)[len(p) - count]
+        better = p > kth
+        ties = np.flatnonzero(p == kth)[: count - int(better.sum())]
+        keep = better
+        keep[ties] = True
+        rows, p = rows[keep], p[keep]
+    return rows[np.lexsort((rows, -p))]
+
+
+def _ranked(features, scores, rows):
+    """Feature rows in the given order with their scores and eligibility attached"""
+    df = features.iloc[rows].reset_index(drop=True)
+    scores = scores.iloc[rows].reset_index(drop=True)
+    for col in (
+        "clean_today_penalty",
+        "cleaning_score_raw",
+        "clean_freshness",
+        "cleaning_score",
+    ):
+        df[col] = scores[col].to_numpy()
+    df["S"] = scores["shunt_penalty"].to_numpy()
+    df["priority_score"] = scores["priority_score"].to_numpy()
+    df["eligible"] = eligibility(df)
+    return df, scores
+
+
+def rank_trains(features, weights=None, scores=None):
+    """Score and sort the fleet; returns the ranked frame and its feature scores.
+
+    Pass precomputed `scores` (aligned with `features`) to skip scoring.
+    """
+    if scores is None:
+        scores = compute_scores(features, weights)
+    order = rank_order(eligibility(features), scores["priority_score"].to_numpy())
+    return _ranked(features, scores, order)
+
+
+def rank_top_k(features, k, standby=DEFAULT_STANDBY, weights=None, scores=None):
+    """The `k` best eligible trains and the next `standby` ones, in rank order.
+
+    Returns the same `(ranked, scores)` pair as `rank_trains`, limited to
+    the selected rows, with a `role` column (`induct` or `standby`). Fleet
+    totals and the shunt moves needed to pull the winners out of the yard
+    in rank order are kept in `ranked.attrs`.
+    """
+    if scores is None:
+        scores = compute_scores(features, weights)
+    eligible = eligibility(features)
+    rows = top_k_order(eligible, scores["priority_score"].to_numpy(), k + standby)
+    ranked, scores = _ranked(features, scores, rows)
+    ranked["role"] = np.where(np.arange(len(rows)) < k, INDUCT, STANDBY)
+    ranked.attrs.update(
+        {
+            "total_trains": len(features),
+            "eligible_trains": int(eligible.sum()),
+            "top_k": int(k),
+            "shunt_moves": int(
+                Yard.from_features(features).shunt_moves(rows[:k]).sum()
+            ),
+        }
+    )
+    return ranked, scores
@@ -0,0 +1,200 @@
+"""Column-wise assembly and encoding of ranking responses.
+
+Every response field is computed for the whole frame (or just the rows
+being returned) in one vectorized step, and the rows are zipped together
+only at the end. Encoding uses orjson when it is installed and falls back
+to the standard library otherwise. Views (offset/limit pagination, field
+selection and NDJSON streaming) are cut from an assembled body.
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+
+from .reasons import FITNESS_EXPIRED, decode, has_reason, render_reasons
+
+# Top-level fields of each result row, in response order
+RESULT_FIELDS = (
+    "train_id",
+    "priority_score",
+    "eligible",
+    "status",
+    "fitness_days_left",
+    "reasons",
+    "recommendations",
+    "reason_codes",
+    "cleaning",
+    "maintenance",
+)
+
+JSON = "json"
+NDJSON = "ndjson"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+NDJSON_CHUNK_ROWS = 1000
+
+
+def _orjson():
+    try:
+        import orjson
+    except ImportError:
+        return None
+    return orjson
+
+
+def dumps(content):
+    """Encode a response body as compact UTF-8 JSON bytes"""
+    orjson = _orjson()
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def loads(body):
+    orjson = _orjson()
+    return orjson.loads(body) if orjson is not None else json.loads(body)
+
+
+def parse_fields(fields):
+    """Validate a comma separated field list; None selects every field"""
+    if not fields:
+        return None
+    selected = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in selected if f not in RESULT_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown result fields: {unknown}")
+    return tuple(f for f in RESULT_FIELDS if f in selected)
+
+
+def _numbers(df, column, rows, dtype=float):
+    """Column values as a Python list, missing column or values as zero"""
+    if column not in df.columns:
+        return [dtype(0)] * len(rows)
+    values = df[column].to_numpy(dtype=float, na_value=np.nan)[rows]
+    return np.nan_to_num(values, nan=0.0).astype(dtype).tolist()
+
+
+def _timestamps(df, column, rows):
+    """ISO 8601 strings (None where missing) for a datetime column"""
+    if column not in df.columns:
+        return [None] * len(rows)
+    values = pd.Series(df[column].to_numpy()[rows])
+    if not pd.api.types.is_datetime64_any_dtype(values):
+        values = pd.to_datetime(values, errors="coerce")
+    known = values.notna().to_numpy()
+    out = np.full(len(values), None, dtype=object)
+    if known.any():
+        stamps = values[known]
+        if (stamps.dt.microsecond == 0).all() and (stamps.dt.nanosecond == 0).all():
+            out[known] = np.datetime_as_string(
+                stamps.to_numpy().astype("datetime64[s]"), unit="s"
+            )
+        else:
+            out[known] = [t.isoformat() for t in stamps]
+    return out.tolist()
+
+
+def result_columns(result_df, rows=None, fields=None):
+    """Response fields as columns (lists) for the selected rows of a ranked frame"""
+    rows = np.arange(len(result_df)) if rows is None else np.asarray(rows)
+    fields = fields or RESULT_FIELDS
+    columns = {}
+
+    if "train_id" in fields:
+        columns["train_id"] = (
+            result_df["train_id"].astype(str).to_numpy()[rows].tolist()
+        )
+    if "priority_score" in fields:
+        columns["priority_score"] = np.round(
+            result_df["priority_score"].to_numpy(dtype=float)[rows], 4
+        ).tolist()
+    eligible = result_df["eligible"].to_numpy(dtype=bool)[rows]
+    if "eligible" in fields:
+        columns["eligible"] = eligible.tolist()
+    if "status" in fields:
+        # Ready > Standby, overridden by Maintenance
+        open_wo = np.asarray(_numbers(result_df, "open_wo_count", rows, int))
+        expired = has_reason(result_df["reason_mask"].to_numpy()[rows], FITNESS_EXPIRED)
+        columns["status"] = np.where(
+            (open_wo > 0) | expired,
+            "Maintenance",
+            np.where(eligible, "Ready", "Standby"),
+        ).tolist()
+    if "fitness_days_left" in fields:
+        columns["fitness_days_left"] = _numbers(
+            result_df, "fitness_days_left", rows, int
+        )
+    if "reasons" in fields or "recommendations" in fields:
+        reasons, recommendations = render_reasons(result_df, rows)
+        columns["reasons"] = reasons
+        columns["recommendations"] = recommendations
+    if "reason_codes" in fields:
+        masks, inverse = np.unique(
+            result_df["reason_mask"].to_numpy()[rows], return_inverse=True
+        )
+        decoded = [decode(mask) for mask in masks]
+        columns["reason_codes"] = [list(decoded[i]) for i in inverse]
+    if "cleaning" in fields:
+        columns["cleaning"] = [
+            {
+                "last_clean_end": end,
+                "clean_age_hours": age,
+                "today_clean_load": load,
+            }
+            for end, age, load in zip(
+                _timestamps(result_df, "last_clean_end", rows),
+                _numbers(result_df, "clean_age_hours", rows),
+                _numbers(result_df, "today_clean_load", rows),
+            )
+        ]
+    if "maintenance" in fields:
+        columns["maintenance"] = [
+            {"open_work_orders": count, "open_work_order_hours": hours}
+            for count, hours in zip(
+                _numbers(result_df, "open_wo_count", rows, int),
+                _numbers(result_df, "open_wo_hours", rows),
+            )
+        ]
+    return columns
+
+
+def build_rows(columns, fields=None):
+    """Zip column lists into row objects with the fields in response order"""
+    fields = [f for f in (fields or RESULT_FIELDS) if f in columns]
+    return [dict(zip(fields, values)) for values in zip(*(columns[f] for f in fields))]
+
+
+def select_view(content, offset=0, limit=None, fields=None):
+    """A page of an assembled response body, optionally with fewer fields"""
+    results = content["results"]
+    stop = None if limit is None else offset + limit
+    return page_view(content, results[offset:stop], offset, limit, fields)
+
+
+def page_view(content, page, offset=0, limit=None, fields=None):
+    """`select_view` for a page of `content`'s results that was cut already"""
+    view = {k: v for k, v in content.items() if k != "results"}
+    if fields is not None:
+        page = [{f: row[f] for f in fields if f in row} for row in page]
+        if "standby" in view:
+            view["standby"] = [
+                {f: row[f] for f in fields if f in row} for row in view["standby"]
+            ]
+    if offset or limit is not None:
+        view["offset"] = offset
+        view["limit"] = limit
+        view["returned"] = len(page)
+    view["results"] = page
+    return view
+
+
+def iter_ndjson(content, chunk_rows=NDJSON_CHUNK_ROWS):
+    """Yield a response as NDJSON: a header line, then one line per result"""
+    header = {k: v for k, v in content.items() if k != "results"}
+    yield dumps(header) + b"\n"
+    results = content["results"]
+    for start in range(0, len(results), chunk_rows):
+        chunk = results[start : start + chunk_rows]
+        yield b"".join(dumps(row) + b"\n" for row in chunk)
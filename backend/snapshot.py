@@ -0,0 +1,184 @@
+"""The latest ranking, published as an immutable snapshot all processes read.
+
+A published ranking is written once under the snapshot directory as two
+files named by its version: `<version>.json`, the encoded response body,
+and `<version>.arrow`, its result rows as an Arrow IPC table with the
+other response fields in the schema metadata. `latest.json` names the
+current version and is swapped with `os.replace`, so a reader sees the
+old snapshot or the new one, never a mix of both.
+
+Each API worker memory-maps the current files once per version: the full
+body is served straight from the mapping, and pages or field selections
+are cut from the Arrow columns. Snapshots older than the newest `KEEP`
+are removed on publishing; a mapping already open stays readable.
+"""
+
+import json
+import mmap
+import os
+import tempfile
+import threading
+import time
+
+from .serialize import dumps, loads, page_view
+
+MANIFEST = "latest.json"
+KEEP = 3
+
+# Manifests a reader follows while newer publishes prune the files it names
+OPEN_ATTEMPTS = 5
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+    except ImportError:
+        raise RuntimeError("Ranking snapshots require `pyarrow`")
+    return pyarrow
+
+
+def snapshot_dir():
+    return os.environ.get(
+        "GALACTUS_SNAPSHOT_DIR",
+        os.path.join(tempfile.gettempdir(), "galactus-snapshots"),
+    )
+
+
+def _write(root, path, write):
+    """Write a file through a temporary name so it appears whole"""
+    fd, tmp = tempfile.mkstemp(dir=root, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            write(fh)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def publish(body, key=None, root=None, keep=KEEP):
+    """Publish an encoded ranking response as the latest snapshot.
+
+    `key` identifies the inputs it was computed from (the result cache
+    key). Returns the new version.
+    """
+    pa = _pyarrow()
+    root = root or snapshot_dir()
+    os.makedirs(root, exist_ok=True)
+    content = loads(body)
+    header = {k: v for k, v in content.items() if k != "results"}
+    table = pa.Table.from_pylist(content.get("results", []))
+    table = table.replace_schema_metadata({"header": dumps(header)})
+    version = f"{time.time_ns():020d}-{os.getpid()}"
+    base = os.path.join(root, version)
+
+    def write_table(fh):
+        with pa.ipc.new_file(fh, table.schema) as writer:
+            writer.write_table(table)
+
+    _write(root, base + ".arrow", write_table)
+    _write(root, base + ".json", lambda fh: fh.write(body))
+    manifest = {
+        "version": version,
+        "key": key,
+        "rows": table.num_rows,
+        "published": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    _write(
+        root,
+        os.path.join(root, MANIFEST),
+        lambda fh: fh.write(json.dumps(manifest).encode()),
+    )
+    _prune(root, keep, version)
+    return version
+
+
+def _prune(root, keep, current):
+    versions = sorted(
+        {name.rsplit(".", 1)[0] for name in os.listdir(root) if name.endswith(".arrow")}
+    )
+    for version in versions[:-keep]:
+        if version == current:
+            continue
+        for suffix in (".arrow", ".json"):
+            try:
+                os.unlink(os.path.join(root, version + suffix))
+            except FileNotFoundError:
+                pass
+
+
+class Snapshot:
+    """One published ranking, memory-mapped read-only"""
+
+    def __init__(self, root, manifest):
+        pa = _pyarrow()
+        self.version = manifest["version"]
+        self.key = manifest.get("key")
+        self.published = manifest.get("published")
+        base = os.path.join(root, self.version)
+        with open(base + ".json", "rb") as fh:
+            self.body = memoryview(mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ))
+        self.table = pa.ipc.open_file(pa.memory_map(base + ".arrow")).read_all()
+        self.header = json.loads(self.table.schema.metadata[b"header"])
+
+    def view(self, offset=0, limit=None, fields=None):
+        """Response content for a page of the results, like `select_view`"""
+        rows = self.table.num_rows
+        stop = rows if limit is None else min(rows, offset + limit)
+        page = self.table.slice(offset, max(0, stop - offset))
+        if fields is not None:
+            page = page.select([f for f in fields if f in page.column_names])
+        return page_view(self.header, page.to_pylist(), offset, limit, fields)
+
+
+class SnapshotReader:
+    """The latest snapshot under `root`, re-mapped when the manifest changes.
+
+    A request costs one `stat` of the manifest while the version holds.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or snapshot_dir()
+        self.current = None
+        self._stamp = None
+        self._lock = threading.Lock()
+
+    def latest(self):
+        """The current snapshot, or None if nothing was published"""
+        path = os.path.join(self.root, MANIFEST)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if stamp != self._stamp:
+            with self._lock:
+                if stamp != self._stamp:
+                    self._open(path)
+                    self._stamp = stamp
+        return self.current
+
+    def _open(self, path):
+        """Map the snapshot the manifest names.
+
+        A newer publish may prune the files between reading the manifest
+        and opening them, so a missing file is retried while the manifest
+        keeps changing; once it holds still the snapshot is gone and
+        FileNotFoundError is raised.
+        """
+        for _ in range(OPEN_ATTEMPTS):
+            with open(path, "rb") as fh:
+                raw = fh.read()
+            manifest = json.loads(raw)
+            if self.current is not None and self.current.version == manifest["version"]:
+                return
+            try:
+                self.current = Snapshot(self.root, manifest)
+                return
+            except FileNotFoundError:
+                with open(path, "rb") as fh:
+                    if fh.read() == raw:
+                        raise
+        raise FileNotFoundError(f"Snapshot files under {self.root} keep disappearing")
@@ -0,0 +1,484 @@
+"""Persistent per-train fleet state that absorbs delta feeds.
+
+`FleetState` keeps the per-train aggregates `build_features` produces,
+together with what is needed to update them (the work-order index,
+certificates, odometer history, cleaning jobs). Applying a
+batch of new or changed rows only touches the trains it mentions, and only
+the affected score columns are re-normalised.
+"""
+
+import copy
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from .ingest import MileageAggregate
+from .scoring import (
+    PLANNING_TIME,
+    aggregate_branding,
+    aggregate_clean_load,
+    aggregate_fitness,
+    aggregate_last_clean,
+    aggregate_stabling,
+    assemble_features,
+    collect_train_ids,
+    compute_scores,
+    eligibility,
+    mileage_bounds,
+    minmax,
+    rank_order,
+    rank_trains,
+    resolve_weights,
+    shunt_bounds,
+)
+from .work_orders import WorkOrderIndex
+
+# Columns owned by the stabling layout; deltas never change them
+STABLING_COLUMNS = [
+    "position",
+    "line_id",
+    "slot_idx",
+    "track_type",
+    "slot_assigned",
+    "shunt_depth",
+]
+
+# Normalised score column -> (raw feature column, whether the score is 1 - x)
+NORMALISED = {
+    "fitness_score": ("fitness_priority_raw", False),
+    "job_score": ("open_wo_hours", True),
+    "branding_score": ("branding_hours", False),
+    "clean_freshness": ("clean_freshness_raw", False),
+    "clean_today_penalty": ("clean_effective_load", False),
+}
+
+
+def _bounds(values):
+    finite = values[~np.isnan(values)]
+    if finite.size == 0:
+        return (np.nan, np.nan)
+    return (finite.min(), finite.max())
+
+
+def _scale(values, bounds):
+    """`minmax` against known bounds, for a subset of rows"""
+    lo, hi = bounds
+    if np.isnan(lo):
+        return np.zeros_like(values)
+    if hi == lo:
+        return np.zeros_like(values)
+    return (values - lo) / (hi - lo)
+
+
+def _keyed(frame, key, required=False):
+    """Index a table by its natural key; later rows win on duplicates.
+
+    Initial loads without the key column fall back to row positions, but
+    delta rows must carry it so that they can replace earlier rows.
+    """
+    if key not in frame.columns:
+        if required:
+            raise ValueError(f"Delta rows need a `{key}` column")
+        return frame.set_axis([f"row_{i}" for i in range(len(frame))])
+    frame = frame.set_index(key, drop=False)
+    return frame[~frame.index.duplicated(keep="last")]
+
+
+def _missing(value):
+    return value is None or (isinstance(value, float) and np.isnan(value))
+
+
+def _replace(aggregate, trains, fresh):
+    """Replace the aggregate rows for `trains` with `fresh`"""
+    if aggregate is not None:
+        aggregate = aggregate.drop(trains, errors="ignore")
+    if fresh is None or len(fresh) == 0:
+        return aggregate
+    return fresh if aggregate is None else pd.concat([aggregate, fresh])
+
+
+class FleetState:
+    """Per-train aggregates and scores that can be updated in place"""
+
+    def __init__(self, planning_time=PLANNING_TIME, weights=None):
+        self.planning_time = planning_time
+        self.weights = resolve_weights(weights)
+        self.aggregates = {}
+        self.certificates = None
+        self.work_orders = WorkOrderIndex(planning_time)
+        self.mileage = MileageAggregate()
+        self.cleaning_jobs = None
+        self.features = None
+        self.scores = None
+        self.combined = None
+        self.bounds = {}
+        self.version = 0
+        self._positions = None
+
+    @classmethod
+    def from_frames(
+        cls,
+        fitness_df,
+        wo_df,
+        branding_df,
+        mileage_df,
+        cleaning_df,
+        stabling_df=None,
+        cleaning_df_prev=None,
+        planning_time=PLANNING_TIME,
+        weights=None,
+        mileage_store=None,
+    ):
+        """Build the state from the same inputs `build_features` takes"""
+        state = cls(planning_time, weights)
+        if mileage_store is not None:
+            state.mileage = MileageAggregate(mileage_store)
+        if fitness_df is not None and not fitness_df.empty:
+            state.certificates = _keyed(fitness_df, "cert_id")
+        state.work_orders = WorkOrderIndex.from_frame(wo_df, planning_time)
+        if mileage_df is not None and not mileage_df.empty:
+            state.mileage.update(mileage_df)
+        if cleaning_df is not None and not cleaning_df.empty:
+            state.cleaning_jobs = cleaning_df.copy()
+
+        maintenance = state.work_orders.maintenance()
+        state.aggregates = {
+            "fitness": aggregate_fitness(fitness_df),
+            "work_orders": state.work_orders.totals(),
+            "maintenance": maintenance,
+            "branding": aggregate_branding(branding_df, planning_time),
+            "mileage": state.mileage.result(planning_time, maintenance),
+            "last_clean": aggregate_last_clean(cleaning_df_prev),
+            "clean_load": aggregate_clean_load(cleaning_df, planning_time),
+            "stabling": aggregate_stabling(stabling_df),
+        }
+        trains = collect_train_ids(
+            fitness_df, wo_df, branding_df, mileage_df, cleaning_df, stabling_df
+        )
+        state._rebuild(trains)
+        return state
+
+    # Delta feeds
+
+    def apply_mileage(self, rows):
+        """New odometer readings; the latest one per train wins"""
+        self.mileage.update(rows)
+        trains = pd.unique(rows["train_id"].dropna())
+        self._refresh_mileage(trains)
+        return trains
+
+    def _refresh_mileage(self, trains):
+        """Recompute the mileage windows of `trains` from the history"""
+        if len(self.mileage.store) == 0:
+            return
+        mileage = self.mileage.result(
+            self.planning_time, self.aggregates.get("maintenance"), trains
+        )
+        self.aggregates["mileage"] = _replace(
+            self.aggregates.get("mileage"), trains, mileage
+        )
+
+    def apply_work_orders(self, rows):
+        """Created work orders and status changes, keyed by `wo_id`"""
+        if "wo_id" not in rows.columns:
+            raise ValueError("Delta rows need a `wo_id` column")
+        return self._work_orders_changed(self.work_orders.upsert(rows))
+
+    def apply_work_order_events(self, events):
+        """Work-order create, status-change and close events, in order"""
+        if isinstance(events, pd.DataFrame):
+            events = [
+                {k: v for k, v in event.items() if not _missing(v)}
+                for event in events.to_dict(orient="records")
+            ]
+        return self._work_orders_changed(self.work_orders.apply(events))
+
+    def _work_orders_changed(self, trains):
+        trains = sorted(trains)
+        self.aggregates["work_orders"] = _replace(
+            self.aggregates.get("work_orders"),
+            trains,
+            self.work_orders.totals(trains),
+        )
+        # Closing a work order restarts the train's km since maintenance
+        maintenance = self.work_orders.maintenance()
+        if maintenance is not None:
+            self.aggregates["maintenance"] = maintenance
+            self._refresh_mileage(trains)
+        return trains
+
+    def apply_fitness(self, rows):
+        """New or renewed certificates, keyed by `cert_id`"""
+        rows = _keyed(rows, "cert_id", required=True)
+        certs = self.certificates
+        if certs is not None:
+            certs = pd.concat([certs.drop(rows.index, errors="ignore"), rows])
+        else:
+            certs = rows
+        self.certificates = certs
+
+        trains = pd.unique(rows["train_id"].dropna())
+        touched = certs[certs["train_id"].isin(trains)]
+        self.aggregates["fitness"] = _replace(
+            self.aggregates.get("fitness"), trains, aggregate_fitness(touched)
+        )
+        return trains
+
+    def apply_cleaning(self, rows):
+        """Newly scheduled cleaning jobs.
+
+        A new job can double-book its bay, so every train with a job in
+        the same bays is updated too.
+        """
+        jobs = self.cleaning_jobs
+        jobs = rows if jobs is None else pd.concat([jobs, rows], ignore_index=True)
+        jobs = jobs.drop_duplicates(ignore_index=True)
+        self.cleaning_jobs = jobs
+
+        touched = jobs["train_id"].isin(rows["train_id"].dropna())
+        if "bay_id" in rows.columns:
+            touched |= jobs["bay_id"].isin(rows["bay_id"].dropna())
+        trains = pd.unique(jobs["train_id"][touched].dropna())
+        fresh = aggregate_clean_load(jobs, self.planning_time)
+        if fresh is not None:
+            fresh = fresh.reindex(fresh.index.intersection(trains))
+        self.aggregates["clean_load"] = _replace(
+            self.aggregates.get("clean_load"), trains, fresh
+        )
+        return trains
+
+    def apply_cleaning_prev(self, rows):
+        """Completed cleanings; the latest end time per train wins"""
+        trains = pd.unique(rows["train_id"].dropna())
+        last = self.aggregates.get("last_clean")
+        known = pd.DataFrame(columns=["train_id", "scheduled_end"])
+        if last is not None:
+            last = last.reindex(last.index.intersection(trains))
+            known = pd.DataFrame(
+                {"train_id": last.index, "scheduled_end": last.to_numpy()}
+            )
+        latest = aggregate_last_clean(
+            pd.concat([known, rows[["train_id", "scheduled_end"]]], ignore_index=True)
+        )
+        self.aggregates["last_clean"] = _replace(
+            self.aggregates.get("last_clean"), trains, latest
+        )
+        return trains
+
+    def apply(self, deltas):
+        """Apply a dict of delta tables; returns the trains that changed.
+
+        The feeds are applied to a staged copy that replaces the state only
+        once all of them succeeded, so a batch with an invalid feed raises
+        and leaves the state as it was.
+        """
+        handlers = {
+            "mileage_logs": FleetState.apply_mileage,
+            "work_orders": FleetState.apply_work_orders,
+            "work_order_events": FleetState.apply_work_order_events,
+            "fitness_certificates": FleetState.apply_fitness,
+            "cleaning_schedule": FleetState.apply_cleaning,
+            "cleaning_schedule_prev": FleetState.apply_cleaning_prev,
+        }
+        unknown = sorted(set(deltas) - set(handlers))
+        if unknown:
+            raise ValueError(f"Unknown delta feeds: {unknown}")
+
+        staged = self._staged()
+        changed = set()
+        for name, rows in deltas.items():
+            if rows is None or len(rows) == 0:
+                continue
+            rows = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows)
+            changed.update(handlers[name](staged, rows))
+        self.__dict__.update(staged.__dict__)
+
+        changed = np.array(sorted(changed), dtype=object)
+        if len(changed) == 0:
+            return changed
+        missing = pd.Index(changed).difference(self.features["train_id"])
+        if len(missing):
+            # New trains shift stabling slots and row positions
+            self._rebuild(np.union1d(self.features["train_id"].to_numpy(), missing))
+        else:
+            self._refresh(changed)
+        self.version += 1
+        return changed
+
+    def _staged(self):
+        """A copy for the delta handlers to update.
+
+        Frames and arrays are shared, since the handlers replace them; what
+        they change in place (the aggregates dict, the work-order index,
+        the odometer history) is copied.
+        """
+        staged = copy.copy(self)
+        staged.aggregates = dict(self.aggregates)
+        staged.work_orders = self.work_orders.copy()
+        staged.mileage = copy.copy(self.mileage)
+        staged.mileage.store = self.mileage.store.with_rows()
+        return staged
+
+    # Features and scores
+
+    def _rebuild(self, trains):
+        self.features = assemble_features(trains, self.aggregates, self.planning_time)
+        self.scores = compute_scores(self.features, self.weights)
+        self.combined = self._combined()
+        self.bounds = {
+            col: _bounds(self.features[raw].to_numpy(dtype=float))
+            for col, (raw, _) in NORMALISED.items()
+        }
+        self.bounds["cleaning_score"] = _bounds(
+            self.scores["cleaning_score_raw"].to_numpy()
+        )
+        self.bounds["priority_score"] = _bounds(self.combined)
+        self.bounds["mileage_score"] = mileage_bounds(
+            self.features["cumulative_km"].to_numpy(dtype=float)
+        )
+        self.bounds["shunt_penalty"] = shunt_bounds(
+            self.features["shunt_depth"].to_numpy(dtype=float)
+        )
+
+    def _refresh(self, trains):
+        rows = self.features["train_id"].searchsorted(trains)
+        old_km = self.features["cumulative_km"].to_numpy()[rows].copy()
+        fresh = assemble_features(trains, self.aggregates, self.planning_time)
+        for col in fresh.columns:
+            if col in STABLING_COLUMNS or col == "train_id":
+                continue
+            if col not in self.features.columns:
+                empty = pd.Series(np.nan, index=self.features.index)
+                self.features[col] = empty.astype(fresh[col].dtype)
+            values = self.features[col].to_numpy().copy()
+            values[rows] = fresh[col].to_numpy()
+            self.features[col] = values
+        km_moved = not np.array_equal(
+            old_km, fresh["cumulative_km"].to_numpy(), equal_nan=True
+        )
+        self._rescore(rows, km_moved)
+
+    def _renormalise(self, col, raw, rows, invert=False):
+        """Rescale `col` for `rows`, or for every row if its bounds moved.
+
+        Returns the rows whose value may have changed (None means all).
+        """
+        bounds = _bounds(raw)
+        old = self.bounds.get(col, (np.nan, np.nan))
+        same = bounds == old or (np.isnan(bounds[0]) and np.isnan(old[0]))
+        self.bounds[col] = bounds
+        if same and rows is not None:
+            values = self.scores[col].to_numpy().copy()
+            scaled = _scale(raw[rows], bounds)
+            values[rows] = 1.0 - scaled if invert else scaled
+            self.scores[col] = values
+            return rows
+        scaled = minmax(raw)
+        self.scores[col] = 1.0 - scaled if invert else scaled
+        return None
+
+    def _combined(self):
+        w = self.weights
+        s = self.scores
+        return (
+            w["W_FITNESS"] * s["fitness_score"].to_numpy()
+            + w["W_JOB"] * s["job_score"].to_numpy()
+            + w["W_BRANDING"] * s["branding_score"].to_numpy()
+            + w["W_MILEAGE"] * s["mileage_score"].to_numpy()
+            + w["W_CLEAN"] * s["cleaning_score"].to_numpy()
+        ) - w["SHUNT_LAMBDA"] * s["shunt_penalty"].to_numpy()
+
+    def _rescore(self, rows, km_moved):
+        f = self.features
+        changed = {
+            col: self._renormalise(col, f[raw].to_numpy(dtype=float), rows, invert)
+            for col, (raw, invert) in NORMALISED.items()
+        }
+
+        # The mileage score is relative to the fleet mean, so it moves as a whole
+        if km_moved:
+            km = f["cumulative_km"].to_numpy(dtype=float)
+            km_mean, max_abs = self.bounds["mileage_score"] = mileage_bounds(km)
+            km_dev = np.abs(km - km_mean)
+            self.scores["mileage_score"] = np.clip(1.0 - km_dev / max_abs, 0.0, 1.0)
+            changed["mileage_score"] = None
+
+        clean_rows = rows
+        if changed["clean_freshness"] is None or changed["clean_today_penalty"] is None:
+            clean_rows = slice(None)
+        cleaning_raw = self.scores["cleaning_score_raw"].to_numpy().copy()
+        cleaning_raw[clean_rows] = np.clip(
+            f["clean_freshness_raw"].to_numpy(dtype=float)[clean_rows]
+            * (
+                1.0
+                - self.weights["CLEAN_UPCOMING_ALPHA"]
+                * self.scores["clean_today_penalty"].to_numpy()[clean_rows]
+            ),
+            0.0,
+            1.0,
+        )
+        self.scores["cleaning_score_raw"] = cleaning_raw
+        changed["cleaning_score"] = self._renormalise(
+            "cleaning_score",
+            cleaning_raw,
+            None if isinstance(clean_rows, slice) else clean_rows,
+        )
+
+        combined_rows = rows
+        if any(v is None for v in changed.values()):
+            combined_rows = slice(None)
+        self.combined[combined_rows] = self._combined()[combined_rows]
+        self._renormalise(
+            "priority_score",
+            self.combined,
+            None if isinstance(combined_rows, slice) else combined_rows,
+        )
+
+    # Output
+
+    def eligible(self, train_id):
+        """Whether one train may enter service; None for an unknown train.
+
+        The work-order half is read from the open-order index.
+        """
+        trains = self.features["train_id"]
+        row = trains.searchsorted(train_id)
+        if row >= len(trains) or trains.iloc[row] != train_id:
+            return None
+        days = self.features["fitness_days_left"].iloc[row]
+        return bool(days > 0 and self.work_orders.is_clear(train_id))
+
+    def rows(self, train_ids):
+        """Row of each train in `features`, -1 for unknown trains"""
+        trains = self.features["train_id"].to_numpy()
+        if len(trains) == 0:
+            return np.full(len(train_ids), -1)
+        rows = np.searchsorted(trains, train_ids).clip(max=len(trains) - 1)
+        known = trains[rows] == np.asarray(train_ids, dtype=object)
+        return np.where(known, rows, -1)
+
+    def positions(self):
+        """Rank position of each row (0 is first), kept until the state changes"""
+        cached = getattr(self, "_positions", None)
+        if cached is None or cached[0] != self.version:
+            order = rank_order(
+                eligibility(self.features), self.scores["priority_score"].to_numpy()
+            )
+            positions = np.empty(len(order), dtype=np.int64)
+            positions[order] = np.arange(len(order))
+            self._positions = cached = (self.version, positions)
+        return cached[1]
+
+    def ranking(self):
+        """Ranked frame and feature scores, identical to `rank_trains`"""
+        return rank_trains(self.features, self.weights, scores=self.scores)
+
+    def save(self, path):
+        with open(path, "wb") as fh:
+            pickle.dump(self, fh, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path):
+        with open(path, "rb") as fh:
+            return pickle.load(fh)
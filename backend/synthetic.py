@@ -0,0 +1,382 @@
+"""Deterministic synthetic depot exports for load testing and benchmarks.
+
+Generates every input the ranking API reads with the same columns and
+value shapes as the exports in `data/`. Output depends only on the fleet
+size, the number of mileage rows and the seed. Mileage logs are produced
+in fixed-size blocks, each with its own random stream, so fleets with
+hundreds of millions of readings can be written without holding them in
+memory and the bytes do not depend on how they are consumed.
+
+    python -m backend.synthetic OUT_DIR --trains 10000 --mileage-rows 10000000
+"""
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from .batch import DEPOT_INPUTS
+from .cleaning import CLEANING_DURATION_MINS
+from .scoring import PLANNING_TIME
+
+DEFAULT_SEED = 0
+DEFAULT_TRAINS = 25
+MAX_TRAINS = 100_000
+MAX_MILEAGE_ROWS = 100_000_000
+
+# Rows per mileage block; part of the output definition, not a tuning knob
+MILEAGE_BLOCK_ROWS = 1_000_000
+
+# Longest history covered by a mileage log, however many readings it holds
+MILEAGE_HISTORY_DAYS = 365
+DAILY_KM = (200.0, 380.0)
+
+CERT_TYPES = ("rolling_stock", "signalling", "telecom")
+ASSETS = ("traction", "doors", "HVAC", "compressor", "bogie", "brake_pad")
+WORK_TYPES = ("replace", "adjustment", "repair", "inspection")
+PRIORITIES = ("high", "medium", "low")
+ADVERTISERS = ("BrandA", "BrandB", "BrandC", "BrandD")
+EXPOSURE_HOURS = (4, 6, 8, 10)
+CLEANING_TYPES = tuple(CLEANING_DURATION_MINS)
+CLEANING_MANPOWER = {"daily": 2, "outside_cleaning": 1, "heavy": 6}
+
+WORK_ORDERS_PER_TRAIN = 2.4
+OPEN_WORK_ORDER_SHARE = 0.13
+BRANDED_SHARE = 0.33
+CLEANED_SHARE = 0.5
+TRAINS_PER_BAY = 5
+TRAINS_PER_LINE = 2
+
+FORMATS = {"csv": ".csv", "parquet": ".parquet"}
+
+# Sub-streams of the seed, one per table
+_STREAMS = {
+    "fitness_certificates": 1,
+    "work_orders_maximo": 2,
+    "branding_schedule": 3,
+    "mileage_logs": 4,
+    "cleaning_schedule": 5,
+    "stabling_layout": 6,
+    "cleaning_schedule_prev": 7,
+}
+
+
+def _rng(seed, table, block=0):
+    return np.random.default_rng([seed, _STREAMS[table], block])
+
+
+def _iso(values):
+    """`YYYY-MM-DDTHH:MM:SS` strings for datetime64 values"""
+    return np.datetime_as_string(np.asarray(values, dtype="datetime64[s]"), unit="s")
+
+
+def _days(values):
+    return np.asarray(values, dtype="datetime64[D]").astype(str)
+
+
+def _choice(rng, options, size):
+    return np.asarray(options, dtype=object)[rng.integers(0, len(options), size)]
+
+
+def train_ids(trains):
+    """Fleet train IDs in the exports' `SET_001` form"""
+    width = max(3, len(str(trains)))
+    return np.array([f"SET_{i:0{width}d}" for i in range(1, trains + 1)], dtype=object)
+
+
+def _check_size(trains, mileage_rows=0):
+    if not 1 <= trains <= MAX_TRAINS:
+        raise ValueError(f"Fleet size must be between 1 and {MAX_TRAINS} trains")
+    if not 0 <= mileage_rows <= MAX_MILEAGE_ROWS:
+        raise ValueError(f"At most {MAX_MILEAGE_ROWS} mileage rows")
+
+
+def _planning(planning_time):
+    return pd.Timestamp(planning_time).to_datetime64().astype("datetime64[s]")
+
+
+def fitness_certificates(trains, seed=DEFAULT_SEED, planning_time=PLANNING_TIME):
+    """One certificate of each type per train; about one in six expired"""
+    rng = _rng(seed, "fitness_certificates")
+    ids = train_ids(trains)
+    now = _planning(planning_time)
+    n = trains * len(CERT_TYPES)
+    train = np.repeat(ids, len(CERT_TYPES))
+    cert_type = np.tile(np.asarray(CERT_TYPES, dtype=object), trains)
+    valid_from = now - rng.integers(75, 530, n).astype("timedelta64[D]")
+    valid_to = now + rng.integers(-28, 118, n).astype("timedelta64[D]")
+    codes = np.tile([t[:3].upper() for t in CERT_TYPES], trains)
+    return pd.DataFrame(
+        {
+            "cert_id": [f"C_{t}_{c}" for t, c in zip(train, codes)],
+            "train_id": train,
+            "cert_type": cert_type,
+            "issued_by": np.tile(
+                np.asarray([f"{t.capitalize()}Dept" for t in CERT_TYPES], dtype=object),
+                trains,
+            ),
+            "valid_from": _iso(valid_from),
+            "valid_to": _iso(valid_to),
+            "notes": np.where(valid_to < now, "EXPIRED", None),
+            "document_link": None,
+        }
+    )
+
+
+def work_orders(trains, seed=DEFAULT_SEED, planning_time=PLANNING_TIME):
+    """Maximo work orders, a few per train, mostly closed"""
+    rng = _rng(seed, "work_orders_maximo")
+    ids = train_ids(trains)
+    now = _planning(planning_time)
+    counts = rng.poisson(WORK_ORDERS_PER_TRAIN, trains)
+    n = int(counts.sum())
+    width = max(4, len(str(n)))
+    created = now - rng.integers(24, 57 * 24, n).astype("timedelta64[h]")
+    closed = created + rng.integers(3, 50, n).astype("timedelta64[h]")
+    is_open = rng.random(n) < OPEN_WORK_ORDER_SHARE
+    return pd.DataFrame(
+        {
+            "wo_id": [f"WO_{i:0{width}d}" for i in range(1, n + 1)],
+            "train_id": np.repeat(ids, counts),
+            "asset": _choice(rng, ASSETS, n),
+            "work_type": _choice(rng, WORK_TYPES, n),
+            "status": np.where(is_open, "open", "closed"),
+            "created_at": _iso(created),
+            "closed_at": np.where(is_open, None, _iso(closed).astype(object)),
+            "priority": _choice(rng, PRIORITIES, n),
+            "estimated_hours": rng.integers(1, 48, n),
+        }
+    )
+
+
+def branding_schedule(trains, seed=DEFAULT_SEED, planning_time=PLANNING_TIME):
+    """One advertising contract for about a third of the fleet"""
+    rng = _rng(seed, "branding_schedule")
+    ids = train_ids(trains)
+    now = _planning(planning_time)
+    branded = ids[rng.random(trains) < BRANDED_SHARE]
+    n = len(branded)
+    return pd.DataFrame(
+        {
+            "contract_id": [f"AD_{t}" for t in branded],
+            "train_id": branded,
+            "advertiser": _choice(rng, ADVERTISERS, n),
+            "start_date": _days(now - rng.integers(10, 60, n).astype("timedelta64[D]")),
+            "end_date": _days(now + rng.integers(30, 160, n).astype("timedelta64[D]")),
+            "required_exposure_hours_per_day": _choice(rng, EXPOSURE_HOURS, n).astype(
+                int
+            ),
+            "sla_priority": _choice(rng, ("low", "medium"), n),
+        }
+    )
+
+
+def _cleaning(trains, seed, table, night):
+    rng = _rng(seed, table)
+    ids = train_ids(trains)
+    cleaned = ids[rng.random(trains) < CLEANED_SHARE]
+    n = len(cleaned)
+    bays = max(1, -(-trains // TRAINS_PER_BAY))
+    width = max(2, len(str(bays)))
+    cleaning_type = _choice(rng, CLEANING_TYPES, n)
+    # Jobs start on the hour between 21:00 and 02:00 of the night
+    start = night + rng.integers(0, 6, n).astype("timedelta64[h]")
+    minutes = np.array([CLEANING_DURATION_MINS[t] for t in cleaning_type])
+    return pd.DataFrame(
+        {
+            "bay_id": [f"CL_{b:0{width}d}" for b in rng.integers(1, bays + 1, n)],
+            "train_id": cleaned,
+            "scheduled_start": _iso(start),
+            "scheduled_end": _iso(start + minutes.astype("timedelta64[m]")),
+            "cleaning_type": cleaning_type,
+            "manpower_required": [CLEANING_MANPOWER[t] for t in cleaning_type],
+            "occupied": "yes",
+        }
+    )
+
+
+def cleaning_schedule(trains, seed=DEFAULT_SEED, planning_time=PLANNING_TIME):
+    """Cleaning jobs booked for the planning night"""
+    return _cleaning(trains, seed, "cleaning_schedule", _planning(planning_time))
+
+
+def cleaning_schedule_prev(trains, seed=DEFAULT_SEED, planning_time=PLANNING_TIME):
+    """Cleaning jobs completed the night before"""
+    night = _planning(planning_time) - np.timedelta64(1, "D")
+    return _cleaning(trains, seed, "cleaning_schedule_prev", night)
+
+
+def stabling_layout(trains, seed=DEFAULT_SEED, planning_time=PLANNING_TIME):
+    """Two trains per stabling line, in fleet order"""
+    slot = np.arange(trains)
+    return pd.DataFrame(
+        {
+            "train_id": train_ids(trains),
+            "position": [
+                f"line_{line}_pos_{pos}"
+                for line, pos in zip(
+                    slot // TRAINS_PER_LINE + 1, slot % TRAINS_PER_LINE
+                )
+            ],
+        }
+    )
+
+
+def iter_mileage_logs(
+    trains,
+    mileage_rows=None,
+    seed=DEFAULT_SEED,
+    planning_time=PLANNING_TIME,
+):
+    """Yield the mileage log in blocks of `MILEAGE_BLOCK_ROWS` rows.
+
+    Readings go round the fleet in train order, daily or, for longer logs,
+    evenly spaced over `MILEAGE_HISTORY_DAYS`; every train's last reading
+    falls within the day before the planning time. Defaults to one
+    reading per train.
+    """
+    mileage_rows = trains if mileage_rows is None else mileage_rows
+    _check_size(trains, mileage_rows)
+    ids = train_ids(trains)
+    now = _planning(planning_time)
+    readings = -(-mileage_rows // trains)
+    interval_s = min(86400, MILEAGE_HISTORY_DAYS * 86400 // readings)
+    odometer = _rng(seed, "mileage_logs", 0).uniform(70_000, 420_000, trains).round()
+
+    for block, start in enumerate(range(0, mileage_rows, MILEAGE_BLOCK_ROWS)):
+        rng = _rng(seed, "mileage_logs", block + 1)
+        count = min(MILEAGE_BLOCK_ROWS, mileage_rows - start)
+        row = np.arange(start, start + count)
+        code, reading = row % trains, row // trains
+        # Trains in the last, partial lap of the fleet take fewer readings
+        lap_end = np.minimum(readings, -(-(mileage_rows - code) // trains))
+        recorded = now - ((lap_end - 1 - reading) * interval_s).astype("timedelta64[s]")
+        recorded -= rng.integers(0, 24, count).astype("timedelta64[h]") * (
+            interval_s >= 86400
+        )
+        delta = rng.uniform(*DAILY_KM, count) * (interval_s / 86400)
+        delta = np.maximum(delta.round(), 1.0)
+
+        # Running odometer per train: lay the block out one lap per row
+        lead = start % trains
+        laps = np.zeros(-(-(lead + count) // trains) * trains)
+        laps[lead : lead + count] = delta
+        laps = laps.reshape(-1, trains)
+        running = laps.cumsum(axis=0).ravel()[lead : lead + count]
+        yield pd.DataFrame(
+            {
+                "train_id": ids[code],
+                "recorded_at": _iso(recorded),
+                "odometer_km": (odometer[code] + running).astype(np.int64),
+                "delta_km": delta.astype(np.int64),
+            }
+        )
+        odometer += laps.sum(axis=0)
+
+
+def mileage_logs(
+    trains, mileage_rows=None, seed=DEFAULT_SEED, planning_time=PLANNING_TIME
+):
+    """The whole mileage log as one frame"""
+    return pd.concat(
+        list(iter_mileage_logs(trains, mileage_rows, seed, planning_time)),
+        ignore_index=True,
+    )
+
+
+GENERATORS = {
+    "fitness_certificates": fitness_certificates,
+    "work_orders_maximo": work_orders,
+    "branding_schedule": branding_schedule,
+    "cleaning_schedule": cleaning_schedule,
+    "stabling_layout": stabling_layout,
+    "cleaning_schedule_prev": cleaning_schedule_prev,
+}
+
+
+def generate_fleet(
+    trains=DEFAULT_TRAINS,
+    mileage_rows=None,
+    seed=DEFAULT_SEED,
+    planning_time=PLANNING_TIME,
+):
+    """Every export in memory, keyed by file stem as in `data/`"""
+    _check_size(trains, trains if mileage_rows is None else mileage_rows)
+    tables = {
+        stem: GENERATORS[stem](trains, seed, planning_time)
+        for stem in DEPOT_INPUTS.values()
+        if stem != "mileage_logs"
+    }
+    tables["mileage_logs"] = mileage_logs(trains, mileage_rows, seed, planning_time)
+    return {stem: tables[stem] for stem in DEPOT_INPUTS.values()}
+
+
+def _write_blocks(blocks, path, fmt):
+    if fmt == "csv":
+        with open(path, "w", encoding="utf-8", newline="") as fh:
+            for i, block in enumerate(blocks):
+                block.to_csv(fh, index=False, header=i == 0)
+        return
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    try:
+        for block in blocks:
+            table = pa.Table.from_pandas(block, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def write_fleet(
+    out_dir,
+    trains=DEFAULT_TRAINS,
+    mileage_rows=None,
+    seed=DEFAULT_SEED,
+    fmt="csv",
+    planning_time=PLANNING_TIME,
+):
+    """Write every export under `out_dir`; returns file stem -> path.
+
+    The mileage log is streamed to disk block by block.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}; expected one of {list(FORMATS)}")
+    _check_size(trains, trains if mileage_rows is None else mileage_rows)
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {}
+    for stem in DEPOT_INPUTS.values():
+        path = os.path.join(out_dir, stem + FORMATS[fmt])
+        if stem == "mileage_logs":
+            blocks = iter_mileage_logs(trains, mileage_rows, seed, planning_time)
+        else:
+            blocks = [GENERATORS[stem](trains, seed, planning_time)]
+        _write_blocks(blocks, path, fmt)
+        paths[stem] = path
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("out_dir")
+    parser.add_argument("--trains", type=int, default=DEFAULT_TRAINS)
+    parser.add_argument(
+        "--mileage-rows", type=int, help="default: one reading per train"
+    )
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--format", choices=list(FORMATS), default="csv")
+    args = parser.parse_args(argv)
+    paths = write_fleet(
+        args.out_dir, args.trains, args.mileage_rows, args.seed, args.format
+    )
+    for stem, path in paths.items():
+        print(f"{stem}: {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+"""Shared fixtures: a small deterministic fleet from `backend.synthetic`"""
+
+import pytest
+
+from ..synthetic import generate_fleet
+
+TRAINS = 200
+MILEAGE_ROWS = 2_000
+SEED = 0
+
+INPUTS = (
+    "fitness_certificates",
+    "work_orders_maximo",
+    "branding_schedule",
+    "mileage_logs",
+    "cleaning_schedule",
+)
+
+
+@pytest.fixture
+def fleet():
+    """Every export of the test fleet, keyed by file stem"""
+    return generate_fleet(TRAINS, MILEAGE_ROWS, SEED)
+
+
+def frames(fleet, **replaced):
+    """Positional and keyword arguments of `build_features` for a fleet"""
+    tables = dict(fleet, **replaced)
+    args = [tables[stem].copy() for stem in INPUTS]
+    kwargs = {
+        "stabling_df": tables["stabling_layout"].copy(),
+        "cleaning_df_prev": tables["cleaning_schedule_prev"].copy(),
+    }
+    return args, kwargs
@@ -0,0 +1,50 @@
+import pytest
+
+from ..batch import DEPOT_INPUTS
+from ..cache import ResultCache
+from ..snapshot import SnapshotReader
+from ..synthetic import write_fleet
+from .conftest import MILEAGE_ROWS, SEED, TRAINS
+
+testclient = pytest.importorskip("fastapi.testclient")
+pytest.importorskip("pyarrow")
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    from .. import app
+
+    monkeypatch.setattr(app, "result_cache", ResultCache())
+    monkeypatch.setattr(app, "snapshots", SnapshotReader(str(tmp_path / "snapshots")))
+    paths = write_fleet(str(tmp_path), TRAINS, MILEAGE_ROWS, SEED)
+
+    def run(**params):
+        files = {
+            field: open(paths[stem], "rb")
+            for field, stem in DEPOT_INPUTS.items()
+            if stem in paths
+        }
+        try:
+            response = client.post("/api/run-optimization", files=files, params=params)
+        finally:
+            for fh in files.values():
+                fh.close()
+        assert response.status_code == 200, response.text
+        return response.json()
+
+    with testclient.TestClient(app.app) as client:
+        yield run, client
+
+
+def test_top_k_is_not_published(api):
+    run, client = api
+    run(top_k=5)
+    assert client.get("/api/ranking/latest").status_code == 404
+
+    full = run()
+    latest = client.get("/api/ranking/latest")
+    assert latest.status_code == 200
+    assert latest.json()["results"] == full["results"]
+
+    run(top_k=5, keep_state=True)
+    assert client.get("/api/ranking/latest").json()["results"] == full["results"]
@@ -0,0 +1,58 @@
+import io
+
+import pandas as pd
+import pytest
+
+from ..ingest import read_input, stream_features
+from ..scoring import build_features
+
+# Input kind of each export stem
+KINDS = {
+    "fitness_certificates": "fitness_certificates",
+    "work_orders_maximo": "work_order_maximo",
+    "branding_schedule": "branding_schedule",
+    "mileage_logs": "mileage_logs",
+    "cleaning_schedule": "cleaning_schedule",
+    "stabling_layout": "stabling_layout",
+    "cleaning_schedule_prev": "cleaning_schedule_prev",
+}
+STREAMED = ("fitness_certificates", "work_orders_maximo", "mileage_logs")
+
+
+@pytest.fixture
+def numeric_ids(fleet):
+    """The test fleet as CSV files, with train IDs like `001`"""
+    files = {}
+    for stem, table in fleet.items():
+        table = table.assign(train_id=table["train_id"].str.replace("SET_", ""))
+        files[stem] = table.to_csv(index=False).encode()
+    return files
+
+
+def test_streaming_matches_in_memory(numeric_ids):
+    def read(stem):
+        return read_input(io.BytesIO(numeric_ids[stem]), KINDS[stem])
+
+    expected = build_features(
+        read("fitness_certificates"),
+        read("work_orders_maximo"),
+        read("branding_schedule"),
+        read("mileage_logs"),
+        read("cleaning_schedule"),
+        stabling_df=read("stabling_layout"),
+        cleaning_df_prev=read("cleaning_schedule_prev"),
+    )
+    sources = {stem: io.BytesIO(numeric_ids[stem]) for stem in STREAMED}
+    streamed = stream_features(
+        sources["fitness_certificates"],
+        sources["work_orders_maximo"],
+        read("branding_schedule"),
+        sources["mileage_logs"],
+        read("cleaning_schedule"),
+        stabling_df=read("stabling_layout"),
+        cleaning_df_prev=read("cleaning_schedule_prev"),
+        chunksize=256,
+    )
+
+    assert streamed["train_id"].iloc[0] == "001"
+    pd.testing.assert_frame_equal(streamed, expected, check_dtype=False)
@@ -0,0 +1,54 @@
+import asyncio
+import os
+from concurrent.futures import Future
+
+import pytest
+
+from ..jobs import DONE, FAILED, Job, JobQueue
+
+
+def double(x):
+    return 2 * x
+
+
+def crash():
+    os._exit(1)
+
+
+@pytest.fixture
+def queue():
+    queue = JobQueue(max_workers=1)
+    yield queue
+    queue.shutdown()
+
+
+def run(job):
+    assert asyncio.run(job.wait(timeout=30))
+    return job
+
+
+def test_result_is_set_once_done(queue):
+    job, joined = queue.submit("a", double, 21)
+    assert not joined
+    assert run(job).status == DONE
+    assert job.result == 42
+
+
+def test_status_waits_for_the_result():
+    future = Future()
+    job = Job(future=future)
+    future.set_result(5)
+    # The future is done but `_finish` has not stored its value yet
+    assert job.status != DONE
+    assert not asyncio.run(job.wait(timeout=0.01))
+    job._finish(future)
+    assert job.status == DONE
+    assert job.result == 5
+
+
+def test_pool_recovers_from_a_crashed_worker(queue):
+    crashed, _ = queue.submit(None, crash)
+    assert run(crashed).status == FAILED
+    job, _ = queue.submit(None, double, 4)
+    assert run(job).status == DONE
+    assert job.result == 8
@@ -0,0 +1,31 @@
+import warnings
+
+import pytest
+
+from ..planner import cleaning_bookings, plan_induction
+from ..scoring import build_features
+from .conftest import frames
+
+
+@pytest.mark.parametrize("bays,manpower", [(0, None), (None, 0), (0, 0)])
+def test_no_cleaning_capacity(fleet, bays, manpower):
+    args, kwargs = frames(fleet)
+    features = build_features(*args, **kwargs)
+    hours, _ = cleaning_bookings(args[4], features["train_id"].to_numpy())
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        ranked, _ = plan_induction(
+            features,
+            cleaning_hours=hours,
+            cleaning_bays=bays,
+            manpower=manpower,
+            time_budget=0.1,
+        )
+
+    service = ranked[ranked["role"] == "induct"]
+    assert len(service) > 0
+    assert ranked.attrs["cleaning_bay_hours"] == 0
+    assert ranked.attrs["cleaning_man_hours"] == 0
+    booked = dict(zip(features["train_id"], hours))
+    assert all(booked[t] == 0 for t in service["train_id"])
@@ -0,0 +1,54 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ..scoring import build_features, compute_scores, rank_top_k, rank_trains
+from .conftest import TRAINS, frames
+
+# Ranking of the test fleet recorded with the original row-wise pipeline
+BASELINE = os.path.join(os.path.dirname(__file__), "data", "baseline_ranking.csv")
+
+
+def ranked(fleet):
+    args, kwargs = frames(fleet)
+    features = build_features(*args, **kwargs)
+    return features, rank_trains(features)[0]
+
+
+def test_ranking_matches_baseline(fleet):
+    # The baseline predates bay conflicts, so every job gets its own bay
+    for stem in ("cleaning_schedule", "cleaning_schedule_prev"):
+        fleet[stem]["bay_id"] = "CL_" + fleet[stem]["train_id"]
+    baseline = pd.read_csv(BASELINE)
+    _, result = ranked(fleet)
+
+    assert result["train_id"].tolist() == baseline["train_id"].tolist()
+    np.testing.assert_allclose(
+        result["priority_score"].to_numpy(dtype=float),
+        baseline["priority_score"].to_numpy(),
+        rtol=0,
+        atol=1e-9,
+    )
+    assert result["eligible"].tolist() == baseline["eligible"].tolist()
+
+
+@pytest.mark.parametrize("k,standby", [(1, 0), (10, 3), (50, 5), (TRAINS, 5)])
+def test_top_k_matches_full_sort(fleet, k, standby):
+    features, full = ranked(fleet)
+    scores = compute_scores(features)
+    top, _ = rank_top_k(features, k, standby, scores=scores)
+
+    eligible = full[full["eligible"]]
+    expected = eligible["train_id"].tolist()[: k + standby]
+    assert top["train_id"].tolist() == expected
+    assert top["role"].tolist() == (
+        ["induct"] * min(k, len(expected)) + ["standby"] * max(0, len(expected) - k)
+    )
+    np.testing.assert_array_equal(
+        top["priority_score"].to_numpy(),
+        eligible["priority_score"].to_numpy()[: k + standby],
+    )
+    assert top.attrs["total_trains"] == len(full)
+    assert top.attrs["eligible_trains"] == len(eligible)
@@ -0,0 +1,72 @@
+import json
+import os
+
+import pytest
+
+from ..serialize import loads
+from ..snapshot import MANIFEST, SnapshotReader, publish
+
+pytest.importorskip("pyarrow")
+
+
+def body(rows):
+    content = {
+        "success": True,
+        "message": "Optimization completed successfully",
+        "total_trains": len(rows),
+        "eligible_trains": sum(r["eligible"] for r in rows),
+        "results": rows,
+    }
+    return json.dumps(content).encode(), content
+
+
+def rows(n):
+    return [
+        {
+            "train_id": f"SET_{i:03d}",
+            "priority_score": 1.0 - i / n,
+            "eligible": i % 3 != 0,
+        }
+        for i in range(n)
+    ]
+
+
+def test_round_trip(tmp_path):
+    encoded, content = body(rows(20))
+    version = publish(encoded, key="abc", root=str(tmp_path))
+
+    snapshot = SnapshotReader(str(tmp_path)).latest()
+    assert snapshot.version == version
+    assert snapshot.key == "abc"
+    assert bytes(snapshot.body) == encoded
+    assert loads(bytes(snapshot.body)) == content
+    assert snapshot.view()["results"] == content["results"]
+
+    page = snapshot.view(offset=5, limit=3, fields=["train_id"])
+    assert page["results"] == [
+        {"train_id": r["train_id"]} for r in content["results"][5:8]
+    ]
+
+
+def test_reader_follows_new_versions(tmp_path):
+    reader = SnapshotReader(str(tmp_path))
+    assert reader.latest() is None
+    publish(body(rows(3))[0], root=str(tmp_path))
+    first = reader.latest()
+    assert reader.latest() is first
+
+    encoded, _ = body(rows(5))
+    version = publish(encoded, root=str(tmp_path), keep=1)
+    assert reader.latest().version == version
+    assert bytes(reader.latest().body) == encoded
+    # The replaced mapping stays readable after its files are pruned
+    assert first.view()["total_trains"] == 3
+    assert len([n for n in os.listdir(tmp_path) if n.endswith(".arrow")]) == 1
+
+
+def test_missing_files_are_not_retried_forever(tmp_path):
+    version = publish(body(rows(3))[0], root=str(tmp_path))
+    os.unlink(os.path.join(tmp_path, version + ".arrow"))
+    with pytest.raises(FileNotFoundError):
+        SnapshotReader(str(tmp_path)).latest()
+    assert os.path.exists(os.path.join(tmp_path, MANIFEST))
@@ -0,0 +1,135 @@
+import pandas as pd
+import pytest
+
+from ..state import FleetState
+from .conftest import frames
+
+
+def full_state(fleet, **replaced):
+    args, kwargs = frames(fleet, **replaced)
+    return FleetState.from_frames(*args, **kwargs)
+
+
+def assert_same_state(state, expected):
+    pd.testing.assert_frame_equal(state.features, expected.features, check_dtype=False)
+    pd.testing.assert_frame_equal(state.scores, expected.scores, check_dtype=False)
+    pd.testing.assert_frame_equal(state.ranking()[0], expected.ranking()[0])
+
+
+def test_deltas_match_full_recompute(fleet):
+    state = full_state(fleet)
+
+    mileage = fleet["mileage_logs"]
+    latest = mileage.groupby("train_id").tail(1).head(5).copy()
+    latest["recorded_at"] = (
+        pd.to_datetime(latest["recorded_at"]) + pd.Timedelta(hours=3)
+    ).dt.strftime("%Y-%m-%dT%H:%M:%S")
+    latest["odometer_km"] += 500
+
+    orders = fleet["work_orders_maximo"]
+    opened = orders[orders["status"] == "open"].iloc[0]
+    events = [
+        {
+            "event": "close",
+            "wo_id": opened["wo_id"],
+            "closed_at": "2025-09-01T18:00:00",
+        },
+        {
+            "event": "create",
+            "wo_id": "WO_NEW",
+            "train_id": "SET_010",
+            "status": "open",
+            "estimated_hours": 6,
+        },
+    ]
+    closed = orders.copy()
+    row = closed["wo_id"] == opened["wo_id"]
+    closed.loc[row, "status"] = "closed"
+    closed.loc[row, "closed_at"] = "2025-09-01T18:00:00"
+    created = pd.DataFrame(
+        [{"wo_id": "WO_NEW", "train_id": "SET_010", "status": "open"}]
+    ).assign(estimated_hours=6)
+
+    certs = fleet["fitness_certificates"]
+    renewed = certs[certs["train_id"] == "SET_001"].copy()
+    renewed["valid_to"] = "2026-03-01T21:00:00"
+
+    jobs = fleet["cleaning_schedule"]
+    booked = jobs.iloc[:1].copy()
+    booked["train_id"] = "SET_020"
+
+    changed = state.apply(
+        {
+            "mileage_logs": latest,
+            "work_order_events": events,
+            "fitness_certificates": renewed,
+            "cleaning_schedule": booked,
+        }
+    )
+    assert state.version == 1
+    assert {"SET_001", "SET_010", "SET_020", opened["train_id"]} <= set(changed)
+
+    expected = full_state(
+        fleet,
+        mileage_logs=pd.concat([mileage, latest], ignore_index=True),
+        work_orders_maximo=pd.concat([closed, created], ignore_index=True),
+        fitness_certificates=pd.concat(
+            [certs.drop(renewed.index), renewed], ignore_index=True
+        ),
+        cleaning_schedule=pd.concat([jobs, booked], ignore_index=True),
+    )
+    assert_same_state(state, expected)
+
+
+def test_mileage_deltas_stay_in_one_segment(fleet):
+    state = full_state(fleet)
+    mileage = fleet["mileage_logs"]
+    deltas = []
+    for hours in (1, 2, 3):
+        delta = mileage.groupby("train_id").tail(1).head(3).copy()
+        delta["recorded_at"] = (
+            pd.to_datetime(delta["recorded_at"]) + pd.Timedelta(hours=hours)
+        ).dt.strftime("%Y-%m-%dT%H:%M:%S")
+        delta["odometer_km"] += 100 * hours
+        state.apply({"mileage_logs": delta})
+        deltas.append(delta)
+
+    assert len(state.mileage.store.segments) == 1
+    expected = full_state(
+        fleet, mileage_logs=pd.concat([mileage, *deltas], ignore_index=True)
+    )
+    assert_same_state(state, expected)
+
+
+def test_unknown_delta_feed(fleet):
+    state = full_state(fleet)
+    with pytest.raises(ValueError, match="Unknown delta feeds"):
+        state.apply({"odometers": pd.DataFrame()})
+
+
+def test_invalid_feed_rejects_whole_batch(fleet):
+    state = full_state(fleet)
+    expected = full_state(fleet)
+    mileage = fleet["mileage_logs"]
+    reading = mileage.groupby("train_id").tail(1).head(1).copy()
+    reading["odometer_km"] = 999999.0
+    events = [{"event": "create", "wo_id": "WO_NEW", "train_id": "SET_010"}]
+
+    with pytest.raises(ValueError, match="wo_id"):
+        state.apply(
+            {
+                "mileage_logs": reading,
+                "work_order_events": events,
+                "work_orders": pd.DataFrame(
+                    [{"train_id": "SET_001", "status": "open"}]
+                ),
+            }
+        )
+    assert state.version == 0
+    assert "WO_NEW" not in state.work_orders.orders
+    assert len(state.mileage.store) == len(mileage)
+    assert 999999.0 not in state.aggregates["mileage"]["cumulative_km"].to_numpy()
+
+    # Rebuilding from the kept aggregates shows none of the rejected rows
+    state._rebuild(state.features["train_id"].to_numpy())
+    assert_same_state(state, expected)
@@ -0,0 +1,79 @@
+import pytest
+
+from ..work_orders import CANCELLED, CLOSED, OPEN, WorkOrderIndex
+
+
+def create(wo_id="WO_1", status="open", hours=4):
+    return {
+        "event": "create",
+        "wo_id": wo_id,
+        "train_id": "SET_001",
+        "status": status,
+        "estimated_hours": hours,
+    }
+
+
+@pytest.fixture
+def index(fleet):
+    return WorkOrderIndex.from_frame(fleet["work_orders_maximo"])
+
+
+def test_index_matches_export(fleet, index):
+    orders = fleet["work_orders_maximo"]
+    opened = orders[orders["status"] == "open"]
+    expected = opened.groupby("train_id")["estimated_hours"].sum()
+    totals = index.totals()
+    assert totals["open_wo_hours"].to_dict() == expected.astype(float).to_dict()
+    assert not index.is_clear(opened["train_id"].iloc[0])
+
+
+def test_lifecycle(index):
+    index.apply([create(hours=4), create("WO_2", hours=2)])
+    before = index.open_hours("SET_001")
+    index.apply([{"event": "status_change", "wo_id": "WO_1", "status": "inprg"}])
+    assert index.open_hours("SET_001") == before
+    index.apply([{"event": "close", "wo_id": "WO_1"}])
+    assert index.orders["WO_1"][1] == CLOSED
+    assert index.open_hours("SET_001") == before - 4
+    # A closed order can be reopened
+    index.apply([{"event": "status_change", "wo_id": "WO_1", "status": "reopened"}])
+    assert index.orders["WO_1"][1] == OPEN
+    assert index.open_hours("SET_001") == before
+
+
+@pytest.mark.parametrize(
+    "events,message",
+    [
+        ([create(status="cancelled"), create()], "already exists"),
+        ([{"event": "close", "wo_id": "WO_MISSING"}], "Unknown work order"),
+        (
+            [
+                create(status="cancelled"),
+                {"event": "status_change", "wo_id": "WO_1", "status": "open"},
+            ],
+            f"cannot move from {CANCELLED} to {OPEN}",
+        ),
+        (
+            [
+                create(status="closed"),
+                {"event": "status_change", "wo_id": "WO_1", "status": "can"},
+            ],
+            f"cannot move from {CLOSED} to {CANCELLED}",
+        ),
+        ([{"event": "reopen", "wo_id": "WO_1"}], "Unknown event"),
+    ],
+)
+def test_illegal_events_are_rejected(index, events, message):
+    orders = dict(index.orders)
+    hours = dict(index.hours)
+    with pytest.raises(ValueError, match=message):
+        index.apply(events)
+    # A rejected batch leaves the index as it was
+    assert index.orders == orders
+    assert index.hours == hours
+
+
+def test_rejected_batch_applies_nothing(index):
+    with pytest.raises(ValueError, match="Event 2"):
+        index.apply([create(), {"event": "close", "wo_id": "WO_MISSING"}])
+    assert "WO_1" not in index.orders
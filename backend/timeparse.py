@@ -0,0 +1,124 @@
+"""Timestamp parsing with declared per-column formats.
+
+Every timestamp column the pipeline reads has a declared layout. A column
+whose values all have its declared `YYYY-MM-DDTHH:MM:SS` or `YYYY-MM-DD`
+layout is parsed in one pass by Arrow's ISO-8601 cast; the layout is
+checked first, since the cast alone accepts any ISO-8601 form. A column
+with any value off its layout falls back to parsing its distinct values only, with the
+declared format first and pandas' flexible ISO-8601 parser second, so
+repeated values such as shared certificate expiry dates are parsed once.
+
+Values that still do not parse become NaT and are counted as the
+enclosing span's `bad_rows`, which feeds `galactus_stage_bad_rows_total`
+and the profile reports.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .metrics import span
+
+ISO_SECONDS = "%Y-%m-%dT%H:%M:%S"
+ISO_DATE = "%Y-%m-%d"
+ISO8601 = "ISO8601"
+
+# Declared layout of each timestamp column read from the exports
+COLUMN_FORMATS = {
+    "valid_to": ISO_SECONDS,
+    "valid_from": ISO_SECONDS,
+    "start_date": ISO_DATE,
+    "end_date": ISO_DATE,
+    "scheduled_start": ISO_SECONDS,
+    "scheduled_end": ISO_SECONDS,
+    "recorded_at": ISO_SECONDS,
+    "created_at": ISO_SECONDS,
+    "closed_at": ISO_SECONDS,
+}
+ISO_FORMATS = {ISO_SECONDS, ISO_DATE, ISO8601}
+
+# Length and date/time separator of the fixed ISO layouts
+ISO_LAYOUTS = {ISO_SECONDS: (19, "T"), ISO_DATE: (10, None)}
+
+UNIT = "us"
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute  # noqa: F401
+    except ImportError:
+        return None
+    return pyarrow
+
+
+def _arrow_iso(values, fmt=ISO8601):
+    """Cast ISO-8601 text with Arrow; None unless every value parses.
+
+    For a fixed layout in `ISO_LAYOUTS` every value must also have that
+    layout's length and separator.
+    """
+    pa = _pyarrow()
+    if pa is None:
+        return None
+    try:
+        array = pa.array(values, from_pandas=True)
+        if not (pa.types.is_string(array.type) or pa.types.is_large_string(array.type)):
+            return None
+        if fmt in ISO_LAYOUTS and not _has_layout(pa, array, *ISO_LAYOUTS[fmt]):
+            return None
+        parsed = array.cast(pa.timestamp(UNIT))
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        return None
+    return parsed.to_numpy(zero_copy_only=False)
+
+
+def _has_layout(pa, array, length, separator):
+    """Whether every non-null string has `length` and `separator` at index 10"""
+    pc = pa.compute
+    bounds = pc.min_max(pc.utf8_length(array))
+    if bounds["min"].is_valid and (
+        bounds["min"].as_py() != length or bounds["max"].as_py() != length
+    ):
+        return False
+    if separator is None:
+        return True
+    marks = pc.utf8_slice_codeunits(array, 10, 11)
+    return pc.all(pc.equal(marks, separator)).as_py() is not False
+
+
+def _parse_distinct(values, fmt):
+    """Parse the distinct values once each; returns datetimes and the bad-row count"""
+    codes, uniques = pd.factorize(values, use_na_sentinel=True)
+    uniques = pd.Index(uniques, dtype=object)
+    parsed = pd.to_datetime(uniques, format=fmt, errors="coerce")
+    parsed = parsed.tz_localize(None) if parsed.tz is not None else parsed
+    parsed = parsed.as_unit(UNIT).to_numpy().copy()
+    retry = np.isnat(parsed)
+    if retry.any() and fmt != ISO8601:
+        again = pd.to_datetime(
+            uniques[retry], format=ISO8601, errors="coerce", utc=True
+        )
+        parsed[retry] = again.tz_localize(None).as_unit(UNIT).to_numpy()
+    out = np.full(len(codes), np.datetime64("NaT"), dtype=parsed.dtype)
+    known = codes >= 0
+    out[known] = parsed[codes[known]]
+    bad = int(np.isnat(out[known]).sum())
+    return out, bad
+
+
+def parse_timestamps(values, column=None, fmt=None):
+    """Parse timestamp text into datetime64 values, NaT where missing or bad.
+
+    `fmt` defaults to the declared format of `column`. Returns a Series
+    with the index of `values`; unparsable values are counted on a
+    `parse_<column>` span.
+    """
+    series = values if isinstance(values, pd.Series) else pd.Series(values)
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        return series
+    fmt = fmt or COLUMN_FORMATS.get(column, ISO8601)
+    with span(f"parse_{column or 'timestamps'}", rows=len(series)) as s:
+        parsed = _arrow_iso(series, fmt) if fmt in ISO_FORMATS else None
+        if parsed is None:
+            parsed, s.bad_rows = _parse_distinct(series, fmt)
+    return pd.Series(parsed, index=series.index, name=series.name)
@@ -0,0 +1,344 @@
+"""Maximo work-order states and a per-train index of open orders.
+
+Exported `status` values are mapped onto three states (open, closed,
+cancelled) through an explicit table; a status the table does not know
+is not open. Work-order events (create, status change, close) move an
+order between states along `TRANSITIONS` only, and `WorkOrderIndex`
+keeps the open orders of each train and their `estimated_hours`, so a
+train's open hours are a dictionary lookup instead of a scan of the
+export.
+
+Events are JSON objects, one per line in a JSONL feed:
+
+    {"event": "create", "wo_id": "WO_1", "train_id": "SET_001",
+     "status": "open", "estimated_hours": 4}
+    {"event": "status_change", "wo_id": "WO_1", "status": "inprg"}
+    {"event": "close", "wo_id": "WO_1", "closed_at": "2025-09-01T18:00:00"}
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+
+from .timeparse import parse_timestamps
+
+OPEN = "open"
+CLOSED = "closed"
+CANCELLED = "cancelled"
+STATES = pd.CategoricalDtype([OPEN, CLOSED, CANCELLED])
+
+# Normalised Maximo status -> state
+STATUS_STATES = {
+    "open": OPEN,
+    "reopened": OPEN,
+    "wappr": OPEN,
+    "waiting_approval": OPEN,
+    "appr": OPEN,
+    "approved": OPEN,
+    "wsch": OPEN,
+    "wmatl": OPEN,
+    "inprg": OPEN,
+    "in_progress": OPEN,
+    "comp": CLOSED,
+    "completed": CLOSED,
+    "close": CLOSED,
+    "closed": CLOSED,
+    "can": CANCELLED,
+    "canceled": CANCELLED,
+    "cancelled": CANCELLED,
+}
+
+# State -> states an order in it may move to (None: not yet created, or
+# indexed from an export with a status the table does not know)
+TRANSITIONS = {
+    None: {OPEN, CLOSED, CANCELLED},
+    OPEN: {OPEN, CLOSED, CANCELLED},
+    CLOSED: {OPEN, CLOSED},
+    CANCELLED: {CANCELLED},
+}
+
+CREATE = "create"
+STATUS_CHANGE = "status_change"
+CLOSE = "close"
+EVENTS = (CREATE, STATUS_CHANGE, CLOSE)
+
+
+def _normalise(status):
+    s = pd.Series(status, dtype=object).astype("string").str.lower().str.strip()
+    return s.str.replace(" ", "_").str.replace("-", "_")
+
+
+def order_states(status):
+    """Work-order state per status value, as a categorical (NaN if unknown)"""
+    codes, uniques = pd.factorize(pd.Series(status, dtype=object))
+    states = _normalise(uniques).map(STATUS_STATES).astype(STATES)
+    return pd.Series(
+        pd.Categorical.from_codes(
+            np.where(codes >= 0, states.cat.codes.to_numpy()[codes], -1), dtype=STATES
+        )
+    )
+
+
+def open_mask(status):
+    """Boolean array: which status values mean an open work order"""
+    return (order_states(status) == OPEN).to_numpy(dtype=bool, na_value=False)
+
+
+def state_of(status):
+    """State of one status value; ValueError if the status is unknown"""
+    state = STATUS_STATES.get(_normalise([status]).iloc[0])
+    if state is None:
+        raise ValueError(f"Unknown work-order status: {status!r}")
+    return state
+
+
+def _timestamp(value):
+    """An event timestamp, or None; ValueError if it cannot be parsed"""
+    if value is None or value == "":
+        return None
+    return pd.Timestamp(value)
+
+
+def _hours(value):
+    hours = pd.to_numeric(pd.Series([value]), errors="coerce").iloc[0]
+    return 0.0 if pd.isna(hours) else float(hours)
+
+
+def read_events(source):
+    """Work-order events from a JSONL path or file object"""
+    if isinstance(source, str):
+        with open(source, "rb") as fh:
+            return read_events(fh)
+    events = []
+    for number, line in enumerate(source, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            event = json.loads(line)
+        except ValueError as e:
+            raise ValueError(f"Line {number}: {str(e)}")
+        if not isinstance(event, dict):
+            raise ValueError(f"Line {number}: an event must be a JSON object")
+        events.append(event)
+    return events
+
+
+class WorkOrderIndex:
+    """Work orders by `wo_id`, and the open ones of each train.
+
+    `orders` maps `wo_id` to `(train_id, state, estimated_hours)`;
+    `open_orders` maps a train to its open orders' hours by `wo_id`, with
+    the train's totals cached in `hours`.
+    """
+
+    def __init__(self, planning_time=None):
+        self.planning_time = planning_time
+        self.orders = {}
+        self.open_orders = {}
+        self.hours = {}
+        self.last_closed = {}
+
+    @classmethod
+    def from_frame(cls, wo_df, planning_time=None):
+        """Index an export; later rows win on duplicate `wo_id`s"""
+        index = cls(planning_time)
+        if wo_df is not None and not wo_df.empty:
+            index.upsert(wo_df)
+        return index
+
+    def __len__(self):
+        return len(self.orders)
+
+    def copy(self):
+        """An index that can be updated without changing this one"""
+        index = WorkOrderIndex(self.planning_time)
+        index.orders = dict(self.orders)
+        index.open_orders = {t: dict(o) for t, o in self.open_orders.items()}
+        index.hours = dict(self.hours)
+        index.last_closed = dict(self.last_closed)
+        return index
+
+    # Queries
+
+    def open_hours(self, train_id):
+        """Estimated hours of a train's open work orders"""
+        return self.hours.get(train_id, 0.0)
+
+    def open_count(self, train_id):
+        return len(self.open_orders.get(train_id, ()))
+
+    def is_clear(self, train_id):
+        """No open work-order hours: the work-order half of eligibility"""
+        return self.open_hours(train_id) <= 0
+
+    def totals(self, trains=None):
+        """`open_wo_count` and `open_wo_hours` of the trains with open orders"""
+        trains = self.open_orders if trains is None else trains
+        rows = [t for t in trains if t in self.open_orders]
+        return pd.DataFrame(
+            {
+                "open_wo_count": [len(self.open_orders[t]) for t in rows],
+                "open_wo_hours": [self.hours[t] for t in rows],
+            },
+            index=pd.Index(rows, dtype=object, name="train_id"),
+        )
+
+    def maintenance(self):
+        """Latest `closed_at` per train, as a train-indexed Series"""
+        if not self.last_closed:
+            return None
+        return pd.Series(self.last_closed, name="last_maintenance").rename_axis(
+            "train_id"
+        )
+
+    # Updates
+
+    def _set(self, wo_id, train_id, state, hours, touched):
+        old = self.orders.get(wo_id)
+        if old is not None and old[1] == OPEN:
+            self.open_orders[old[0]].pop(wo_id, None)
+            touched.add(old[0])
+        self.orders[wo_id] = (train_id, state, hours)
+        if state == OPEN and train_id is not None:
+            self.open_orders.setdefault(train_id, {})[wo_id] = hours
+            touched.add(train_id)
+
+    def _closed(self, train_id, closed_at, touched):
+        if train_id is None or closed_at is None or pd.isna(closed_at):
+            return
+        closed_at = pd.Timestamp(closed_at)
+        if self.planning_time is not None and closed_at > self.planning_time:
+            return
+        last = self.last_closed.get(train_id)
+        if last is None or closed_at > last:
+            self.last_closed[train_id] = closed_at
+            touched.add(train_id)
+
+    def _total(self, trains):
+        for train in trains:
+            orders = self.open_orders.get(train)
+            if orders:
+                self.hours[train] = float(sum(orders.values()))
+            else:
+                self.open_orders.pop(train, None)
+                self.hours.pop(train, None)
+
+    def upsert(self, rows):
+        """Replace orders with export rows, keyed by `wo_id`.
+
+        Rows state an order as it now is, so they are not checked against
+        `TRANSITIONS`; rows without a `wo_id` column are keyed by position.
+        Returns the trains whose open orders or last maintenance changed.
+        """
+        n = len(rows)
+        ids = (
+            rows["wo_id"].to_numpy(dtype=object)
+            if "wo_id" in rows.columns
+            else np.array([f"row_{i}" for i in range(n)], dtype=object)
+        )
+        keep = ~pd.isna(ids)
+        train = rows["train_id"]
+        trains = train.astype(object).where(train.notna(), None).to_numpy()
+        states = order_states(rows["status"]).to_numpy(dtype=object, na_value=None)
+        hours = pd.to_numeric(rows["estimated_hours"], errors="coerce")
+        hours = np.nan_to_num(hours.to_numpy(dtype=float), nan=0.0)
+
+        touched = set()
+        if self.orders:
+            for wo_id, train_id, state, h in zip(
+                ids[keep], trains[keep], states[keep], hours[keep].tolist()
+            ):
+                self._set(wo_id, train_id, state, h, touched)
+        else:
+            self._load(ids[keep], trains[keep], states[keep], hours[keep], touched)
+
+        if "closed_at" in rows.columns:
+            closed_at = parse_timestamps(rows["closed_at"], "closed_at")
+            done = keep & (states == CLOSED) & train.notna().to_numpy()
+            done &= closed_at.notna().to_numpy()
+            if self.planning_time is not None:
+                done &= (closed_at <= self.planning_time).to_numpy()
+            latest = closed_at[done].groupby(trains[done]).max()
+            for train_id, last in latest.items():
+                self._closed(train_id, last, touched)
+        self._total(touched)
+        return touched
+
+    def _load(self, ids, trains, states, hours, touched):
+        """`_set` for every row, into an empty index"""
+        rows = np.flatnonzero(~pd.Series(ids).duplicated(keep="last").to_numpy())
+        self.orders = dict(
+            zip(
+                ids[rows].tolist(),
+                zip(trains[rows].tolist(), states[rows].tolist(), hours[rows].tolist()),
+            )
+        )
+        rows = rows[(states[rows] == OPEN) & pd.notna(trains[rows])]
+        for wo_id, train_id, h in zip(ids[rows], trains[rows], hours[rows].tolist()):
+            self.open_orders.setdefault(train_id, {})[wo_id] = h
+        touched.update(self.open_orders)
+
+    def apply(self, events):
+        """Apply work-order events in order; returns the trains touched.
+
+        The batch is checked before anything changes: an unknown order, a
+        duplicate create or a move `TRANSITIONS` does not allow raises
+        ValueError and leaves the index as it was.
+        """
+        pending = {}
+        for number, event in enumerate(events, 1):
+            try:
+                pending[event["wo_id"]] = self._check(event, pending)
+            except KeyError as e:
+                raise ValueError(f"Event {number}: missing {str(e)}")
+            except ValueError as e:
+                raise ValueError(f"Event {number}: {str(e)}")
+
+        touched = set()
+        for event in events:
+            wo_id = event["wo_id"]
+            train, state, hours = self._next(event, self.orders.get(wo_id))
+            self._set(wo_id, train, state, hours, touched)
+            if state == CLOSED:
+                closed_at = _timestamp(event.get("closed_at", event.get("at")))
+                self._closed(train, closed_at, touched)
+        self._total(touched)
+        return touched
+
+    def _check(self, event, pending):
+        kind = event.get("event")
+        if kind not in EVENTS:
+            raise ValueError(f"Unknown event {kind!r}; expected one of {EVENTS}")
+        wo_id = event["wo_id"]
+        current = pending.get(wo_id, self.orders.get(wo_id))
+        if kind == CREATE and current is not None:
+            raise ValueError(f"Work order {wo_id} already exists")
+        if kind != CREATE and current is None:
+            raise ValueError(f"Unknown work order {wo_id}")
+        after = self._next(event, current)
+        _timestamp(event.get("closed_at", event.get("at")))
+        before = None if current is None else current[1]
+        if after[1] not in TRANSITIONS[before]:
+            raise ValueError(
+                f"Work order {wo_id} cannot move from {before} to {after[1]}"
+            )
+        return after
+
+    @staticmethod
+    def _next(event, current):
+        """`(train_id, state, hours)` of an order after an event"""
+        kind = event["event"]
+        if kind == CREATE:
+            return (
+                event["train_id"],
+                state_of(event.get("status", OPEN)),
+                _hours(event.get("estimated_hours")),
+            )
+        train, state, hours = current
+        if "estimated_hours" in event:
+            hours = _hours(event["estimated_hours"])
+        if kind == CLOSE:
+            return train, CLOSED, hours
+        return train, state_of(event["status"]), hours
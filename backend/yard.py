@@ -0,0 +1,189 @@
+"""Stabling yard model: lines, slots and the shunting cost of an induction.
+
+Each stabling line is a dead-end track, left only past slot 0, or a
+through track, which can also be left from its far end. To pull a train
+out, every train still standing between it and the exit has to be moved
+out of the way (and put back); on a through track the cheaper end is
+used. Trains not listed in the stabling layout stand on a line of their
+own and never block anything.
+"""
+
+import numpy as np
+import pandas as pd
+
+DEAD_END = "dead_end"
+THROUGH = "through"
+TRACK_TYPES = (DEAD_END, THROUGH)
+
+
+def track_types(values):
+    """Normalise declared track types; anything but `through` is a dead end"""
+    t = pd.Series(values, dtype=object).astype(str).str.lower().str.strip()
+    t = t.str.replace(" ", "_").str.replace("-", "_")
+    return np.where(t.to_numpy() == THROUGH, THROUGH, DEAD_END).astype(object)
+
+
+def line_groups(line_id, trains):
+    """Dense line numbers; trains without a line each get one of their own"""
+    key = pd.Series(line_id, dtype=object).fillna(
+        pd.Series(np.asarray(trains, dtype=object))
+    )
+    groups, _ = pd.factorize(key, sort=True)
+    return groups.astype(np.int64)
+
+
+def _fill_free_slots(groups, slots):
+    """Give every unknown slot the lowest free index on its line, in row order.
+
+    The j-th missing slot on a line is `j + #{known k : k - rank(k) <= j}`,
+    where `rank` counts the distinct known slots below `k`.
+    """
+    known = ~np.isnan(slots)
+    out = np.where(known, slots, 0.0).astype(np.int64)
+    unknown = np.flatnonzero(~known)
+    if unknown.size == 0:
+        return out
+
+    taken = np.unique(np.stack([groups[known], out[known]], axis=1), axis=0)
+    tg, tk = taken[:, 0], taken[:, 1]
+    first = np.searchsorted(tg, tg, side="left")
+    gaps = tk - (np.arange(len(tg)) - first)
+
+    ug = groups[unknown]
+    order = np.argsort(ug, kind="stable")
+    sorted_g = ug[order]
+    j = np.arange(len(order)) - np.searchsorted(sorted_g, sorted_g, side="left")
+    nth = np.empty_like(j)
+    nth[order] = j
+
+    span = int(max(gaps.max(initial=0), nth.max(initial=0))) + 2
+    keys = tg * span + gaps
+    probe = ug * span + nth
+    below = np.searchsorted(keys, probe, side="right") - np.searchsorted(
+        keys, ug * span, side="left"
+    )
+    out[unknown] = nth + below
+    return out
+
+
+def assign_slots(groups, position, slot_idx, trains):
+    """Assign a slot index to every train within its stabling line.
+
+    Lines with at least one parsed slot keep the parsed slots and hand the
+    lowest free indices to the rest; lines without any are ordered by
+    position and train id.
+    """
+    slots = np.asarray(slot_idx, dtype=float)
+    has_known = np.zeros(groups.max() + 1 if len(groups) else 0, dtype=bool)
+    np.logical_or.at(has_known, groups, ~np.isnan(slots))
+    mixed = has_known[groups]
+
+    assigned = np.zeros(len(trains), dtype=np.int64)
+    if mixed.any():
+        assigned[mixed] = _fill_free_slots(groups[mixed], slots[mixed])
+    if (~mixed).any():
+        sub = pd.DataFrame(
+            {
+                "g": groups[~mixed],
+                "position": np.asarray(position, dtype=object)[~mixed],
+                "train_id": np.asarray(trains, dtype=object)[~mixed],
+            }
+        )
+        ordered = sub.sort_values(["g", "position", "train_id"], kind="stable")
+        rank = ordered.groupby("g").cumcount()
+        assigned[np.flatnonzero(~mixed)] = rank.reindex(sub.index).to_numpy()
+    return assigned
+
+
+class Yard:
+    """Trains on stabling lines, in the row order of the fleet.
+
+    `groups` numbers each train's line, `slots` its slot on the line
+    (slot 0 next to the exit) and `track_type` what kind of track the
+    line is; a line with any `through` entry counts as a through track.
+    """
+
+    def __init__(self, groups, slots, track_type=None):
+        groups = np.asarray(groups, dtype=np.int64)
+        slots = np.asarray(slots, dtype=np.int64)
+        n = len(groups)
+        through = np.zeros(n, dtype=bool)
+        if track_type is not None and n:
+            per_line = np.zeros(groups.max() + 1, dtype=bool)
+            np.logical_or.at(per_line, groups, track_types(track_type) == THROUGH)
+            through = per_line[groups]
+        self.through = through
+
+        # Every train's place in the yard sorted by line and slot, and the
+        # range of places its line occupies
+        order = np.lexsort((slots, groups))
+        sorted_groups = groups[order]
+        self.place = np.empty(n, dtype=np.int64)
+        self.place[order] = np.arange(n)
+        self.line_start = np.empty(n, dtype=np.int64)
+        self.line_start[order] = np.searchsorted(sorted_groups, sorted_groups, "left")
+        self.line_stop = np.empty(n, dtype=np.int64)
+        self.line_stop[order] = np.searchsorted(sorted_groups, sorted_groups, "right")
+
+    @classmethod
+    def from_features(cls, features):
+        """The yard described by a feature frame's stabling columns"""
+        track_type = features["track_type"] if "track_type" in features else None
+        groups = line_groups(features["line_id"], features["train_id"])
+        return cls(groups, features["slot_assigned"].to_numpy(), track_type)
+
+    def __len__(self):
+        return len(self.place)
+
+    def ahead(self):
+        """Trains between each train and the exit of its line"""
+        return self.place - self.line_start
+
+    def behind(self):
+        """Trains between each train and the far end of its line"""
+        return self.line_stop - self.place - 1
+
+    def blockers(self):
+        """Shunt moves to pull each train out of a full yard"""
+        ahead = self.ahead()
+        return np.where(self.through, np.minimum(ahead, self.behind()), ahead)
+
+    def shunt_moves(self, order):
+        """Shunt moves to pull out the trains at row positions `order`, in turn.
+
+        Trains pulled out earlier no longer block the later ones; trains
+        not in `order` stay where they are. Returns the moves per step.
+        """
+        order = np.asarray(order, dtype=np.int64)
+        if len(np.unique(order)) != len(order):
+            raise ValueError("A train can only be pulled out once")
+        place = self.place[order]
+        start = self.line_start[order]
+        stop = self.line_stop[order]
+
+        # Fenwick tree over yard places counting the trains already gone
+        tree = [0] * (len(self) + 1)
+
+        def gone(upto):
+            total = 0
+            while upto > 0:
+                total += tree[upto]
+                upto &= upto - 1
+            return total
+
+        gone_ahead = np.zeros(len(order), dtype=np.int64)
+        gone_behind = np.zeros(len(order), dtype=np.int64)
+        for step, (p, lo, hi) in enumerate(
+            zip(place.tolist(), start.tolist(), stop.tolist())
+        ):
+            before = gone(p)
+            gone_ahead[step] = before - gone(lo)
+            gone_behind[step] = gone(hi) - gone(p + 1)
+            i = p + 1
+            while i < len(tree):
+                tree[i] += 1
+                i += i & -i
+
+        ahead = self.ahead()[order] - gone_ahead
+        behind = self.behind()[order] - gone_behind
+        return np.where(self.through[order], np.minimum(ahead, behind), ahead)